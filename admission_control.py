@@ -0,0 +1,156 @@
+"""
+按接口类别的准入控制中间件
+每类接口有独立的并发上限和有界等待队列，某一类打满时只影响该类：
+导出、统计等重查询排满时，房源列表和详情等轻量接口仍然走自己的并发额度。
+等待队列已满或等待超时的请求立即返回 503 并带 Retry-After，不在事件循环和连接池上堆积
+
+每类的参数可以用环境变量覆盖（CLASS为类别名大写）：
+    ADMISSION_<CLASS>_CONCURRENCY  同时处理的请求数
+    ADMISSION_<CLASS>_QUEUE        超出并发时允许排队等待的请求数
+    ADMISSION_<CLASS>_WAIT         排队最长等待秒数
+    ADMISSION_<CLASS>_RETRY_AFTER  拒绝时 Retry-After 建议的秒数
+ADMISSION_CONTROL=off 时关闭准入控制
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+import metrics
+
+logger = logging.getLogger("admission_control")
+
+ENABLED = os.getenv("ADMISSION_CONTROL", "on").lower() not in ("off", "false", "0")
+
+# 不做准入控制的路径：监控、长连接事件流和性能采样需要在系统繁忙时仍然可用
+EXEMPT_PATHS = re.compile(r"^/(metrics|events/stream|admin/profile)(/|$)")
+
+# (类别, 路径规则, 并发, 队列, 等待秒数, Retry-After秒数)，按顺序匹配，都不匹配时归入default
+ENDPOINT_CLASSES = [
+    ("export", r"^/(export/|settings/export)", 2, 2, 2, 30),
+    ("image", r"^/proxy/image", 8, 16, 1, 2),
+    ("heavy", r"^/(statistics/|dashboard|houses/count|analysis/results|settings/info|admin/)", 4, 16, 3, 5),
+]
+DEFAULT_CLASS = ("default", None, 32, 128, 5, 1)
+
+
+class EndpointLimiter:
+    """一类接口的并发额度和有界等待队列，只在事件循环线程中使用"""
+
+    def __init__(self, name, concurrency, max_queue, max_wait, retry_after):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def acquire(self):
+        """
+        获取并发额度
+
+        Returns:
+            str: admitted 已获取；queue_full 队列已满；timeout 等待超时
+        """
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                return "queue_full"
+            self.waiting += 1
+            metrics.ADMISSION_WAITING.labels(endpoint_class=self.name).inc()
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                return "timeout"
+            finally:
+                self.waiting -= 1
+                metrics.ADMISSION_WAITING.labels(endpoint_class=self.name).dec()
+                metrics.ADMISSION_WAIT_SECONDS.labels(endpoint_class=self.name).observe(
+                    time.perf_counter() - start
+                )
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        metrics.ADMISSION_IN_FLIGHT.labels(endpoint_class=self.name).inc()
+        return "admitted"
+
+    def release(self):
+        self.in_flight -= 1
+        metrics.ADMISSION_IN_FLIGHT.labels(endpoint_class=self.name).dec()
+        self._semaphore.release()
+
+
+def _env_number(name, field, default):
+    value = os.getenv(f"ADMISSION_{name.upper()}_{field}")
+    return type(default)(value) if value else default
+
+
+def build_limiters():
+    """根据ENDPOINT_CLASSES和环境变量创建各类接口的限流器，返回[(路径规则, 限流器)]和默认限流器"""
+    def make(name, concurrency, max_queue, max_wait, retry_after):
+        return EndpointLimiter(
+            name,
+            _env_number(name, "CONCURRENCY", concurrency),
+            _env_number(name, "QUEUE", max_queue),
+            _env_number(name, "WAIT", float(max_wait)),
+            _env_number(name, "RETRY_AFTER", retry_after),
+        )
+
+    rules = [(re.compile(pattern), make(name, *limits)) for name, pattern, *limits in ENDPOINT_CLASSES]
+    name, _, *limits = DEFAULT_CLASS
+    return rules, make(name, *limits)
+
+
+class AdmissionControlMiddleware:
+    """按路径把请求归类，获取该类的并发额度后再交给应用处理，饱和时返回503"""
+
+    def __init__(self, app):
+        self.app = app
+        self.rules, self.default = build_limiters()
+        for limiter in [limiter for _, limiter in self.rules] + [self.default]:
+            logger.info(f"接口类别 {limiter.name}: 并发 {limiter.concurrency}，排队 {limiter.max_queue}，"
+                        f"最长等待 {limiter.max_wait} 秒")
+
+    def classify(self, path):
+        for pattern, limiter in self.rules:
+            if pattern.match(path):
+                return limiter
+        return self.default
+
+    async def __call__(self, scope, receive, send):
+        if (not ENABLED or scope["type"] != "http" or scope.get("method") == "OPTIONS"
+                or EXEMPT_PATHS.match(scope.get("path", ""))):
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.classify(scope.get("path", ""))
+        outcome = await limiter.acquire()
+        metrics.ADMISSION_REQUESTS.labels(endpoint_class=limiter.name, outcome=outcome).inc()
+        if outcome != "admitted":
+            logger.warning(f"接口类别 {limiter.name} 已饱和（{outcome}），拒绝请求 {scope.get('path')}，"
+                           f"执行中 {limiter.in_flight}，排队 {limiter.waiting}")
+            await self._reject(send, limiter)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    @staticmethod
+    async def _reject(send, limiter):
+        body = json.dumps({"detail": "服务器繁忙，请稍后重试"}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(limiter.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,61 @@
+"""
+分析worker
+角色分离部署（TASK_DISPATCH=database）时的数据分析进程入口：
+从 jobs 队列认领analysis任务，在本进程中用PySpark执行分析并保存结果。
+同时处理maintenance类维护任务。
+Spark的CPU和内存开销不再影响API响应
+
+用法:
+    python analysis_worker.py
+"""
+import os
+import signal
+import logging
+import threading
+
+import task_dispatch
+import job_queue
+import metrics
+import sampling_profiler
+# worker启动时就加载PySpark依赖，避免第一个分析任务承担导入开销
+import data_processor  # noqa: F401
+
+logger = logging.getLogger("analysis_worker")
+
+# 没有请求时的轮询间隔（秒）
+POLL_INTERVAL = float(os.getenv("ANALYSIS_POLL_INTERVAL", "5"))
+# 指标导出端口
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9102"))
+
+_stop_event = threading.Event()
+
+
+def _handle_stop(signum, frame):
+    logger.info("收到停止信号，当前分析结束后退出")
+    _stop_event.set()
+
+
+def run():
+    name = task_dispatch.worker_name("analysis")
+    logger.info(f"分析worker {name} 启动")
+
+    signal.signal(signal.SIGTERM, _handle_stop)
+    signal.signal(signal.SIGINT, _handle_stop)
+    sampling_profiler.install_signal_handler()
+    metrics.start_worker_metrics_server(METRICS_PORT)
+    task_dispatch.install_event_forwarder()
+
+    job_queue.run_worker(
+        ["analysis", "maintenance"],
+        {"analysis": task_dispatch.run_analysis_job, "maintenance": task_dispatch.run_maintenance_job},
+        name,
+        _stop_event,
+        poll_interval=POLL_INTERVAL,
+        visibility_timeout=task_dispatch.ANALYSIS_VISIBILITY_TIMEOUT
+    )
+
+    logger.info(f"分析worker {name} 已退出")
+
+
+if __name__ == "__main__":
+    run()
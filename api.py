@@ -5,29 +5,23 @@ import json
 import logging
 import datetime
 import base64
+import hashlib
 import requests
 from typing import List, Dict, Optional, Any
-import pandas as pd
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Depends, Request, Response
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import verification_manager
-import selenium_spider
 import time
-import threading
-from selenium import webdriver
 import shutil
-import schedule
-import calendar
 import traceback
 from datetime import timedelta
 import asyncio
 import io
-from PIL import Image
 import csv
 from urllib.parse import quote
 
@@ -37,12 +31,26 @@ load_dotenv()
 
 # 导入爬虫和数据处理模块
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-import selenium_spider as spider
-import data_processor
+# 爬虫（DrissionPage/OpenCV）只在第一次使用时导入，数据分析（PySpark/pandas）由任务队列的worker加载，
+# 只提供HTTP服务的进程不需要承担这部分启动时间和内存
+from lazy_loader import lazy_import
+spider = lazy_import("selenium_spider")
+from cities import get_supported_cities, get_city_code
 import auth_secure as auth  # 使用加密版的认证模块
 import ip_manager  # 导入IP管理模块
 import db_config    # 导入数据库配置模块
 import security_utils  # 导入安全工具模块
+import image_cache  # 导入图片缓存模块
+import response_compression  # 导入响应压缩中间件
+import admission_control  # 导入准入控制中间件
+import event_bus  # 导入进度事件总线
+import metrics  # 导入监控指标
+import sql_timing  # 导入SQL计时
+import slow_query_log  # 导入慢查询日志
+import sampling_profiler  # 导入采样分析器
+import task_dispatch  # 导入任务分发
+import job_queue  # 导入持久化任务队列
+import scheduler  # 导入定时任务调度器
 
 # 记录应用启动时间
 start_time_seconds = time.time()
@@ -50,9 +58,6 @@ start_time_seconds = time.time()
 # 在文件顶部附近，定义全局启动时间常量
 start_time = datetime.datetime.now()
 
-# 全局变量声明
-RUNNING_ANALYSIS_TASKS = 0
-
 # 数据库连接池配置
 api_connection_pool_params = {
     "maxconn": 10,  # 默认最大连接数
@@ -100,20 +105,6 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# 配置FastAPI处理JSON响应时使用自定义编码器
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:8080",  # 开发环境前端
-        "http://localhost:80",    # 生产环境前端
-        "http://127.0.0.1:8080",  # 本地开发
-        "http://127.0.0.1:80",    # 本地生产
-    ],  # 只允许特定域名，提高安全性
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-)
-
 # 自定义JSON响应处理
 @app.middleware("http")
 async def custom_json_serialization(request: Request, call_next):
@@ -138,6 +129,39 @@ async def custom_json_serialization(request: Request, call_next):
     
     return response
 
+# 按接口类别的准入控制：导出、统计等重接口有独立的并发上限，饱和时快速返回503，
+# 不占用轻量接口的事件循环和数据库连接；注册在指标中间件内侧，503也计入请求指标
+app.add_middleware(admission_control.AdmissionControlMiddleware)
+
+# 跨域配置注册在准入控制外层，准入控制快速返回的503同样带CORS响应头，
+# 前端可以读取状态码和Retry-After，而不是看到跨域错误
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[
+        "http://localhost:8080",  # 开发环境前端
+        "http://localhost:80",    # 生产环境前端
+        "http://127.0.0.1:8080",  # 本地开发
+        "http://127.0.0.1:80",    # 本地生产
+    ],  # 只允许特定域名，提高安全性
+    allow_credentials=True,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["*"],
+    expose_headers=["Retry-After"],
+)
+
+# 后注册的中间件位于外层，从外到内依次为：SQL耗时、请求指标、响应压缩、CORS、准入控制、JSON序列化
+
+# 响应压缩：按Accept-Encoding协商br/gzip，超过COMPRESSION_MIN_SIZE字节才压缩
+# 位于CORS、准入控制和JSON序列化外层，压缩的是它们处理后的最终响应
+app.add_middleware(response_compression.CompressionMiddleware)
+
+# 请求耗时指标，位于压缩外层以包含压缩的耗时
+app.add_middleware(metrics.MetricsMiddleware)
+
+# 每个请求的SQL查询次数和数据库耗时，输出到Server-Timing响应头和 logs/access.log
+# 最后注册，位于最外层，统计范围覆盖所有中间件中执行的查询
+app.add_middleware(sql_timing.SQLTimingMiddleware)
+
 # 注册认证路由
 app.include_router(auth.router)
 
@@ -150,10 +174,8 @@ DB_CONFIG = {
     "database": os.getenv("DB_NAME", "rental_analysis")
 }
 
-# 创建API专用的数据库连接池
-api_connection_pool = db_config.create_api_pool()
-if not api_connection_pool:
-    logger.error("无法创建API数据库连接池，程序可能无法正常工作")
+# API专用的数据库连接池，在startup事件中建立连接
+api_connection_pool = db_config.LazyPool(db_config.create_api_pool, "API服务")
 
 def get_db_connection():
     """从API连接池获取数据库连接，并确保使用后正确归还"""
@@ -186,8 +208,9 @@ def get_db_connection():
         logger.error(f"API服务数据库连接失败: {str(e)}")
         # 记录当前连接池状态
         try:
-            if 'api_connection_pool' in globals():
-                conn_info = f"连接池信息: 大小={api_connection_pool.size()}, 使用中={api_connection_pool.used}"
+            if api_connection_pool.initialized:
+                usage = db_config.get_pool_usage(api_connection_pool.get_pool())
+                conn_info = f"连接池信息: 最大={usage['max']}, 使用中={usage['in_use']}, 空闲={usage['idle']}"
                 logger.error(conn_info)
         except:
             pass
@@ -216,17 +239,15 @@ async def shutdown_event():
     """应用关闭时执行清理工作"""
     logger.info("应用关闭，清理资源...")
     
+    # 停止定时任务调度线程，释放leader锁
+    scheduler.stop()
+    
     # 关闭API连接池
-    if 'api_connection_pool' in globals() and api_connection_pool:
+    if api_connection_pool.initialized:
         logger.info("正在关闭API数据库连接池...")
         try:
             # 关闭所有连接
-            for i in range(api_connection_pool.maxconn):
-                try:
-                    conn = api_connection_pool.getconn()
-                    conn.close()
-                except:
-                    pass
+            api_connection_pool.closeall()
             logger.info("API数据库连接池已关闭")
         except Exception as e:
             logger.error(f"关闭API数据库连接池时出错: {str(e)}")
@@ -284,6 +305,14 @@ class AnalysisResult(BaseModel):
     analysis_time: datetime.datetime
     result_data: Any
 
+class AnalysisIndexEntry(BaseModel):
+    id: int
+    analysis_type: str
+    city: Optional[str] = None
+    analysis_time: datetime.datetime
+    row_count: Optional[int] = None
+    byte_size: Optional[int] = None
+
 # 系统设置模型
 class DatabaseSettings(BaseModel):
     host: str
@@ -324,7 +353,7 @@ STARTUP_TIME = datetime.datetime.now()
 # 后台任务：爬取数据
 def crawl_data_task(city: str, max_pages: int):
     try:
-        cities = spider.get_supported_cities()
+        cities = get_supported_cities()
         city_code = cities.get(city)
         
         if not city_code:
@@ -338,70 +367,113 @@ def crawl_data_task(city: str, max_pages: int):
     except Exception as e:
         logger.error(f"爬取任务执行失败: {str(e)}")
 
-# 后台任务：分析数据
-def analyze_data_task(city: Optional[str] = None, task_id: Optional[int] = None):
-    try:
-        logger.info(f"开始数据分析任务，城市: {city}, 任务ID: {task_id}")
-        
-        # 使用上下文管理器确保适当的连接池管理
-        processor = None
-        try:
-            # 创建处理器时传入连接配置
-            processor = data_processor.RentalDataProcessor(DB_CONFIG)
-            
-            # 加载数据 - 使用独立的try块来处理可能的加载错误
-            df = None
-            try:
-                df = processor.load_data_from_db(city=city, task_id=task_id)
-            except Exception as load_err:
-                logger.error(f"加载数据失败: {str(load_err)}")
-                raise
-                
-            if df is not None:
-                # 执行分析
-                results = processor.run_all_analysis(df, city=city)
-                logger.info(f"数据分析完成，城市: {city}, 任务ID: {task_id}")
-            else:
-                logger.warning(f"没有找到数据进行分析，城市: {city}, 任务ID: {task_id}")
-        
-        except Exception as proc_err:
-            logger.error(f"处理数据时出错: {str(proc_err)}")
-            raise
-            
-        finally:
-            # 确保无论如何都关闭Spark会话和连接
-            if processor:
-                try:
-                    processor.close()
-                    logger.info("数据处理器资源已释放")
-                except Exception as close_err:
-                    logger.error(f"关闭数据处理器失败: {str(close_err)}")
-    
-    except Exception as e:
-        logger.error(f"分析任务执行失败: {str(e)}")
-        logger.error(f"错误详情: {traceback.format_exc()}")
-    
-    finally:
-        # 强制进行垃圾回收，释放资源
-        import gc
-        gc.collect()
-        logger.info("数据分析任务资源清理完成")
-
 # API路由
 
 @app.get("/")
 async def read_root():
     return {"message": "租房数据分析系统API", "status": "运行中"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """导出Prometheus格式的监控指标"""
+    if metrics.METRICS_TOKEN:
+        authorization = request.headers.get("authorization", "")
+        if authorization != f"Bearer {metrics.METRICS_TOKEN}":
+            raise HTTPException(status_code=401, detail="无效的监控令牌")
+    content, content_type = metrics.render_latest()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/admin/slow-queries", response_model=List[Dict[str, Any]])
+async def get_slow_queries(
+    sort_by: str = Query("total_ms", description="排序字段: total_ms, max_ms, avg_ms, count, last_seen"),
+    limit: int = Query(50, ge=1, le=500),
+    auth_user: dict = Depends(auth.get_current_user)
+):
+    """按指纹汇总的慢查询列表"""
+    if not auth_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="只有管理员可以查看慢查询")
+    return slow_query_log.list_entries(sort_by=sort_by, limit=limit)
+
+@app.get("/admin/slow-queries/{fingerprint}", response_model=Dict[str, Any])
+async def get_slow_query_detail(fingerprint: str, auth_user: dict = Depends(auth.get_current_user)):
+    """单个慢查询指纹的详情，包含采集到的执行计划"""
+    if not auth_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="只有管理员可以查看慢查询")
+    entry = slow_query_log.get_entry(fingerprint)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="未找到该慢查询")
+    return entry
+
+@app.delete("/admin/slow-queries", response_model=Dict[str, str])
+async def clear_slow_queries(auth_user: dict = Depends(auth.get_current_user)):
+    """清空慢查询汇总，日志文件保留"""
+    if not auth_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="只有管理员可以清空慢查询")
+    slow_query_log.clear()
+    return {"message": "慢查询汇总已清空"}
+
+@app.get("/admin/profile")
+async def profile_process(
+    seconds: float = Query(10, gt=0, le=sampling_profiler.MAX_SECONDS, description="采样时长（秒）"),
+    interval_ms: int = Query(sampling_profiler.DEFAULT_INTERVAL_MS, ge=1, le=1000, description="采样间隔（毫秒）"),
+    thread: Optional[str] = Query(None, description="只采样名称包含该字符串的线程，如 crawl-、analysis-、AnyIO worker"),
+    lines: bool = Query(False, description="帧名称是否包含行号"),
+    auth_user: dict = Depends(auth.get_current_user)
+):
+    """
+    对API进程（包括其中运行的爬虫和分析线程）采样，返回collapsed格式的调用栈，
+    可直接用 flamegraph.pl 或 speedscope 生成火焰图
+    """
+    if not auth_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="只有管理员可以执行性能采样")
+    try:
+        collapsed, rounds = await asyncio.to_thread(
+            sampling_profiler.sample, seconds, interval_ms, thread, lines
+        )
+    except sampling_profiler.ProfilerBusyError:
+        raise HTTPException(status_code=409, detail="已有采样正在进行，请稍后再试")
+    logger.info(f"管理员 {auth_user.get('username')} 完成 {seconds} 秒性能采样，共 {rounds} 轮")
+    filename = f"profile-{os.getpid()}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.collapsed"
+    return Response(
+        content=collapsed,
+        media_type="text/plain; charset=utf-8",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Profile-Samples": str(rounds),
+        }
+    )
+
+@app.get("/admin/jobs", response_model=List[Dict[str, Any]])
+async def get_jobs(
+    kind: Optional[str] = Query(None, description="任务类型: crawl, analysis, export, maintenance"),
+    status: Optional[str] = Query(None, description="任务状态: queued, running, completed, dead"),
+    limit: int = Query(50, ge=1, le=500),
+    auth_user: dict = Depends(auth.get_current_user)
+):
+    """查看持久化任务队列中的任务，包括重试次数和死信的错误信息"""
+    if not auth_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="只有管理员可以查看任务队列")
+    return await asyncio.to_thread(job_queue.list_jobs, kind, status, limit)
+
+@app.post("/admin/jobs/{job_id}/retry", response_model=Dict[str, str])
+async def retry_job(job_id: int, auth_user: dict = Depends(auth.get_current_user)):
+    """把死信任务重新排队"""
+    if not auth_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="只有管理员可以重试任务")
+    if not await asyncio.to_thread(job_queue.retry_job, job_id):
+        raise HTTPException(status_code=404, detail="未找到该死信任务")
+    logger.info(f"管理员 {auth_user.get('username')} 重新排队死信任务 {job_id}")
+    return {"message": f"任务 {job_id} 已重新排队"}
+
 @app.get("/cities", response_model=Dict[str, str])
 async def get_cities():
     """获取支持的城市列表"""
-    return spider.get_supported_cities()
+    return get_supported_cities()
 
 @app.post("/tasks/crawl", response_model=CrawlTaskStatus)
-async def create_crawl_task(task_info: CrawlTaskCreate, background_tasks: BackgroundTasks, auth_user: dict = Depends(auth.get_current_user)):
+async def create_crawl_task(task_info: CrawlTaskCreate, auth_user: dict = Depends(auth.get_current_user)):
     """创建并执行新的爬虫任务"""
-    cities = spider.get_supported_cities()
+    cities = get_supported_cities()
     
     if task_info.city not in cities:
         raise HTTPException(status_code=400, detail="不支持的城市")
@@ -428,9 +500,8 @@ async def create_crawl_task(task_info: CrawlTaskCreate, background_tasks: Backgr
     
     logger.info(f"用户 {auth_user.get('username', 'unknown')} 创建爬虫任务成功，ID: {task_id}，城市: {task_info.city}，预期房源数: {expected_houses}，计划页数: {task_info.max_pages}")
     
-    # 在后台执行爬虫任务，确保传递已创建的task_id
-    background_tasks.add_task(spider.crawl_city_with_selenium, 
-                             task_info.city, city_code, task_info.max_pages, task_id)
+    # 放入jobs队列，由API进程内的爬虫线程或角色分离部署时的爬虫worker认领执行
+    task_dispatch.dispatch_crawl(task_id, task_info.max_pages)
     
     # 查询并返回任务状态
     with DBConnectionManager() as conn:
@@ -601,6 +672,31 @@ async def get_task(task_id: int, auth_user: dict = Depends(auth.get_current_user
         logger.error(f"获取任务详情失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取任务详情失败: {str(e)}")
 
+@app.get("/tasks/{task_id}/image-prefetch")
+async def get_task_image_prefetch(task_id: int, auth_user: dict = Depends(auth.get_current_user)):
+    """获取爬虫任务的缩略图预取进度"""
+    try:
+        with DBConnectionManager() as conn:
+            if not table_exists(conn, "image_prefetch_status"):
+                raise HTTPException(status_code=404, detail=f"任务 {task_id} 没有图片预取记录")
+            
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("SELECT * FROM image_prefetch_status WHERE task_id = %s", (task_id,))
+            status = cursor.fetchone()
+            
+            if not status:
+                raise HTTPException(status_code=404, detail=f"任务 {task_id} 没有图片预取记录")
+            
+            finished = status["done"] + status["cached"] + status["failed"]
+            status["pending"] = max(0, status["queued"] - finished)
+            status["progress"] = round(finished / status["queued"] * 100, 1) if status["queued"] else 100
+            return status
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取图片预取进度失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取图片预取进度失败: {str(e)}")
+
 @app.get("/houses", response_model=List[HouseInfo])
 async def get_houses(
     city: Optional[str] = None,
@@ -824,73 +920,150 @@ async def get_house(house_id: str):
         logger.error(f"获取房源详情失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取房源详情失败: {str(e)}")
 
-@app.post("/analysis/run", response_model=Dict[str, str])
-async def run_analysis(analysis_req: AnalysisRequest, background_tasks: BackgroundTasks, auth_user: dict = Depends(auth.get_current_user)):
-    """运行数据分析任务"""
+@app.post("/analysis/run", response_model=Dict[str, Any])
+async def run_analysis(analysis_req: AnalysisRequest, auth_user: dict = Depends(auth.get_current_user)):
+    """
+    提交数据分析任务
+
+    分析任务进入任务队列，由分析worker（单进程部署时为API进程内的worker线程）依次执行；
+    同一城市已有排队中的分析时合并为一次，页面上手动发起的分析优先于爬取完成后触发的分析
+    """
     try:
-        # 使用全局变量跟踪正在运行的分析任务数量
-        global RUNNING_ANALYSIS_TASKS
-        
-        # 限制同时运行的分析任务数量
-        max_concurrent_tasks = 1  # 同时只允许一个分析任务
-        
-        if RUNNING_ANALYSIS_TASKS >= max_concurrent_tasks:
-            logger.warning(f"已有{RUNNING_ANALYSIS_TASKS}个分析任务正在运行，拒绝新的请求")
-            return {"status": "rejected", "message": "系统正在进行数据分析，请稍后再试"}
-        
-        # 增加运行任务计数
-        RUNNING_ANALYSIS_TASKS += 1
-        logger.info(f"用户 {auth_user.get('username', 'unknown')} 启动分析任务，当前运行的分析任务数量: {RUNNING_ANALYSIS_TASKS}")
-        
-        # 定义一个包装函数，确保任务完成后减少计数
-        async def run_analysis_with_cleanup(city, task_id):
-            # 在内部函数顶部立即声明 global
-            global RUNNING_ANALYSIS_TASKS
-            
-            try:
-                # 执行实际分析任务
-                await asyncio.to_thread(analyze_data_task, city, task_id)
-            finally:
-                # 无论任务成功与否，都减少计数
-                RUNNING_ANALYSIS_TASKS -= 1
-                logger.info(f"分析任务完成，当前运行任务数量: {RUNNING_ANALYSIS_TASKS}")
-        
-        # 启动后台分析任务
-        background_tasks.add_task(
-            run_analysis_with_cleanup, 
-            analysis_req.city, 
-            analysis_req.task_id
+        result = await asyncio.to_thread(
+            task_dispatch.enqueue_analysis,
+            analysis_req.city,
+            analysis_req.task_id,
+            "manual",
+            auth_user.get("username")
         )
-        
-        logger.info(f"已启动数据分析任务，城市: {analysis_req.city}, 任务ID: {analysis_req.task_id}")
-        return {"status": "success", "message": "数据分析任务已启动"}
+        logger.info(f"用户 {auth_user.get('username', 'unknown')} 提交分析任务，城市: {analysis_req.city}, "
+                    f"任务ID: {analysis_req.task_id}, 结果: {result}")
+        if result["coalesced"]:
+            message = "该城市已有排队中的分析任务，本次请求已合并"
+        elif result["queue_position"]:
+            message = f"数据分析任务已提交，排队位置: {result['queue_position']}"
+        else:
+            message = "数据分析任务已提交"
+        return {"status": "success", "message": message, **result}
     except Exception as e:
-        logger.error(f"启动数据分析任务失败: {str(e)}")
+        logger.error(f"提交数据分析任务失败: {str(e)}")
         logger.error(f"错误详情: {traceback.format_exc()}")
-        
-        # 确保在发生错误时也减少任务计数
+        raise HTTPException(status_code=500, detail=f"提交数据分析任务失败: {str(e)}")
+
+@app.get("/analysis/status")
+async def get_analysis_status(city: Optional[str] = None, auth_user: dict = Depends(auth.get_current_user)):
+    """获取数据分析的当前阶段（来自进度事件总线）以及排队中、执行中的分析任务"""
+    analyses = [
+        {"key": event["key"], "time": event["time"], **event["data"]}
+        for event in event_bus.bus.snapshot("analysis")
+        if not city or event["data"].get("city") == city
+    ]
+    queue = await asyncio.to_thread(task_dispatch.list_analysis_queue, city)
+    return {
+        "running": sum(1 for job in queue if job["status"] == "running"),
+        "pending": sum(1 for job in queue if job["status"] == "queued"),
+        "queue": queue,
+        "analyses": analyses
+    }
+
+@app.get("/events/stream")
+async def stream_events(request: Request, token: Optional[str] = None):
+    """
+    以Server-Sent Events推送爬虫任务和数据分析的进度变化
+    
+    EventSource无法设置请求头，令牌通过 token 查询参数传递，也支持Authorization头。
+    连接建立后先推送所有任务/分析的最新状态快照，之后推送增量变化。
+    """
+    if not token:
+        authorization = request.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            token = authorization[7:]
+    if not token:
+        raise HTTPException(status_code=401, detail="缺少访问令牌")
+    # 只在建立连接时认证一次
+    await auth.get_current_user(token)
+    
+    subscription = event_bus.bus.subscribe()
+    
+    async def event_generator():
         try:
-            if RUNNING_ANALYSIS_TASKS > 0:
-                RUNNING_ANALYSIS_TASKS -= 1
-        except:
-            pass
-            
-        raise HTTPException(status_code=500, detail=f"启动数据分析任务失败: {str(e)}")
+            # 客户端重连时会重新收到快照，无需按Last-Event-ID补发
+            yield "retry: 3000\n\n"
+            for event in event_bus.bus.snapshot():
+                yield event_bus.format_sse(event)
+            
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # 心跳，防止代理因空闲断开连接
+                    yield ": keepalive\n\n"
+                    continue
+                
+                if subscription.overflowed:
+                    # 客户端消费过慢丢失了事件，通知其重新拉取完整状态
+                    subscription.overflowed = False
+                    yield "event: resync\ndata: {}\n\n"
+                yield event_bus.format_sse(event)
+        finally:
+            event_bus.bus.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 禁止nginx缓冲事件流
+        }
+    )
+
+def build_analysis_etag(rows):
+    """
+    根据分析结果行的id和分析时间生成强ETag
+    
+    analysis_result只追加不修改，id与analysis_time足以标识结果内容，
+    无需读取result_data即可判断客户端缓存是否仍然有效
+    """
+    digest = hashlib.sha1()
+    for row in rows:
+        analysis_time = row["analysis_time"].isoformat() if row["analysis_time"] else ""
+        digest.update(f"{row['id']}:{analysis_time};".encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """判断请求的If-None-Match是否与当前ETag匹配（弱比较，忽略压缩中间件添加的编码后缀）"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(
+        response_compression.strip_etag_encoding(tag[2:] if tag.startswith("W/") else tag) == etag
+        for tag in candidates
+    )
+
+# 分析结果只在重新分析后变化，客户端每次使用前需用ETag重新验证
+ANALYSIS_CACHE_HEADERS = {"Cache-Control": "private, no-cache"}
 
 @app.get("/analysis/results", response_model=List[AnalysisResult])
 async def get_analysis_results(
+    request: Request,
+    response: Response,
     analysis_type: Optional[str] = None,
     city: Optional[str] = None,
     limit: int = 10,
     offset: int = 0,
     auth_user: dict = Depends(auth.get_current_user)
 ):
-    """获取分析结果列表"""
+    """获取分析结果列表，支持ETag条件请求"""
     try:
         with DBConnectionManager() as conn:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             
-            query = "SELECT * FROM analysis_result"
+            query = "SELECT id, analysis_time FROM analysis_result"
             conditions = []
             params = []
             
@@ -908,8 +1081,21 @@ async def get_analysis_results(
             query += " ORDER BY analysis_time DESC LIMIT %s OFFSET %s"
             params.extend([limit, offset])
             
+            # 先只查询id和分析时间计算ETag，命中时不读取jsonb结果
             cursor.execute(query, params)
-            results = cursor.fetchall()
+            versions = cursor.fetchall()
+            etag = build_analysis_etag(versions)
+            
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag, **ANALYSIS_CACHE_HEADERS})
+            
+            results = []
+            if versions:
+                cursor.execute(
+                    "SELECT * FROM analysis_result WHERE id = ANY(%s) ORDER BY analysis_time DESC",
+                    ([row["id"] for row in versions],)
+                )
+                results = cursor.fetchall()
             
             # 确保结果数据是正确解析的对象
             for result in results:
@@ -920,6 +1106,8 @@ async def get_analysis_results(
                         logger.warning(f"无法解析分析结果JSON: {result['id']}")
                 # 如果结果已经是对象(例如psycopg2已经解析了JSONB类型)，则不需要再次解析
             
+            response.headers["ETag"] = etag
+            response.headers.update(ANALYSIS_CACHE_HEADERS)
             # 不再需要手动关闭连接，DBConnectionManager会自动处理
             return results
     except Exception as e:
@@ -927,11 +1115,26 @@ async def get_analysis_results(
         raise HTTPException(status_code=500, detail=f"获取分析结果失败: {str(e)}")
 
 @app.get("/analysis/results/{result_id}", response_model=AnalysisResult)
-async def get_analysis_result(result_id: int, auth_user: dict = Depends(auth.get_current_user)):
-    """获取分析结果详情"""
+async def get_analysis_result(
+    result_id: int,
+    request: Request,
+    response: Response,
+    auth_user: dict = Depends(auth.get_current_user)
+):
+    """获取分析结果详情，支持ETag条件请求"""
     try:
         with DBConnectionManager() as conn:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("SELECT id, analysis_time FROM analysis_result WHERE id = %s", (result_id,))
+            version = cursor.fetchone()
+            
+            if not version:
+                raise HTTPException(status_code=404, detail=f"未找到分析结果ID: {result_id}")
+            
+            etag = build_analysis_etag([version])
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag, **ANALYSIS_CACHE_HEADERS})
+            
             cursor.execute("SELECT * FROM analysis_result WHERE id = %s", (result_id,))
             result = cursor.fetchone()
             
@@ -945,6 +1148,8 @@ async def get_analysis_result(result_id: int, auth_user: dict = Depends(auth.get
                 except json.JSONDecodeError:
                     logger.warning(f"无法解析分析结果JSON: {result_id}")
             
+            response.headers["ETag"] = etag
+            response.headers.update(ANALYSIS_CACHE_HEADERS)
             # 不再需要手动关闭连接，DBConnectionManager会自动处理
             return result
     except HTTPException:
@@ -953,6 +1158,105 @@ async def get_analysis_result(result_id: int, auth_user: dict = Depends(auth.get
         logger.error(f"获取分析结果详情失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取分析结果详情失败: {str(e)}")
 
+@app.get("/analysis/index", response_model=List[AnalysisIndexEntry])
+async def get_analysis_index(
+    request: Request,
+    response: Response,
+    city: Optional[str] = None,
+    auth_user: dict = Depends(auth.get_current_user)
+):
+    """
+    获取每种分析类型最新结果的索引（不含result_data）
+    
+    前端据此决定要加载哪些分析，再按类型单独获取详情
+    """
+    try:
+        with DBConnectionManager() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            where_clause = "WHERE city = %s" if city else ""
+            params = [city] if city else []
+            
+            # 先确定每种类型的最新一行，再只对这些行计算旧数据缺失的行数和大小
+            cursor.execute(f"""
+                WITH latest AS (
+                    SELECT DISTINCT ON (analysis_type) id
+                    FROM analysis_result
+                    {where_clause}
+                    ORDER BY analysis_type, analysis_time DESC
+                )
+                SELECT r.id, r.analysis_type, r.city, r.analysis_time,
+                       COALESCE(r.row_count,
+                                CASE WHEN jsonb_typeof(r.result_data) = 'array'
+                                     THEN jsonb_array_length(r.result_data) END) AS row_count,
+                       COALESCE(r.byte_size, pg_column_size(r.result_data)) AS byte_size
+                FROM analysis_result r
+                JOIN latest ON latest.id = r.id
+                ORDER BY r.analysis_type
+            """, params)
+            entries = cursor.fetchall()
+            
+            etag = build_analysis_etag(entries)
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag, **ANALYSIS_CACHE_HEADERS})
+            
+            response.headers["ETag"] = etag
+            response.headers.update(ANALYSIS_CACHE_HEADERS)
+            return entries
+    except Exception as e:
+        logger.error(f"获取分析结果索引失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取分析结果索引失败: {str(e)}")
+
+@app.get("/analysis/latest/{analysis_type}", response_model=AnalysisResult)
+async def get_latest_analysis(
+    analysis_type: str,
+    request: Request,
+    response: Response,
+    city: Optional[str] = None,
+    auth_user: dict = Depends(auth.get_current_user)
+):
+    """获取指定分析类型的最新结果，只读取这一行的result_data"""
+    try:
+        with DBConnectionManager() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            query = "SELECT id, analysis_time FROM analysis_result WHERE analysis_type = %s"
+            params = [analysis_type]
+            if city:
+                query += " AND city = %s"
+                params.append(city)
+            query += " ORDER BY analysis_time DESC LIMIT 1"
+            
+            cursor.execute(query, params)
+            version = cursor.fetchone()
+            if not version:
+                raise HTTPException(status_code=404, detail=f"未找到分析结果: {analysis_type}")
+            
+            etag = build_analysis_etag([version])
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag, **ANALYSIS_CACHE_HEADERS})
+            
+            cursor.execute(
+                "SELECT id, analysis_type, city, analysis_time, result_data FROM analysis_result WHERE id = %s",
+                (version["id"],)
+            )
+            result = cursor.fetchone()
+            
+            if isinstance(result['result_data'], str):
+                try:
+                    result['result_data'] = json.loads(result['result_data'])
+                except json.JSONDecodeError:
+                    logger.warning(f"无法解析分析结果JSON: {result['id']}")
+            
+            response.headers["ETag"] = etag
+            response.headers.update(ANALYSIS_CACHE_HEADERS)
+            return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"获取最新分析结果失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取最新分析结果失败: {str(e)}")
+
 @app.get("/analysis/types")
 async def get_analysis_types():
     """获取支持的分析类型"""
@@ -1110,19 +1414,66 @@ async def get_summary_statistics(city: Optional[str] = None, auth_user: dict = D
 @app.on_event("startup")
 async def startup_event():
     """应用启动时执行的初始化函数"""
-    global STARTUP_TIME, api_connection_pool
+    global STARTUP_TIME
     
     # 记录启动时间
     STARTUP_TIME = datetime.datetime.now()
     logger.info(f"API服务启动时间: {STARTUP_TIME}")
     
-    # 初始化数据库连接池
-    api_connection_pool = db_config.create_api_pool()
+    # 多worker部署时可以用 kill -USR2 <pid> 对单个worker采样
+    sampling_profiler.install_signal_handler()
+    
+    # 角色分离部署：爬取和分析由worker进程执行，进度事件经数据库通知转发过来
+    try:
+        job_queue.ensure_schema()
+    except Exception as e:
+        logger.error(f"初始化任务队列表失败: {str(e)}")
+    if not task_dispatch.is_inline():
+        task_dispatch.start_event_listener()
+        logger.info("任务分发模式: database，爬取和分析由独立worker执行")
+    else:
+        # 单进程部署：由API进程执行队列中排队的爬虫和分析任务，进程重启后继续
+        task_dispatch.start_inline_workers()
+    
+    # 初始化数据库连接池（模块导入时只创建了延迟连接池）
     if api_connection_pool:
         logger.info(f"API数据库连接池初始化成功，连接范围: {db_config.API_MIN_CONNECTIONS}-{db_config.API_MAX_CONNECTIONS}")
     else:
         logger.error("API数据库连接池初始化失败")
         
+    # 补齐旧数据库缺少的分析结果索引字段（分析worker写入时依赖这两列）。
+    # 只在确实缺少时执行DDL：ALTER TABLE 即使列已存在也要取得排他锁，会阻塞 /analysis/* 的读取
+    try:
+        with DBConnectionManager() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    SELECT
+                        (SELECT COUNT(*) FROM information_schema.columns
+                         WHERE table_schema = current_schema() AND table_name = 'analysis_result'
+                           AND column_name IN ('row_count', 'byte_size')),
+                        to_regclass('analysis_result_type_city_time_idx') IS NOT NULL
+                """)
+                column_count, index_exists = cursor.fetchone()
+                if column_count < 2 or not index_exists:
+                    logger.info("analysis_result表缺少索引字段，开始升级")
+                    cursor.execute("SET LOCAL lock_timeout = '5s'")
+                    cursor.execute("""
+                        ALTER TABLE analysis_result
+                            ADD COLUMN IF NOT EXISTS row_count integer,
+                            ADD COLUMN IF NOT EXISTS byte_size integer
+                    """)
+                    cursor.execute("""
+                        CREATE INDEX IF NOT EXISTS analysis_result_type_city_time_idx
+                        ON analysis_result (analysis_type, city, analysis_time DESC)
+                    """)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    except Exception as e:
+        logger.error(f"更新analysis_result表结构失败: {str(e)}")
+    
     # 读取IP代理设置
     try:
         # 使用上下文管理器更安全地管理数据库连接
@@ -1144,20 +1495,16 @@ async def startup_event():
     except Exception as e:
         logger.error(f"读取IP设置失败: {str(e)}")
         
-    # 初始化定时任务
-    initialize_scheduled_tasks()
-    
-    # 启动调度器
-    background_tasks = BackgroundTasks()
-    background_tasks.add_task(start_scheduler)
+    # 启动定时任务调度线程，多进程部署时只有竞选为leader的进程触发定时任务
+    scheduler.start()
     
     logger.info("API服务初始化完成")
 
 # 在原有的爬虫任务接口中使用selenium爬虫
 @app.post("/tasks/selenium_crawl", response_model=CrawlTaskStatus)
-async def create_selenium_crawl_task(task_info: CrawlTaskCreate, background_tasks: BackgroundTasks, auth_user: dict = Depends(auth.get_current_user)):
+async def create_selenium_crawl_task(task_info: CrawlTaskCreate, auth_user: dict = Depends(auth.get_current_user)):
     """创建并执行新的Selenium爬虫任务"""
-    cities = spider.get_supported_cities()
+    cities = get_supported_cities()
     
     if task_info.city not in cities:
         raise HTTPException(status_code=400, detail="不支持的城市")
@@ -1184,9 +1531,8 @@ async def create_selenium_crawl_task(task_info: CrawlTaskCreate, background_task
     
     logger.info(f"用户 {auth_user.get('username', 'unknown')} 创建Selenium爬虫任务成功，ID: {task_id}，城市: {task_info.city}，预期房源数: {expected_houses}，计划页数: {task_info.max_pages}")
     
-    # 在后台执行Selenium爬虫任务，确保传递已创建的task_id
-    background_tasks.add_task(spider.crawl_city_with_selenium, 
-                             task_info.city, city_code, task_info.max_pages, task_id)
+    # 放入jobs队列，由API进程内的爬虫线程或角色分离部署时的爬虫worker认领执行
+    task_dispatch.dispatch_crawl(task_id, task_info.max_pages)
     
     # 查询并返回任务状态
     with DBConnectionManager() as conn:
@@ -1412,6 +1758,7 @@ async def purge_data(auth_user: dict = Depends(auth.get_current_user), request:
                 data_tables = [
                     # 先删除有外键依赖的表 - 严格按照依赖关系排序
                     "house_info",      # 依赖于 crawl_task
+                    "house_price_history",
                     "crawled_pages",   # 依赖于 crawl_task
                     "verification_session", # 依赖于 crawl_task
                     # 再删除被依赖的表
@@ -1424,6 +1771,7 @@ async def purge_data(auth_user: dict = Depends(auth.get_current_user), request:
                 
                 sequence_tables = {
                     "house_info": "house_info_id_seq",
+                    "house_price_history": "house_price_history_id_seq",
                     "crawl_task": "crawl_task_id_seq",
                     "crawled_pages": "crawled_pages_id_seq",
                     "analysis_result": "analysis_result_id_seq",
@@ -1495,6 +1843,7 @@ async def export_data(auth_user: dict = Depends(auth.get_current_user)):
             return {"message": "没有可导出的数据"}
         
         # 将房源数据转换为DataFrame
+        import pandas as pd
         df = pd.DataFrame(houses)
         
         # 生成导出文件名
@@ -1575,218 +1924,17 @@ class ScheduledTask(BaseModel):
     created_at: datetime.datetime
     updated_at: Optional[datetime.datetime] = None
 
-# 定时任务全局变量
-scheduled_jobs = {}
-
-# 运行定时任务的函数
-def run_scheduled_task(task_id: int, city: str, pages: int):
-    logger.info(f"执行定时任务 ID: {task_id}, 城市: {city}, 页数: {pages}")
-    try:
-        # 更新任务状态为执行中
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute(
-            "UPDATE scheduled_tasks SET status = '执行中' WHERE id = %s",
-            (task_id,)
-        )
-        conn.commit()
-        
-        # 获取城市代码
-        city_code = spider.get_city_code(city)
-        if not city_code:
-            logger.error(f"无效的城市代码: {city}")
-            raise ValueError(f"无效的城市代码: {city}")
-
-        # 创建爬取任务
-        crawl_task_id = spider.start_crawl_task(city, city_code)
-        if not crawl_task_id:
-            logger.error("创建爬取任务失败")
-            raise Exception("创建爬取任务失败")
-            
-        # 直接使用创建的爬取任务ID执行爬取
-        spider.crawl_city_with_selenium(city, city_code, pages, crawl_task_id)
-        
-        # 计算下次运行时间
-        update_next_run_time(task_id)
-        
-        # 更新定时任务状态为正常
-        cursor.execute(
-            "UPDATE scheduled_tasks SET status = '正常' WHERE id = %s",
-            (task_id,)
-        )
-        conn.commit()
-        
-    except Exception as e:
-        logger.error(f"定时任务执行失败: {str(e)}")
-        try:
-            # 更新任务状态为错误
-            conn = get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(
-                "UPDATE scheduled_tasks SET status = '错误' WHERE id = %s",
-                (task_id,)
-            )
-            conn.commit()
-        except Exception as db_error:
-            logger.error(f"更新任务状态失败: {str(db_error)}")
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
-
 # 计算下次运行时间
-def update_next_run_time(task_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        # 获取任务信息
-        cursor.execute("SELECT * FROM scheduled_tasks WHERE id = %s", (task_id,))
-        task = cursor.fetchone()
-        
-        if not task:
-            return
-        
-        next_run = None
-        now = datetime.datetime.now()
-        
-        schedule_type, *schedule_value = task['schedule'].split('|')
-        schedule_value = schedule_value[0] if schedule_value else None
-        
-        if task['time']:
-            time_parts = task['time'].split(':')
-            hour, minute = int(time_parts[0]), int(time_parts[1])
-        else:
-            hour, minute = now.hour, now.minute
-        
-        if schedule_type == 'daily':
-            # 每天同一时间运行
-            next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            if next_run <= now:
-                next_run += datetime.timedelta(days=1)
-        
-        elif schedule_type == 'weekly' and schedule_value:
-            # 每周特定日期运行
-            weekday = int(schedule_value)
-            days_ahead = weekday - now.weekday()
-            if days_ahead <= 0:  # 如果今天已经是指定日期或已经过了
-                days_ahead += 7
-            next_run = (now + datetime.timedelta(days=days_ahead)).replace(hour=hour, minute=minute, second=0, microsecond=0)
-        
-        elif schedule_type == 'monthly' and schedule_value:
-            # 每月特定日期运行
-            day = int(schedule_value)
-            next_month = now.month + 1 if now.day > day or (now.day == day and now.hour > hour) else now.month
-            next_year = now.year + 1 if next_month > 12 else now.year
-            if next_month > 12:
-                next_month = 1
-            
-            # 处理月末日期问题（如31日在有些月份不存在）
-            _, last_day = calendar.monthrange(next_year, next_month)
-            target_day = min(day, last_day)
-            
-            next_run = datetime.datetime(next_year, next_month, target_day, hour, minute, 0)
-        
-        # 更新数据库中的下次运行时间
-        if next_run:
-            cursor.execute(
-                "UPDATE scheduled_tasks SET next_run = %s WHERE id = %s",
-                (next_run, task_id)
-            )
-            conn.commit()
-    
-    except Exception as e:
-        logger.error(f"计算下次运行时间失败: {str(e)}")
-    finally:
-        cursor.close()
-        conn.close()
-
-# 初始化定时任务
-def initialize_scheduled_tasks():
-    try:
-        with DBConnectionManager() as conn:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            try:
-                # 获取所有状态为正常的定时任务
-                cursor.execute("SELECT * FROM scheduled_tasks WHERE status = '正常'")
-                tasks = cursor.fetchall()
-                
-                # 清除之前的所有定时任务
-                schedule.clear()
-                
-                for task in tasks:
-                    schedule_task(task)
-            
-            except Exception as e:
-                logger.error(f"初始化定时任务失败: {str(e)}")
-            finally:
-                cursor.close()
-    except Exception as conn_error:
-        logger.error(f"获取数据库连接失败: {str(conn_error)}")
-
-# 添加定时任务到调度器
-def schedule_task(task):
-    task_id = task['id']
-    schedule_type, *schedule_value = task['schedule'].split('|')
-    schedule_value = schedule_value[0] if schedule_value else None
-    
-    if task['time']:
-        time_parts = task['time'].split(':')
-        hour, minute = int(time_parts[0]), int(time_parts[1])
-    else:
-        hour, minute = 0, 0  # 默认午夜
-    
-    job = None
-    
-    if schedule_type == 'daily':
-        # 每天同一时间运行
-        job = schedule.every().day.at(f"{hour:02d}:{minute:02d}").do(
-            run_scheduled_task, task_id=task_id, city=task['city'], pages=task['pages']
-        )
-    
-    elif schedule_type == 'weekly' and schedule_value:
-        # 每周特定日期运行
-        weekday = int(schedule_value)
-        weekdays = {
-            0: schedule.every().sunday,
-            1: schedule.every().monday,
-            2: schedule.every().tuesday,
-            3: schedule.every().wednesday,
-            4: schedule.every().thursday,
-            5: schedule.every().friday,
-            6: schedule.every().saturday
-        }
-        
-        if weekday in weekdays:
-            job = weekdays[weekday].at(f"{hour:02d}:{minute:02d}").do(
-                run_scheduled_task, task_id=task_id, city=task['city'], pages=task['pages']
-            )
-    
-    elif schedule_type == 'monthly' and schedule_value:
-        # 每月特定日期运行
-        day = int(schedule_value)
-        
-        # 由于schedule库没有直接支持每月特定日期的方法
-        # 我们使用schedule.every().day.at()，然后在运行前检查日期
-        def monthly_job():
-            current_day = datetime.datetime.now().day
-            if current_day == day:
-                run_scheduled_task(task_id=task_id, city=task['city'], pages=task['pages'])
-        
-        job = schedule.every().day.at(f"{hour:02d}:{minute:02d}").do(monthly_job)
-    
-    if job:
-        scheduled_jobs[task_id] = job
-
-# 定时任务调度线程
-def run_scheduler():
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # 每分钟检查一次
-
-# 启动调度器线程
-def start_scheduler():
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
+def update_next_run_time(cursor, task):
+    """根据调度配置重新计算下次运行时间，暂停的任务不设置"""
+    next_run = None
+    if task['status'] == '正常':
+        next_run = scheduler.next_run_time(task['schedule'], task['time'])
+    cursor.execute(
+        "UPDATE scheduled_tasks SET next_run = %s WHERE id = %s RETURNING *",
+        (next_run, task['id'])
+    )
+    return cursor.fetchone()
 
 # 定时任务API端点
 @app.post("/scheduled-tasks", response_model=ScheduledTask)
@@ -1795,50 +1943,15 @@ async def create_scheduled_task(task: ScheduledTaskCreate, auth_user: dict = Dep
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     try:
         # 验证城市代码
-        city_code = spider.get_city_code(task.city)
+        city_code = get_city_code(task.city)
         if not city_code:
             raise HTTPException(status_code=400, detail="无效的城市")
         
-        # 计算下次运行时间
-        next_run = None
-        now = datetime.datetime.now()
-        
-        schedule_type, *schedule_value = task.schedule.split('|')
-        schedule_value = schedule_value[0] if schedule_value else None
-        
-        if task.time:
-            time_parts = task.time.split(':')
-            hour, minute = int(time_parts[0]), int(time_parts[1])
-        else:
-            hour, minute = now.hour, now.minute
-        
-        if schedule_type == 'daily':
-            # 每天同一时间运行
-            next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            if next_run <= now:
-                next_run += datetime.timedelta(days=1)
-        
-        elif schedule_type == 'weekly' and schedule_value:
-            # 每周特定日期运行
-            weekday = int(schedule_value)
-            days_ahead = weekday - now.weekday()
-            if days_ahead <= 0:  # 如果今天已经是指定日期或已经过了
-                days_ahead += 7
-            next_run = (now + datetime.timedelta(days=days_ahead)).replace(hour=hour, minute=minute, second=0, microsecond=0)
-        
-        elif schedule_type == 'monthly' and schedule_value:
-            # 每月特定日期运行
-            day = int(schedule_value)
-            next_month = now.month + 1 if now.day > day or (now.day == day and now.hour > hour) else now.month
-            next_year = now.year + 1 if next_month > 12 else now.year
-            if next_month > 12:
-                next_month = 1
-            
-            # 处理月末日期问题（如31日在有些月份不存在）
-            _, last_day = calendar.monthrange(next_year, next_month)
-            target_day = min(day, last_day)
-            
-            next_run = datetime.datetime(next_year, next_month, target_day, hour, minute, 0)
+        # 校验调度配置并计算下次运行时间
+        try:
+            next_run = scheduler.next_run_time(task.schedule, task.time)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"无效的调度配置: {str(e)}")
         
         # 插入任务记录
         cursor.execute(
@@ -1851,11 +1964,11 @@ async def create_scheduled_task(task: ScheduledTaskCreate, auth_user: dict = Dep
         new_task = cursor.fetchone()
         conn.commit()
         
-        # 添加到调度器
-        schedule_task(new_task)
-        
         return new_task
     
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         logger.error(f"创建定时任务失败: {str(e)}")
@@ -1948,38 +2061,20 @@ async def update_scheduled_task(
             update_values + [task_id]
         )
         updated_task = cursor.fetchone()
-        conn.commit()
-        
-        # 如果状态改为暂停，从调度器中移除任务
-        if task_update.status == '暂停' and task_id in scheduled_jobs:
-            schedule.cancel_job(scheduled_jobs[task_id])
-            del scheduled_jobs[task_id]
         
-        # 如果状态改为正常，将任务添加到调度器
-        elif (task_update.status == '正常' or 
-              (task_update.status is None and existing_task['status'] == '正常')) and (
-              task_update.schedule is not None or 
-              task_update.time is not None or 
-              task_update.city is not None or 
-              task_update.pages is not None):
-            
-            # 从调度器中移除旧任务
-            if task_id in scheduled_jobs:
-                schedule.cancel_job(scheduled_jobs[task_id])
-                del scheduled_jobs[task_id]
-            
-            # 添加新任务到调度器
-            schedule_task(updated_task)
-        
-        # 更新下次运行时间
-        update_next_run_time(task_id)
-        
-        # 重新获取更新后的任务（包含更新的next_run字段）
-        cursor.execute("SELECT * FROM scheduled_tasks WHERE id = %s", (task_id,))
-        updated_task = cursor.fetchone()
+        # 调度配置或状态变化后重新计算下次运行时间，调度线程按next_run触发
+        if {'schedule', 'time', 'status'} & updates.keys():
+            try:
+                updated_task = update_next_run_time(cursor, updated_task)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"无效的调度配置: {str(e)}")
+        conn.commit()
         
         return updated_task
     
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         logger.error(f"更新定时任务失败: {str(e)}")
@@ -1999,11 +2094,6 @@ async def delete_scheduled_task(task_id: int, auth_user: dict = Depends(auth.get
         if not existing_task:
             raise HTTPException(status_code=404, detail="定时任务不存在")
         
-        # 从调度器中删除任务
-        if task_id in scheduled_jobs:
-            schedule.cancel_job(scheduled_jobs[task_id])
-            del scheduled_jobs[task_id]
-        
         # 从数据库中删除任务
         cursor.execute("DELETE FROM scheduled_tasks WHERE id = %s", (task_id,))
         conn.commit()
@@ -2018,6 +2108,19 @@ async def delete_scheduled_task(task_id: int, auth_user: dict = Depends(auth.get
         cursor.close()
         conn.close()
 
+@app.get("/scheduled-tasks/{task_id}/runs", response_model=List[Dict[str, Any]])
+async def get_scheduled_task_runs(
+    task_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    auth_user: dict = Depends(auth.get_current_user)
+):
+    """定时任务的运行记录：触发结果、合并的错过次数以及对应爬虫任务的状态"""
+    try:
+        return await asyncio.to_thread(scheduler.list_runs, task_id, limit)
+    except Exception as e:
+        logger.error(f"获取定时任务运行记录失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取定时任务运行记录失败: {str(e)}")
+
 # IP管理模型
 class ProxyCreate(BaseModel):
     ip: str
@@ -2303,11 +2406,6 @@ async def delete_task(task_id: int, auth_user: dict = Depends(auth.get_current_u
 
 # 图片代理相关处理
 
-# 图片缓存，避免重复请求相同图片
-image_cache = {}
-# 缓存过期时间（秒）
-CACHE_EXPIRY = 3600  # 1小时
-
 @app.get("/proxy/image")
 async def proxy_image(url: str):
     """
@@ -2320,64 +2418,13 @@ async def proxy_image(url: str):
         包含base64编码图片的JSON响应
     """
     try:
-        # 如果缓存中有且未过期，直接返回
-        current_time = time.time()
-        if url in image_cache and current_time - image_cache[url]["timestamp"] < CACHE_EXPIRY:
-            return {"base64": image_cache[url]["data"]}
-        
-        # 设置超时和请求头
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        
-        # 发送请求获取图片
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # 如果请求不成功则抛出异常
-        
-        # 图片处理和转换为base64
-        try:
-            # 使用PIL处理图片并可选地调整大小
-            image = Image.open(io.BytesIO(response.content))
-            
-            # 调整为合理的大小，如果图片太大
-            max_size = (800, 600)  # 设置最大宽高
-            if image.width > max_size[0] or image.height > max_size[1]:
-                image.thumbnail(max_size, Image.LANCZOS)
-            
-            # 如果图片是P模式(调色板模式)，先转换为RGB模式再保存为JPEG
-            if image.mode == 'P':
-                image = image.convert('RGB')
-            
-            # 转换为JPEG格式，减小大小
-            output = io.BytesIO()
-            image.save(output, format='JPEG', quality=85)
-            output.seek(0)
-            
-            # 转为base64
-            base64_data = base64.b64encode(output.read()).decode('utf-8')
-            base64_image = f"data:image/jpeg;base64,{base64_data}"
-            
-            # 存入缓存
-            image_cache[url] = {
-                "data": base64_image,
-                "timestamp": current_time
-            }
-            
-            # 如果缓存过大，清理最旧的条目
-            if len(image_cache) > 500:  # 设置最大缓存条目数
-                # 按时间戳排序，删除最旧的20%
-                sorted_items = sorted(image_cache.items(), key=lambda x: x[1]["timestamp"])
-                items_to_remove = sorted_items[:int(len(sorted_items) * 0.2)]
-                for key, _ in items_to_remove:
-                    del image_cache[key]
-            
-            return {"base64": base64_image}
-        
-        except Exception as img_err:
-            logger.error(f"图片处理失败: {str(img_err)}")
-            raise HTTPException(status_code=500, detail=f"图片处理失败: {str(img_err)}")
-            
-    except requests.RequestException as err:
+        # 缓存由 image_cache 模块统一管理，爬虫预取的缩略图也会在这里命中
+        base64_image = image_cache.fetch_image(url, timeout=10)
+        return {"base64": base64_image}
+    except image_cache.ImageProcessError as img_err:
+        logger.error(f"图片处理失败: {str(img_err)}")
+        raise HTTPException(status_code=500, detail=f"图片处理失败: {str(img_err)}")
+    except image_cache.ImageFetchError as err:
         logger.error(f"获取图片失败: {str(err)}")
         raise HTTPException(status_code=500, detail=f"获取图片失败: {str(err)}")
     except Exception as e:
@@ -43,17 +43,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger("auth")
 
-# 创建认证系统专用的数据库连接池
-try:
-    auth_pool = db_config.create_pool(
+# 认证系统专用的数据库连接池，第一次使用时才建立连接
+auth_pool = db_config.LazyPool(
+    lambda: db_config.create_pool(
         min_conn=2, 
         max_conn=10, 
         application_name="auth_service"
-    )
-    logger.info("认证系统数据库连接池创建成功")
-except Exception as e:
-    logger.error(f"认证系统数据库连接池创建失败: {str(e)}")
-    auth_pool = None
+    ),
+    "认证系统"
+)
 
 # 创建装饰器实例
 with_db_connection = db_utils.with_db_connection(auth_pool)
@@ -0,0 +1,86 @@
+"""
+响应压缩基准测试
+请求运行中的API服务，统计各接口未压缩/gzip/br的传输字节数以及压缩耗费的CPU时间
+
+用法:
+    python benchmarks/bench_compression.py --base-url http://localhost:8000 --token <JWT>
+"""
+import os
+import sys
+import time
+import argparse
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import response_compression
+
+DEFAULT_ENDPOINTS = [
+    "/houses?page=1&page_size=100",
+    "/tasks?limit=50",
+    "/analysis/results",
+    "/statistics/summary",
+    "/cities",
+]
+
+
+def measure_cpu(encoding, body, rounds):
+    """本地以中间件相同的参数压缩，返回(压缩后字节数, 每次压缩CPU毫秒)"""
+    stream_cls = response_compression._BrotliStream if encoding == "br" else response_compression._GzipStream
+    start = time.process_time()
+    for _ in range(rounds):
+        stream = stream_cls()
+        data = stream.compress(body) + stream.finish()
+    elapsed = (time.process_time() - start) / rounds * 1000
+    return len(data), elapsed
+
+
+def fetch(session, url, headers, accept_encoding):
+    """请求接口，返回(线上字节数, Content-Encoding, 解压后的响应体)"""
+    response = session.get(
+        url,
+        headers={**headers, "Accept-Encoding": accept_encoding},
+        stream=True,
+        timeout=60,
+    )
+    raw = response.raw.read(decode_content=False)
+    encoding = response.headers.get("Content-Encoding", "identity")
+    response.close()
+    return len(raw), encoding, raw
+
+
+def main():
+    parser = argparse.ArgumentParser(description="响应压缩基准测试")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", default=os.getenv("API_TOKEN"), help="JWT访问令牌")
+    parser.add_argument("--rounds", type=int, default=20, help="本地压缩CPU测量的重复次数")
+    parser.add_argument("endpoints", nargs="*", default=DEFAULT_ENDPOINTS)
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    encodings = ["gzip"] + (["br"] if response_compression.brotli else [])
+    session = requests.Session()
+
+    print(f"压缩阈值: {response_compression.COMPRESSION_MIN_SIZE} 字节, 支持: {', '.join(encodings)}")
+    print(f"{'接口':<36}{'原始字节':>12}{'编码':>8}{'线上字节':>12}{'压缩率':>9}{'CPU(ms)':>10}")
+
+    for endpoint in args.endpoints:
+        url = args.base_url.rstrip("/") + endpoint
+        try:
+            identity_size, _, body = fetch(session, url, headers, "identity")
+        except requests.RequestException as e:
+            print(f"{endpoint:<36}请求失败: {e}")
+            continue
+
+        print(f"{endpoint:<36}{identity_size:>12}{'identity':>8}{identity_size:>12}{'100.0%':>9}{'-':>10}")
+        for encoding in encodings:
+            wire_size, served_encoding, _ = fetch(session, url, headers, encoding)
+            _, cpu_ms = measure_cpu(encoding, body, args.rounds)
+            ratio = wire_size / identity_size * 100 if identity_size else 100
+            label = encoding if served_encoding == encoding else f"{encoding}*"
+            print(f"{'':<36}{'':>12}{label:>8}{wire_size:>12}{ratio:>8.1f}%{cpu_ms:>10.2f}")
+
+    print("\n* 表示服务端未按该编码压缩（响应小于阈值或内容类型被跳过）")
+
+
+if __name__ == "__main__":
+    main()
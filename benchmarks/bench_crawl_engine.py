@@ -0,0 +1,141 @@
+"""
+异步抓取引擎基准测试
+在本地启动一个HTTP桩服务（返回 fixtures/listing_page.html，可模拟响应延迟），分别用
+原来的逐页请求 + 固定随机等待、以及 crawl_engine 的令牌桶并发抓取同样的页面，对比每秒页数，
+并根据桩服务记录的请求时间检查是否超出令牌桶允许的速率。超出时退出码为1
+
+用法:
+    python benchmarks/bench_crawl_engine.py
+    python benchmarks/bench_crawl_engine.py --pages 40 --rate 2 --burst 2 --concurrency 4 --latency 300
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import threading
+from pathlib import Path
+
+import requests
+from aiohttp import web
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import crawl_engine
+
+FIXTURE = Path(__file__).parent / "fixtures" / "listing_page.html"
+
+
+class StubServer:
+    """在后台线程中运行的列表页桩服务，记录每个请求到达的时间"""
+
+    def __init__(self, html, latency):
+        self.html = html
+        self.latency = latency
+        self.arrivals = []
+        self.port = None
+        self._ready = threading.Event()
+        self._loop = None
+        self._runner = None
+
+    async def handle(self, request):
+        self.arrivals.append(time.monotonic())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(text=self.html, content_type="text/html")
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get("/zufang/{page}/", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start())
+        self._ready.set()
+        self._loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+        return f"http://127.0.0.1:{self.port}/zufang/"
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def max_requests_in_window(arrivals, window):
+    """任意长度为window秒的时间窗口内最多到达的请求数"""
+    arrivals = sorted(arrivals)
+    best, start = 0, 0
+    for end, arrival in enumerate(arrivals):
+        while arrival - arrivals[start] > window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+def bench_sequential(urls, sleep_range):
+    """原来的方式：逐页请求，每页之后随机等待"""
+    start = time.perf_counter()
+    with requests.Session() as session:
+        for url in urls:
+            session.get(url, timeout=15).raise_for_status()
+            time.sleep(random.uniform(*sleep_range))
+    return time.perf_counter() - start
+
+
+def bench_engine(urls, args):
+    engine = crawl_engine.AsyncFetchEngine(
+        rate=args.rate, burst=args.burst, concurrency=args.concurrency, jitter=args.jitter
+    )
+    start = time.perf_counter()
+    responses = engine.run(urls)
+    elapsed = time.perf_counter() - start
+    failed = [response for response in responses if response.status != 200]
+    if failed:
+        raise RuntimeError(f"{len(failed)} 个请求失败: {failed[0].error or failed[0].status}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="异步抓取引擎基准测试")
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--rate", type=float, default=2.0, help="令牌桶每秒请求数")
+    parser.add_argument("--burst", type=float, default=2.0, help="令牌桶容量")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--jitter", type=float, default=0.2, help="每个请求的随机抖动上限（秒）")
+    parser.add_argument("--latency", type=float, default=200, help="桩服务每个响应的延迟（毫秒）")
+    parser.add_argument("--sleep", type=float, nargs=2, default=(0.5, 1.0), metavar=("MIN", "MAX"),
+                        help="逐页方式每页之后的随机等待（秒），线上为5~10秒")
+    args = parser.parse_args()
+
+    server = StubServer(FIXTURE.read_text(encoding="utf-8"), args.latency / 1000)
+    base_url = server.start()
+    urls = [f"{base_url}pg{page}/" for page in range(1, args.pages + 1)]
+    try:
+        sequential = bench_sequential(urls, args.sleep)
+        print(f"逐页+固定等待  {args.pages} 页 {sequential:6.2f} 秒  {args.pages / sequential:6.2f} 页/秒")
+
+        server.arrivals.clear()
+        elapsed = bench_engine(urls, args)
+        print(f"令牌桶并发     {args.pages} 页 {elapsed:6.2f} 秒  {args.pages / elapsed:6.2f} 页/秒"
+              f"（速率 {args.rate}/秒，容量 {args.burst}，并发 {args.concurrency}）")
+        print(f"加速比 {sequential / elapsed:.1f}x")
+    finally:
+        server.stop()
+
+    # 任意1秒窗口内的请求数不应超过 容量 + 速率 * 1秒（向上取整，容许计时误差）
+    observed = max_requests_in_window(server.arrivals, 1.0)
+    allowed = int(args.burst + args.rate) + 1
+    print(f"任意1秒内最多 {observed} 个请求，允许 {allowed} 个")
+    return 0 if observed <= allowed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+房源入库基准测试
+在数据库会话中创建与 house_info、house_price_history 结构相同的临时表（同名，遮盖正式表，不写入正式数据），
+分别用原来的逐行 SELECT + UPDATE/INSERT 和 house_store 的多行upsert写入同样的房源页，
+统计每秒写入行数。每页一半是已存在的房源（更新）、一半是新房源（插入）。
+最后用多行upsert把同样内容再写一遍，模拟重复爬取未变化的房源，此时只更新last_seen
+
+用法:
+    python benchmarks/bench_house_upsert.py
+    python benchmarks/bench_house_upsert.py --pages 50 --page-size 30
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import datetime
+
+import psycopg2
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_config
+import house_store
+
+
+def make_rows(pages, page_size, generation):
+    """生成房源页，generation不同时价格不同，用于模拟重新爬取"""
+    now = datetime.datetime.now()
+    result = []
+    for page in range(pages):
+        rows = []
+        for index in range(page_size):
+            number = page * page_size + index
+            rows.append({
+                "house_id": f"BENCH{number:012d}",
+                "task_id": 1,
+                "link": f"https://bench.zu.ke.com/zufang/BENCH{number:012d}.html",
+                "title": f"整租·基准测试小区{number} 2室1厅 南",
+                "price": 3000 + number % 500 + generation,
+                "layout": "2室1厅1卫",
+                "size": 60.0 + number % 40,
+                "floor": "中楼层 （18层）",
+                "direction": "南",
+                "subway": "",
+                "location_qu": "南山区",
+                "location_big": f"基准测试小区{number}",
+                "city_code": "bench",
+                "publish_date": now.strftime("%Y-%m-%d"),
+                "features": json.dumps(["近地铁", "精装"], ensure_ascii=False),
+                "image": f"https://image1.ljcdn.com/bench/{number}.jpg",
+                "room": "2室1厅1卫",
+                "room_count": 2,
+                "hall_count": 1,
+                "bath_count": 1,
+                "unit_price": 50.0,
+                "created_at": now,
+                "last_updated": now,
+                "content_hash": None,
+                "last_seen": now,
+            })
+        result.append(rows)
+    return result
+
+
+def legacy_save(conn, rows):
+    """原来的写法：每个房源先按house_id查询，再UPDATE或INSERT"""
+    cursor = conn.cursor()
+    inserted = updated = 0
+    for row in rows:
+        cursor.execute("SELECT id FROM house_info WHERE house_id = %s", (row["house_id"],))
+        if cursor.fetchone():
+            cursor.execute(
+                "UPDATE house_info SET "
+                + ", ".join(f"{column} = %({column})s" for column in house_store.UPDATE_COLUMNS)
+                + " WHERE house_id = %(house_id)s",
+                row,
+            )
+            updated += 1
+        else:
+            cursor.execute("SELECT id FROM house_info WHERE link = %s AND city_code = %s",
+                           (row["link"], row["city_code"]))
+            cursor.fetchone()
+            cursor.execute(
+                f"INSERT INTO house_info ({', '.join(house_store.HOUSE_COLUMNS)}) VALUES {house_store.HOUSE_ROW_TEMPLATE}",
+                row,
+            )
+            inserted += 1
+    conn.commit()
+    cursor.close()
+    return inserted, updated
+
+
+def bulk_save(conn, rows):
+    result = house_store.upsert_house_rows(conn, rows)
+    return result["inserted"], result["updated"], result["unchanged"]
+
+
+def run(conn, name, save, pages, page_size):
+    """清空临时表，预先写入一半房源，再按页写入全部房源（一半更新一半插入），返回每秒行数和写入的房源页"""
+    cursor = conn.cursor()
+    cursor.execute("TRUNCATE house_info, house_price_history")
+    conn.commit()
+    existing = [row for rows in make_rows(pages, page_size, generation=0) for row in rows[: page_size // 2]]
+    house_store.upsert_house_rows(conn, existing)
+    # upsert_house_rows结束时恢复autocommit，逐行写法同样按页一个事务
+    conn.autocommit = False
+
+    batches = make_rows(pages, page_size, generation=1)
+    start = time.perf_counter()
+    inserted = updated = 0
+    for rows in batches:
+        page_inserted, page_updated = save(conn, rows)[:2]
+        inserted += page_inserted
+        updated += page_updated
+    elapsed = time.perf_counter() - start
+    total = inserted + updated
+    print(f"{name:<10} {total} 行 {elapsed:7.3f} 秒  {total / elapsed:9.0f} 行/秒  "
+          f"（插入 {inserted}，更新 {updated}）")
+    return total / elapsed, batches
+
+
+def run_unchanged(conn, batches):
+    """把上一轮写入的房源页原样再写一遍，内容哈希相同，只更新last_seen"""
+    start = time.perf_counter()
+    unchanged = written = 0
+    for rows in batches:
+        page_inserted, page_updated, page_unchanged = bulk_save(conn, rows)
+        written += page_inserted + page_updated
+        unchanged += page_unchanged
+    elapsed = time.perf_counter() - start
+    total = unchanged + written
+    print(f"{'重复爬取':<10} {total} 行 {elapsed:7.3f} 秒  {total / elapsed:9.0f} 行/秒  "
+          f"（未变化 {unchanged}，重写 {written}）")
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="房源入库基准测试")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=30)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**db_config.DB_PARAMS)
+    try:
+        # 先补齐正式库中的新列和价格历史表，临时表按正式表的结构创建
+        house_store.ensure_schema(conn)
+        cursor = conn.cursor()
+        # 临时表与正式表同名，pg_temp在search_path中优先，基准测试中的写入都落在临时表上
+        for table in ("house_info", "house_price_history"):
+            cursor.execute(f"CREATE TEMP TABLE {table} (LIKE public.{table} INCLUDING ALL)")
+            # id改用临时序列，不推进正式表的序列
+            cursor.execute(f"CREATE TEMP SEQUENCE {table}_bench_seq")
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_bench_seq')")
+        conn.commit()
+        before, _ = run(conn, "逐行", legacy_save, args.pages, args.page_size)
+        after, batches = run(conn, "多行upsert", bulk_save, args.pages, args.page_size)
+        print(f"加速比 {after / before:.1f}x")
+        unchanged = run_unchanged(conn, batches)
+        print(f"未变化房源相对整行更新 {unchanged / after:.1f}x")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
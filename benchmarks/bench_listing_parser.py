@@ -0,0 +1,147 @@
+"""
+房源列表页解析基准测试
+用 fixtures/listing_page.html 中的列表项拼出一页（默认30个房源），统计整页HTML快照解析
+（listing_parser）每页的耗时；加 --browser 时在浏览器中打开同一页面，再用逐个元素读取的
+extract_house_info 提取一遍，逐字段比较两种方式的结果并对比耗时。
+同时检查懒加载（class="lazyload"）的图片取到的是data-src中的真实地址而不是占位图。结果不一致时退出码为1
+
+用法:
+    python benchmarks/bench_listing_parser.py
+    python benchmarks/bench_listing_parser.py --items 30 --rounds 200 --browser
+"""
+import os
+import sys
+import copy
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+import lxml.html
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import listing_parser
+
+FIXTURE = Path(__file__).parent / "fixtures" / "listing_page.html"
+CITY_CODE = "sz"
+
+
+def build_page(fixture, items):
+    """把fixture中的列表项循环复制到指定数量，返回页面HTML"""
+    document = lxml.html.fromstring(fixture.read_text(encoding="utf-8"))
+    container = document.cssselect("div.content__list")[0]
+    originals = container.cssselect(listing_parser.ITEM_SELECTOR)
+    for index in range(len(originals), items):
+        container.append(copy.deepcopy(originals[index % len(originals)]))
+    return lxml.html.tostring(document, encoding="unicode", doctype="<!DOCTYPE html>")
+
+
+def bench_snapshot(html, base_url, rounds):
+    """返回(解析结果, 每页耗时列表ms)"""
+    timings = []
+    houses = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        houses, _, errors = listing_parser.parse_listing_page(html, CITY_CODE, task_id=1, base_url=base_url)
+        timings.append((time.perf_counter() - start) * 1000)
+        if errors:
+            raise RuntimeError(f"解析失败: {errors}")
+    return houses, timings
+
+
+def bench_browser(page_path, rounds):
+    """在浏览器中打开页面，用extract_house_info逐个元素提取，返回(提取结果, 每页耗时列表ms, 页面地址)"""
+    import selenium_spider as spider
+
+    driver = spider.setup_driver()
+    try:
+        driver.get(page_path.as_uri())
+        timings = []
+        houses = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            elements = driver.eles(f"css:{listing_parser.ITEM_SELECTOR}")
+            houses = [spider.extract_house_info(element, CITY_CODE, task_id=1) for element in elements]
+            timings.append((time.perf_counter() - start) * 1000)
+        return houses, timings, page_path.as_uri()
+    finally:
+        driver.quit()
+
+
+def compare(expected, actual):
+    """逐个房源、逐字段比较，返回差异描述列表"""
+    if len(expected) != len(actual):
+        return [f"房源数量不同: 逐元素 {len(expected)}，快照 {len(actual)}"]
+    differences = []
+    for index, (left, right) in enumerate(zip(expected, actual)):
+        if left is None:
+            differences.append(f"第 {index + 1} 个房源: 逐元素提取失败")
+            continue
+        for key in sorted(set(left) | set(right)):
+            if left.get(key) != right.get(key):
+                differences.append(f"第 {index + 1} 个房源 {key}: 逐元素 {left.get(key)!r}，快照 {right.get(key)!r}")
+    return differences
+
+
+def check_lazyload_images(html, houses):
+    """懒加载图片的src是占位图，解析结果应为data-src中的地址，返回差异描述列表"""
+    document = lxml.html.fromstring(html)
+    differences = []
+    for index, (item, house) in enumerate(zip(document.cssselect(listing_parser.ITEM_SELECTOR), houses)):
+        images = item.cssselect(f"{listing_parser.IMAGE_SELECTOR}.lazyload")
+        if images and house["image_url"] != images[0].get("data-src"):
+            differences.append(f"第 {index + 1} 个房源 image_url: 期望 {images[0].get('data-src')!r}，"
+                               f"实际 {house['image_url']!r}")
+    return differences
+
+
+def report(name, timings):
+    print(f"{name:<12} 中位数 {statistics.median(timings):8.2f} ms/页   "
+          f"最小 {min(timings):8.2f} ms   最大 {max(timings):8.2f} ms   ({len(timings)} 次)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="房源列表页解析基准测试")
+    parser.add_argument("--fixture", type=Path, default=FIXTURE)
+    parser.add_argument("--items", type=int, default=30, help="每页房源数")
+    parser.add_argument("--rounds", type=int, default=200, help="快照解析的重复次数")
+    parser.add_argument("--browser", action="store_true", help="同时在浏览器中用逐元素方式提取并比较结果")
+    parser.add_argument("--browser-rounds", type=int, default=3, help="逐元素提取的重复次数")
+    args = parser.parse_args()
+
+    html = build_page(args.fixture, args.items)
+    with tempfile.TemporaryDirectory() as tmp:
+        page_path = Path(tmp) / "listing_page.html"
+        page_path.write_text(html, encoding="utf-8")
+
+        snapshot_houses, snapshot_timings = bench_snapshot(html, page_path.as_uri(), args.rounds)
+        print(f"每页 {len(snapshot_houses)} 个房源")
+        report("snapshot", snapshot_timings)
+
+        lazyload_differences = check_lazyload_images(html, snapshot_houses)
+        if lazyload_differences:
+            print(f"懒加载图片取到了占位图（{len(lazyload_differences)} 处）:")
+            for line in lazyload_differences:
+                print(f"  {line}")
+            return 1
+
+        if not args.browser:
+            return 0
+
+        cdp_houses, cdp_timings, _ = bench_browser(page_path, args.browser_rounds)
+        report("cdp", cdp_timings)
+        print(f"加速比 {statistics.median(cdp_timings) / statistics.median(snapshot_timings):.1f}x")
+
+        differences = compare(cdp_houses, snapshot_houses)
+        if differences:
+            print(f"两种提取方式结果不一致（{len(differences)} 处）:")
+            for line in differences:
+                print(f"  {line}")
+            return 1
+        print("两种提取方式结果一致")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
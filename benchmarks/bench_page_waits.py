@@ -0,0 +1,81 @@
+"""
+页面条件等待基准测试
+在浏览器中反复打开 fixtures/listing_page.html（可模拟房源列表延迟出现），统计等到房源列表
+出现实际花费的时间，与原来导航后的固定等待（random.uniform(2, 5) + 3 秒，平均6.5秒）对比，
+输出一次模拟爬取中去掉的空闲时间
+
+用法:
+    python benchmarks/bench_page_waits.py
+    python benchmarks/bench_page_waits.py --pages 20 --render-delay 800
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import selenium_spider as spider
+
+FIXTURE = Path(__file__).parent / "fixtures" / "listing_page.html"
+# 原来导航后的固定等待：uniform(2, 5) 的期望 + 等待列表加载的 3 秒
+FIXED_WAIT_SECONDS = (2 + 5) / 2 + 3
+
+# 页面加载后先移除房源列表，延迟一段时间再放回，模拟列表渲染较慢的情况
+DELAY_SCRIPT = """
+<script>
+(function () {
+  var list = document.querySelector("div.content__list");
+  var items = Array.prototype.slice.call(list.children);
+  items.forEach(function (item) { list.removeChild(item); });
+  setTimeout(function () { items.forEach(function (item) { list.appendChild(item); }); }, %d);
+})();
+</script>
+"""
+
+
+def build_page(render_delay_ms):
+    html = FIXTURE.read_text(encoding="utf-8")
+    if render_delay_ms:
+        html = html.replace("</body>", DELAY_SCRIPT % render_delay_ms + "</body>")
+    return html
+
+
+def main():
+    parser = argparse.ArgumentParser(description="页面条件等待基准测试")
+    parser.add_argument("--pages", type=int, default=10, help="模拟爬取的页数")
+    parser.add_argument("--render-delay", type=int, default=500, help="房源列表延迟出现的毫秒数，0表示随页面一起出现")
+    args = parser.parse_args()
+
+    driver = spider.setup_driver()
+    if driver is None:
+        print("浏览器启动失败")
+        return 1
+    waits = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            page_path = Path(tmp) / "listing_page.html"
+            page_path.write_text(build_page(args.render_delay), encoding="utf-8")
+            for _ in range(args.pages):
+                driver.get(page_path.as_uri())
+                start = time.perf_counter()
+                state = spider.wait_for_listing_or_captcha(driver)
+                waits.append(time.perf_counter() - start)
+                if state != "listing":
+                    print(f"未等到房源列表（状态: {state}）")
+                    return 1
+    finally:
+        driver.quit()
+
+    condition_total = sum(waits)
+    fixed_total = FIXED_WAIT_SECONDS * args.pages
+    print(f"条件等待  每页中位数 {statistics.median(waits) * 1000:8.1f} ms   合计 {condition_total:7.2f} 秒")
+    print(f"固定等待  每页平均   {FIXED_WAIT_SECONDS * 1000:8.1f} ms   合计 {fixed_total:7.2f} 秒")
+    print(f"{args.pages} 页共去掉空闲时间 {fixed_total - condition_total:.2f} 秒")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
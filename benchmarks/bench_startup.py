@@ -0,0 +1,95 @@
+"""
+启动开销基准测试
+在全新的Python进程中导入指定模块，统计导入耗时、常驻内存（RSS）以及加载了哪些重量级依赖，
+用于确认API进程没有在启动时导入爬虫和数据分析的依赖
+
+用法:
+    python benchmarks/bench_startup.py                # 默认测试 api
+    python benchmarks/bench_startup.py api selenium_spider data_processor --repeat 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 需要关注的重量级依赖
+HEAVY_MODULES = [
+    "pandas",
+    "numpy",
+    "pyspark",
+    "cv2",
+    "PIL",
+    "DrissionPage",
+    "selenium",
+    "bs4",
+    "selenium_spider",
+    "data_processor",
+]
+
+# 子进程中执行的测量脚本
+PROBE = r"""
+import sys, time, json, importlib, resource
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - start
+rss_kb = 0
+try:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss_kb = int(line.split()[1])
+except OSError:
+    # 非Linux平台退化为峰值RSS（macOS单位为字节）
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss_kb //= 1024
+heavy = json.loads(sys.argv[2])
+print(json.dumps({
+    "seconds": elapsed,
+    "rss_mb": rss_kb / 1024,
+    "loaded": [m for m in heavy if m in sys.modules],
+}))
+"""
+
+
+def measure(module, heavy_modules):
+    """在新进程中导入模块，返回测量结果"""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, module, json.dumps(heavy_modules)],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        timeout=300,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "导入失败")
+    # 被测模块导入时可能向标准输出打印日志，结果在最后一行
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模块导入耗时和内存基准测试")
+    parser.add_argument("modules", nargs="*", default=["api"])
+    parser.add_argument("--repeat", type=int, default=3, help="每个模块重复测量的次数")
+    args = parser.parse_args()
+
+    print(f"{'模块':<20}{'导入耗时(中位数)':>18}{'RSS(MB)':>12}  已加载的重量级依赖")
+    print("-" * 90)
+    for module in args.modules:
+        try:
+            runs = [measure(module, HEAVY_MODULES) for _ in range(args.repeat)]
+        except Exception as e:
+            print(f"{module:<20}导入失败: {e}")
+            continue
+        seconds = statistics.median(run["seconds"] for run in runs)
+        rss = statistics.median(run["rss_mb"] for run in runs)
+        loaded = ", ".join(runs[-1]["loaded"]) or "无"
+        print(f"{module:<20}{seconds * 1000:>15.0f} ms{rss:>12.1f}  {loaded}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+浏览器池
+为并发爬取的多个城市分配相互隔离的浏览器：每个槽位使用动态分配的远程调试端口和
+独立的用户数据目录，同一台机器上的多个爬虫不再争用 9222 端口和同一份浏览器配置。
+
+池大小由 BROWSER_POOL_SIZE 配置（默认2），也是爬虫worker并发执行的任务数。
+交给调用方前和每页爬取前做健康检查，失效时在原槽位重新启动。
+
+任务结束后浏览器不关闭，连同cookie和缓存保留在槽位上，下一个同城市的任务直接复用，
+省去Chromium启动和首次访问的开销。以下情况回收（关闭并清理用户数据目录）：
+- 累计访问页数达到 BROWSER_RECYCLE_PAGES
+- 浏览器进程树内存超过 BROWSER_RECYCLE_RSS_MB（需要psutil）
+- 空闲超过 BROWSER_IDLE_SECONDS
+- 需要空槽位给其他城市使用
+
+用法:
+    pool = browser_pool.get_pool(launcher)
+    lease = pool.acquire(city_code)
+    try:
+        driver = lease.page
+        ...
+        driver = pool.ensure_healthy(lease)
+        pool.record_page(lease)
+    finally:
+        pool.release(lease)
+"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import logging
+
+try:
+    import psutil
+except ImportError:  # psutil为可选依赖，未安装时不按内存回收
+    psutil = None
+
+import metrics
+
+logger = logging.getLogger("browser_pool")
+
+# 池中的浏览器数量，即本进程同时爬取的城市数
+POOL_SIZE = max(1, int(os.getenv("BROWSER_POOL_SIZE", "2")))
+# 各槽位用户数据目录的上级目录
+PROFILE_ROOT = os.getenv("BROWSER_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "lianjia_browser_profiles"))
+# 所有槽位都被占用时最长等待秒数
+ACQUIRE_TIMEOUT = float(os.getenv("BROWSER_ACQUIRE_TIMEOUT", "600"))
+# 浏览器启动失败或健康检查失败时的最大启动次数
+MAX_LAUNCH_ATTEMPTS = int(os.getenv("BROWSER_MAX_LAUNCH_ATTEMPTS", "3"))
+# 浏览器累计访问多少页后回收，0表示不按页数回收
+RECYCLE_PAGES = int(os.getenv("BROWSER_RECYCLE_PAGES", "200"))
+# 浏览器进程树内存超过多少MB后回收，0表示不按内存回收
+RECYCLE_RSS_MB = int(os.getenv("BROWSER_RECYCLE_RSS_MB", "1536"))
+# 保温的浏览器空闲多少秒后关闭
+IDLE_SECONDS = float(os.getenv("BROWSER_IDLE_SECONDS", "900"))
+
+
+class BrowserPoolExhausted(Exception):
+    """等待超时仍没有空闲的浏览器槽位"""
+
+
+def allocate_port():
+    """向系统申请一个当前空闲的本地端口作为远程调试端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def is_healthy(page):
+    """浏览器进程存活且页面能执行脚本"""
+    if page is None:
+        return False
+    try:
+        return page.run_js("return 1;") == 1
+    except Exception as e:
+        logger.warning(f"浏览器健康检查失败: {str(e)}")
+        return False
+
+
+def browser_rss_mb(page):
+    """浏览器主进程及其子进程（渲染、GPU等）的常驻内存，无法获取时返回None"""
+    pid = getattr(page, "process_id", None)
+    if psutil is None or not pid:
+        return None
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+        total = 0
+        for proc in processes:
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / (1024 * 1024)
+    except psutil.Error:
+        return None
+
+
+class BrowserSlot:
+    """
+    池中的一个浏览器槽位
+
+    租用期间 reused、startup_ms、saved_ms 描述本次租用：是否复用了保温的浏览器、
+    获取可用浏览器实际花费的时间、相比冷启动节省的时间
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.user_data_dir = os.path.join(PROFILE_ROOT, f"{os.getpid()}-slot-{index}")
+        self.port = None
+        self.page = None
+        self.city = None
+        self.pages = 0
+        self.in_use = False
+        self.launched_at = None
+        self.launch_ms = None
+        self.leased_at = None
+        self.released_at = None
+        self.reused = False
+        self.startup_ms = 0
+        self.saved_ms = 0
+
+    def describe(self):
+        return {
+            "slot": self.index,
+            "port": self.port,
+            "user_data_dir": self.user_data_dir,
+            "in_use": self.in_use,
+            "alive": self.page is not None,
+            "city": self.city,
+            "pages": self.pages,
+            "launched_at": self.launched_at,
+        }
+
+
+class BrowserPool:
+    """
+    线程安全的浏览器池
+
+    Args:
+        launcher: 启动浏览器的函数，参数为(port, user_data_dir)，返回页面对象，失败时返回None
+        size: 槽位数量
+    """
+
+    def __init__(self, launcher, size=POOL_SIZE):
+        self.launcher = launcher
+        self.slots = [BrowserSlot(i) for i in range(size)]
+        self._condition = threading.Condition()
+        # 最近一次冷启动的耗时，用于估算复用节省的时间
+        self._last_launch_ms = None
+
+    def _launch(self, slot):
+        """在槽位上启动浏览器并通过健康检查，端口被占用等原因失败时换端口重试"""
+        self._close(slot)
+        last_error = None
+        for attempt in range(1, MAX_LAUNCH_ATTEMPTS + 1):
+            slot.port = allocate_port()
+            os.makedirs(slot.user_data_dir, exist_ok=True)
+            start = time.perf_counter()
+            try:
+                page = self.launcher(slot.port, slot.user_data_dir)
+            except Exception as e:
+                page, last_error = None, str(e)
+            if page is not None and is_healthy(page):
+                slot.page = page
+                slot.pages = 0
+                slot.launched_at = time.time()
+                slot.launch_ms = int((time.perf_counter() - start) * 1000)
+                self._last_launch_ms = slot.launch_ms
+                metrics.BROWSER_LAUNCHES.labels(result="success").inc()
+                logger.info(f"浏览器槽位 {slot.index} 已启动，端口 {slot.port}，耗时 {slot.launch_ms} ms")
+                return page
+            metrics.BROWSER_LAUNCHES.labels(result="failed").inc()
+            logger.warning(f"浏览器槽位 {slot.index} 第 {attempt} 次启动失败（端口 {slot.port}）: {last_error}")
+            if page is not None:
+                try:
+                    page.quit()
+                except Exception:
+                    pass
+        raise RuntimeError(f"浏览器槽位 {slot.index} 启动失败: {last_error}")
+
+    def _close(self, slot, reason=None):
+        """关闭槽位上的浏览器并清理用户数据目录"""
+        if slot.page is not None:
+            if reason:
+                metrics.BROWSER_RECYCLES.labels(reason=reason).inc()
+                logger.info(f"回收浏览器槽位 {slot.index}（城市 {slot.city}，已访问 {slot.pages} 页），原因: {reason}")
+            try:
+                slot.page.quit()
+            except Exception as e:
+                logger.warning(f"关闭浏览器槽位 {slot.index} 时出错: {str(e)}")
+        slot.page = None
+        slot.city = None
+        slot.pages = 0
+        slot.launched_at = None
+        shutil.rmtree(slot.user_data_dir, ignore_errors=True)
+
+    def _recycle_reason(self, slot):
+        """需要回收时返回原因，否则返回None"""
+        if RECYCLE_PAGES and slot.pages >= RECYCLE_PAGES:
+            return "pages"
+        if RECYCLE_RSS_MB:
+            rss = browser_rss_mb(slot.page)
+            if rss is not None and rss >= RECYCLE_RSS_MB:
+                return "memory"
+        return None
+
+    def _pick_slot(self, city):
+        """
+        选择空闲槽位：优先同城市保温的浏览器，其次没有浏览器的槽位，最后是空闲最久的其他城市浏览器
+
+        在锁内调用，只做选择：空闲超时的浏览器标记为租用（其他线程不会选中），
+        由调用方释放锁后再关闭，关闭浏览器和删除用户数据目录可能需要数秒
+
+        Returns:
+            tuple: (选中的槽位，没有空闲槽位时为None, 需要在锁外关闭的空闲超时槽位列表)
+        """
+        now = time.time()
+        expired = [
+            slot for slot in self.slots
+            if not slot.in_use and slot.page is not None and slot.released_at
+            and now - slot.released_at > IDLE_SECONDS
+        ]
+        for slot in expired:
+            slot.in_use = True
+        idle = [slot for slot in self.slots if not slot.in_use]
+        if not idle:
+            # 空闲槽位都已超时：关闭后在其中一个槽位上启动新浏览器
+            return (expired[0] if expired else None), expired
+        for slot in idle:
+            if slot.page is not None and city and slot.city == city:
+                return slot, expired
+        for slot in idle:
+            if slot.page is None:
+                return slot, expired
+        return min(idle, key=lambda slot: slot.released_at or 0), expired
+
+    def _evict_idle(self, expired, keep):
+        """在锁外关闭空闲超时的浏览器，除keep外的槽位关闭后重新变为空闲"""
+        for slot in expired:
+            self._close(slot, reason="idle")
+            if slot is keep:
+                continue
+            with self._condition:
+                slot.in_use = False
+                self._condition.notify()
+
+    def acquire(self, city=None, timeout=ACQUIRE_TIMEOUT):
+        """
+        租用一个槽位并确保其中的浏览器可用
+
+        Args:
+            city: 城市代码，有同城市保温的浏览器时直接复用
+            timeout: 没有空闲槽位时的最长等待秒数
+
+        Raises:
+            BrowserPoolExhausted: 等待超时仍没有空闲槽位
+            RuntimeError: 浏览器多次启动失败
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                slot, expired = self._pick_slot(city)
+                if slot is not None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BrowserPoolExhausted(f"{timeout} 秒内没有空闲的浏览器")
+                self._condition.wait(remaining)
+            slot.in_use = True
+            slot.leased_at = time.time()
+        metrics.BROWSER_POOL_IN_USE.inc()
+
+        start = time.perf_counter()
+        try:
+            self._evict_idle(expired, keep=slot)
+            if slot.page is not None and slot.city != city:
+                self._close(slot, reason="city")
+            warm_page = slot.page
+            page = self.ensure_healthy(slot)
+        except Exception:
+            self.release(slot, recycle=True)
+            raise
+        slot.city = city
+        slot.reused = warm_page is not None and page is warm_page
+        slot.startup_ms = int((time.perf_counter() - start) * 1000)
+        if slot.reused:
+            # 复用时节省的是一次冷启动的耗时，以该槽位上次冷启动为准
+            slot.saved_ms = max(0, (slot.launch_ms or self._last_launch_ms or 0) - slot.startup_ms)
+            metrics.BROWSER_REUSES.labels(result="warm").inc()
+            logger.info(f"复用浏览器槽位 {slot.index}（城市 {city}，已访问 {slot.pages} 页），"
+                        f"节省启动时间约 {slot.saved_ms} ms")
+        else:
+            slot.saved_ms = 0
+            metrics.BROWSER_REUSES.labels(result="cold").inc()
+        return slot
+
+    def ensure_healthy(self, slot):
+        """检查租用中的浏览器，失效或达到回收条件时在原槽位重新启动，返回可用的页面对象"""
+        if slot.page is not None and is_healthy(slot.page):
+            reason = self._recycle_reason(slot)
+            if reason is None:
+                return slot.page
+            city = slot.city
+            self._close(slot, reason=reason)
+            slot.city = city
+        elif slot.page is not None:
+            metrics.BROWSER_HEALTH_CHECK_FAILURES.inc()
+            logger.warning(f"浏览器槽位 {slot.index} 已失效，重新启动")
+        return self._launch(slot)
+
+    def record_page(self, slot):
+        """记录租用中的浏览器访问了一页"""
+        slot.pages += 1
+
+    def release(self, slot, recycle=False):
+        """
+        归还槽位，浏览器默认保温留给下一个同城市的任务
+
+        Args:
+            recycle: 为True时关闭浏览器（如任务异常结束、浏览器状态不可信）
+        """
+        if recycle:
+            self._close(slot, reason="error" if slot.page is not None else None)
+        elif slot.page is not None:
+            reason = self._recycle_reason(slot)
+            if reason:
+                self._close(slot, reason=reason)
+        with self._condition:
+            slot.in_use = False
+            slot.leased_at = None
+            slot.released_at = time.time()
+            self._condition.notify()
+        metrics.BROWSER_POOL_IN_USE.dec()
+
+    def close_all(self):
+        """关闭所有浏览器，进程退出时调用"""
+        for slot in self.slots:
+            self._close(slot)
+
+    def status(self):
+        with self._condition:
+            return [slot.describe() for slot in self.slots]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(launcher):
+    """返回进程内共享的浏览器池，第一次调用时创建"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(launcher)
+            logger.info(f"浏览器池已创建，大小 {len(_pool.slots)}，用户数据目录 {PROFILE_ROOT}")
+        return _pool
@@ -0,0 +1,70 @@
+"""
+支持的城市列表
+从爬虫模块中独立出来，API查询城市不需要导入爬虫及其依赖
+"""
+
+# 城市名称到链家城市代码的映射
+SUPPORTED_CITIES = {
+    "北京": "bj",
+    "上海": "sh",
+    "广州": "gz",
+    "深圳": "sz",
+    "杭州": "hz",
+    "南京": "nj",
+    "成都": "cd",
+    "武汉": "wh",
+    "天津": "tj",
+    "西安": "xa",
+    "重庆": "cq",
+    "苏州": "su",
+    "郑州": "zz",
+    "长沙": "cs",
+    "合肥": "hf",
+    "宁波": "nb",
+    "青岛": "qd",
+    "大连": "dl",
+    "厦门": "xm",
+    "福州": "fz",
+    "济南": "jn",
+    "南昌": "nc",
+    "昆明": "km",
+    "沈阳": "sy",
+    "长春": "cc",
+    "哈尔滨": "hrb",
+    "石家庄": "sjz",
+    "太原": "ty",
+    "南宁": "nn",
+    "无锡": "wx",
+    "湖州": "huzhou",
+    "常州": "cz",
+    "嘉兴": "jx",
+    "海口": "hk",
+    "贵阳": "gy",
+    "三亚": "sanya",
+    "兰州": "lz",
+    "廊坊": "lf",
+    "保定": "bd",
+    "佛山": "fs",
+    "东莞": "dg",
+    "中山": "zs",
+    "珠海": "zh",
+    "湛江": "zhanjiang"
+}
+
+
+def get_supported_cities():
+    """获取支持的城市列表"""
+    return dict(SUPPORTED_CITIES)
+
+
+def get_city_code(city_name):
+    """
+    根据城市名称获取城市代码
+    
+    Args:
+        city_name (str): 城市名称，如"北京"、"上海"等
+        
+    Returns:
+        str: 城市代码，如"bj"、"sh"等；如果城市不支持，返回None
+    """
+    return SUPPORTED_CITIES.get(city_name)
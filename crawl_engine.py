@@ -0,0 +1,275 @@
+"""
+异步列表页抓取引擎
+原来逐页抓取、页与页之间固定随机等待，吞吐量取决于等待时间而不是站点允许的请求速率。
+这里用asyncio + aiohttp在速率预算内并发抓取多个页面：每个“host + 出口代理”一个令牌桶，
+同一进程中所有爬虫线程共享，无论多少任务并发，对同一站点同一出口IP的请求速率都不超过设定值。
+
+参数（环境变量）:
+    CRAWL_RATE         每个host+代理每秒允许的请求数，默认0.5
+    CRAWL_BURST        令牌桶容量，即允许的突发请求数，默认2
+    CRAWL_CONCURRENCY  每个任务同时进行的请求数，默认3
+    CRAWL_JITTER       每个请求拿到令牌后再随机等待 0~N 秒，默认1，0表示不加抖动
+
+引擎只负责按速率取回响应，是否为正常的列表页由调用方判断（见 listing_fetcher）。
+不依赖数据库和浏览器，可以直接对本地HTTP桩服务运行，见 benchmarks/bench_crawl_engine.py。
+
+令牌桶的速率由 AimdController 根据抓取结果调整（加性增、乘性减）：页面成功时每次加
+CRAWL_AIMD_INCREASE，遇到验证码、HTTP错误或空页面时按原因乘以对应系数，
+速率限制在 CRAWL_RATE_MIN ~ CRAWL_RATE_MAX 之间。浏览器加载的页面同样先从令牌桶取令牌。
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from urllib.parse import urlparse
+
+import aiohttp
+
+import metrics
+
+logger = logging.getLogger("crawl_engine")
+
+RATE = float(os.getenv("CRAWL_RATE", "0.5"))
+BURST = float(os.getenv("CRAWL_BURST", "2"))
+CONCURRENCY = max(1, int(os.getenv("CRAWL_CONCURRENCY", "3")))
+JITTER = float(os.getenv("CRAWL_JITTER", "1"))
+TIMEOUT = float(os.getenv("LISTING_HTTP_TIMEOUT", "15"))
+
+RATE_MIN = float(os.getenv("CRAWL_RATE_MIN", "0.05"))
+RATE_MAX = float(os.getenv("CRAWL_RATE_MAX", "2"))
+# 每个成功页面增加的速率（次/秒）
+AIMD_INCREASE = float(os.getenv("CRAWL_AIMD_INCREASE", "0.05"))
+# 两次降速之间的最短间隔秒数，同一批并发请求一起失败时只降一次
+AIMD_DECREASE_COOLDOWN = float(os.getenv("CRAWL_AIMD_COOLDOWN", "10"))
+# 各失败原因的降速系数，验证码说明已经被识别为爬虫，降得最狠
+DECREASE_FACTORS = {
+    "captcha": 0.25,
+    "redirect": 0.5,
+    "status": 0.5,
+    "error": 0.5,
+    "empty": 0.7,
+    "parse": 0.7,
+}
+
+
+class TokenBucket:
+    """
+    令牌桶，按预约方式发放令牌：取令牌时立即扣减并返回需要等待的秒数，
+    不依赖某个事件循环，多个线程各自的事件循环可以共享同一个桶
+
+    Args:
+        rate: 每秒补充的令牌数
+        burst: 桶容量
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """预约一个令牌，返回拿到令牌前需要等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def set_rate(self, rate):
+        """调整速率，已经累积的令牌保留"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def wait(self, jitter=0):
+        """同步版本的acquire，供浏览器加载和requests请求前调用"""
+        delay = self.reserve()
+        if jitter:
+            delay += random.uniform(0, jitter)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def acquire(self, jitter=0):
+        """等待拿到令牌，再加上 0~jitter 秒的随机抖动，返回实际等待的秒数"""
+        delay = self.reserve()
+        if jitter:
+            delay += random.uniform(0, jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(host, proxy=None, rate=None, burst=None):
+    """返回 host + 代理 对应的令牌桶，第一次使用时按给定速率创建"""
+    key = (host, proxy or "direct")
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate or RATE, burst or BURST)
+            _buckets[key] = bucket
+        return bucket
+
+
+class EngineResponse:
+    """
+    一个URL的抓取结果
+
+    Attributes:
+        status: HTTP状态码，请求失败时为None
+        location: 跳转地址（3xx时）
+        text: 200时的响应正文
+        error: 请求失败时的错误信息
+        waited: 等待令牌和抖动的秒数
+        seconds: 请求本身的耗时
+    """
+
+    def __init__(self, url, status=None, location="", text=None, error=None, waited=0.0, seconds=0.0):
+        self.url = url
+        self.status = status
+        self.location = location
+        self.text = text
+        self.error = error
+        self.waited = waited
+        self.seconds = seconds
+
+
+class AsyncFetchEngine:
+    """
+    在令牌桶速率内并发抓取一批URL
+
+    Args:
+        headers: 请求头（如浏览器的User-Agent）
+        cookies: {name: value}，通常来自浏览器会话
+        proxy: 出口代理URL，同时作为令牌桶的区分键
+    """
+
+    def __init__(self, headers=None, cookies=None, proxy=None, rate=RATE, burst=BURST,
+                 concurrency=CONCURRENCY, jitter=JITTER, timeout=TIMEOUT):
+        self.headers = headers or {}
+        self.cookies = cookies or {}
+        self.proxy = proxy
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.timeout = timeout
+
+    async def _fetch(self, session, semaphore, url, referer):
+        bucket = get_bucket(urlparse(url).netloc, self.proxy, self.rate, self.burst)
+        async with semaphore:
+            waited = await bucket.acquire(self.jitter)
+            metrics.CRAWLER_RATE_LIMIT_WAIT_SECONDS.observe(waited)
+            start = time.perf_counter()
+            try:
+                async with session.get(
+                    url,
+                    headers={"Referer": referer} if referer else None,
+                    proxy=self.proxy,
+                    allow_redirects=False,
+                ) as response:
+                    text = await response.text() if response.status == 200 else None
+                    return EngineResponse(
+                        url,
+                        status=response.status,
+                        location=response.headers.get("Location", ""),
+                        text=text,
+                        waited=waited,
+                        seconds=time.perf_counter() - start,
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                return EngineResponse(url, error=str(e) or type(e).__name__, waited=waited,
+                                      seconds=time.perf_counter() - start)
+
+    async def fetch_all(self, urls, referer=None):
+        """并发抓取，返回与urls顺序一致的EngineResponse列表"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(headers=self.headers, cookies=self.cookies, timeout=timeout) as session:
+            return await asyncio.gather(*(self._fetch(session, semaphore, url, referer) for url in urls))
+
+    def run(self, urls, referer=None):
+        """在当前线程中运行一个事件循环完成抓取，供爬虫线程同步调用"""
+        start = time.perf_counter()
+        responses = asyncio.run(self.fetch_all(urls, referer))
+        logger.info(f"并发抓取 {len(urls)} 个页面完成，耗时 {time.perf_counter() - start:.2f} 秒"
+                    f"（并发 {self.concurrency}）")
+        return responses
+
+
+class AimdController:
+    """
+    根据一个爬取任务的抓取结果调整 host + 代理 对应令牌桶的速率
+
+    速率保存在共享的令牌桶上，同一站点的下一个任务从上一个任务调整后的速率开始。
+    每次调整都带原因记录到日志，任务结束时汇总。
+
+    Args:
+        host: 站点域名，如 sz.zu.ke.com
+        proxy: 出口代理URL
+        task_id: 爬取任务ID，用于日志
+    """
+
+    def __init__(self, host, proxy=None, task_id=None):
+        self.host = host
+        self.task_id = task_id
+        self.bucket = get_bucket(host, proxy)
+        self.initial_rate = self.bucket.rate
+        self.changes = {}
+        self._last_decrease = None
+        self._lock = threading.Lock()
+        metrics.CRAWLER_RATE.labels(host=host).set(self.bucket.rate)
+        logger.info(f"任务 {task_id} 抓取 {host} 的初始速率 {self.bucket.rate:.3f} 次/秒")
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def wait(self, jitter=JITTER):
+        """请求前（包括浏览器加载页面前）按当前速率等待令牌"""
+        waited = self.bucket.wait(jitter)
+        metrics.CRAWLER_RATE_LIMIT_WAIT_SECONDS.observe(waited)
+        return waited
+
+    def on_success(self):
+        """页面成功抓取并解析出房源：加性增"""
+        self._set_rate(min(RATE_MAX, self.bucket.rate + AIMD_INCREASE), "success")
+
+    def on_failure(self, reason):
+        """验证码、HTTP错误或空页面：乘性减，冷却时间内只降一次（验证码总是生效）"""
+        factor = DECREASE_FACTORS.get(reason, 0.5)
+        with self._lock:
+            now = time.monotonic()
+            if (reason != "captcha" and self._last_decrease is not None
+                    and now - self._last_decrease < AIMD_DECREASE_COOLDOWN):
+                return
+            self._last_decrease = now
+        self._set_rate(max(RATE_MIN, self.bucket.rate * factor), reason)
+
+    def _set_rate(self, rate, reason):
+        previous = self.bucket.rate
+        if abs(rate - previous) < 1e-9:
+            return
+        self.bucket.set_rate(rate)
+        direction = "increase" if rate > previous else "decrease"
+        self.changes[reason] = self.changes.get(reason, 0) + 1
+        metrics.CRAWLER_RATE.labels(host=self.host).set(rate)
+        metrics.CRAWLER_RATE_CHANGES.labels(direction=direction, reason=reason).inc()
+        log = logger.info if direction == "increase" else logger.warning
+        log(f"任务 {self.task_id} 抓取 {self.host} 的速率 {previous:.3f} → {rate:.3f} 次/秒（原因: {reason}）")
+
+    def log_summary(self):
+        changes = "，".join(f"{reason} {count} 次" for reason, count in self.changes.items()) or "无"
+        logger.info(f"任务 {self.task_id} 抓取 {self.host} 的速率 {self.initial_rate:.3f} → "
+                    f"{self.bucket.rate:.3f} 次/秒，调整原因: {changes}")
@@ -0,0 +1,78 @@
+"""
+爬虫worker
+角色分离部署（TASK_DISPATCH=database）时的爬虫进程入口：
+从 jobs 队列认领crawl任务，在本进程中启动浏览器执行爬取。
+每个浏览器池槽位（BROWSER_POOL_SIZE）对应一个认领线程，不同城市并发爬取，
+同一城市由城市爬虫锁保证同时只有一个任务。
+API进程不再运行Chromium，爬虫可以单独扩容和重启；worker退出时未完成的任务
+在可见性超时后由其他worker重新认领
+
+用法:
+    python crawler_worker.py
+"""
+import os
+import signal
+import logging
+import threading
+
+import task_dispatch
+import job_queue
+import metrics
+import sampling_profiler
+import selenium_spider as spider
+import browser_pool
+
+logger = logging.getLogger("crawler_worker")
+
+# 队列为空时的轮询间隔（秒）
+POLL_INTERVAL = float(os.getenv("CRAWLER_POLL_INTERVAL", "5"))
+# 指标导出端口
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))
+
+_stop_event = threading.Event()
+
+
+def _handle_stop(signum, frame):
+    logger.info("收到停止信号，当前任务结束后退出")
+    _stop_event.set()
+
+
+def run():
+    name = task_dispatch.worker_name("crawler")
+    logger.info(f"爬虫worker {name} 启动")
+
+    signal.signal(signal.SIGTERM, _handle_stop)
+    signal.signal(signal.SIGINT, _handle_stop)
+    sampling_profiler.install_signal_handler()
+    metrics.start_worker_metrics_server(METRICS_PORT)
+    task_dispatch.install_event_forwarder()
+    # 启动时完成房源表结构检查，爬取线程入库时不再执行DDL
+    try:
+        spider.ensure_ingest_schema()
+    except Exception as e:
+        logger.error(f"检查房源表结构失败，将在爬取开始时重试: {str(e)}")
+
+    # 每个线程同时只执行一个任务，线程数等于浏览器池大小，认领到的任务总能租到浏览器
+    threads = []
+    for index in range(browser_pool.POOL_SIZE):
+        thread = threading.Thread(
+            target=job_queue.run_worker,
+            args=(["crawl"], {"crawl": spider.run_crawl_job}, f"{name}-{index}", _stop_event),
+            kwargs={"poll_interval": POLL_INTERVAL},
+            name=f"crawl-worker-{index}"
+        )
+        thread.start()
+        threads.append(thread)
+    logger.info(f"已启动 {len(threads)} 个爬虫线程")
+
+    # 主线程等待停止信号，信号处理函数只在主线程中执行
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+    spider.get_browser_pool().close_all()
+
+    logger.info(f"爬虫worker {name} 已退出")
+
+
+if __name__ == "__main__":
+    run()
@@ -5,6 +5,9 @@ import datetime
 import pandas as pd
 import numpy as np
 import psycopg2
+import event_bus
+import metrics
+import sampling_profiler
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import col, round as spark_round, avg, count, min, max, stddev, expr, when, regexp_extract, lag, date_format, explode, array_contains, from_json, lit
 from pyspark.sql.types import StructType, StructField, StringType, IntegerType, FloatType, TimestampType, ArrayType
@@ -28,6 +31,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger("data_processor")
 
+# run_all_analysis中的分析阶段总数，用于进度推送
+ANALYSIS_PHASE_TOTAL = 16
+
 class RentalDataProcessor:
     def __init__(self, db_config=None):
         """
@@ -658,6 +664,25 @@ class RentalDataProcessor:
             logger.error(f"小区租金分析失败: {str(e)}")
             return None
     
+    def _insert_analysis_result(self, cursor, analysis_type, city, pandas_df):
+        """
+        插入一条分析结果，同时记录结果行数和JSON字节数，供分析索引接口使用
+        row_count、byte_size 列由init.sql创建，旧数据库在API启动时补齐；由调用方提交事务
+        :param cursor: 数据库游标
+        :param analysis_type: 分析类型
+        :param city: 城市名称
+        :param pandas_df: 分析结果的pandas DataFrame
+        """
+        result_json = pandas_df.to_json(orient="records")
+        cursor.execute(
+            """
+            INSERT INTO analysis_result (analysis_type, city, analysis_time, result_data, row_count, byte_size)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """,
+            (analysis_type, city, datetime.datetime.now(), result_json,
+             len(pandas_df), len(result_json.encode("utf-8")))
+        )
+
     def save_analysis_to_db(self, analysis_df, analysis_type, city=None):
         """
         将分析结果保存到数据库
@@ -684,15 +709,9 @@ class RentalDataProcessor:
             )
             cursor = conn.cursor()
             
-            # 将分析结果转换为JSON字符串
+            # 将分析结果转换为JSON字符串并插入
             pandas_df = analysis_df.toPandas()
-            result_json = pandas_df.to_json(orient="records")
-            
-            # 插入分析结果
-            cursor.execute(
-                "INSERT INTO analysis_result (analysis_type, city, analysis_time, result_data) VALUES (%s, %s, %s, %s)",
-                (analysis_type, city, datetime.datetime.now(), result_json)
-            )
+            self._insert_analysis_result(cursor, analysis_type, city, pandas_df)
             
             conn.commit()
             logger.info(f"分析结果已保存到数据库，类型: {analysis_type}, 城市: {city}")
@@ -1011,10 +1030,44 @@ class RentalDataProcessor:
             logger.error(f"租金效率分析失败: {str(e)}")
             return None
     
+    def load_price_history(self, city_codes):
+        """
+        从价格历史表加载指定城市的价格记录（按 city_code 过滤，走 (city_code, observed_at) 索引）
+        :param city_codes: 城市代码列表
+        :return: Spark DataFrame，没有记录时返回None
+        """
+        # 城市代码直接拼进Spark JDBC子查询，只接受字母数字
+        city_codes = sorted({code for code in city_codes if code and str(code).isalnum()})
+        if not city_codes:
+            return None
+        
+        jdbc_url = f"jdbc:postgresql://{self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}"
+        city_list = ", ".join(f"'{code}'" for code in city_codes)
+        query = (
+            "SELECT house_id, city_code, price, unit_price, observed_at FROM house_price_history "
+            f"WHERE city_code IN ({city_list})"
+        )
+        logger.info(f"加载价格历史: {query}")
+        
+        history_df = self.spark.read.format("jdbc").options(
+            url=jdbc_url,
+            dbtable=f"({query}) as price_history",
+            user=self.db_config["user"],
+            password=self.db_config["password"],
+            driver="org.postgresql.Driver",
+            fetchsize="1000"
+        ).load()
+        
+        if history_df.rdd.isEmpty():
+            return None
+        return history_df
+    
     def analyze_price_changes(self, df):
         """
         分析同一房源在不同时间点的价格变化
-        :param df: 输入的DataFrame
+        house_info 中每个房源只保留最新一行，价格变化从 house_price_history 中读取：
+        入库时只有价格或单价变化才追加记录，相邻两条记录即为一次价格变化
+        :param df: 输入的DataFrame，用于确定分析的城市和房源，并提供标题、区域等信息
         :return: 分析结果DataFrame
         """
         try:
@@ -1022,35 +1075,39 @@ class RentalDataProcessor:
                 logger.warning("没有数据需要分析")
                 return None
             
-            # 检查是否有足够的时间跨度数据
-            distinct_dates = df.select(date_format(col("crawl_time"), "yyyy-MM-dd")).distinct().count()
-            if distinct_dates <= 1:
-                logger.warning("没有足够的时间点数据来分析价格变化，至少需要两个不同的爬取日期")
+            city_codes = [row["city_code"] for row in df.select("city_code").distinct().collect()]
+            history_df = self.load_price_history(city_codes)
+            if history_df is None:
+                logger.warning("价格历史表中没有记录，无法分析价格变化")
                 return None
             
-            logger.info(f"开始分析房源价格变化，发现 {distinct_dates} 个不同的爬取日期")
+            # 只分析本次输入中的房源，标题和区域取自house_info
+            listings_df = df.select("house_id", "title", "location_qu", "location_small").dropDuplicates(["house_id"])
+            history_df = history_df.join(listings_df, "house_id")
             
-            # 使用窗口函数，为每个house_id按时间排序
-            window_spec = Window.partitionBy("house_id").orderBy("crawl_time")
-            window_spec_desc = Window.partitionBy("house_id").orderBy(col("crawl_time").desc())
+            # 使用窗口函数，为每个house_id按观测时间排序
+            window_spec = Window.partitionBy("house_id").orderBy("observed_at")
+            window_spec_desc = Window.partitionBy("house_id").orderBy(col("observed_at").desc())
             
-            # 计算每个房源的前一次价格和当前价格
-            price_changes_df = df.withColumn("row_num", row_number().over(window_spec))
-            price_changes_df = price_changes_df.withColumn(
+            # 计算每条价格记录的前一次价格
+            price_changes_df = history_df.withColumn(
                 "prev_price", 
                 lag("price", 1).over(window_spec)
+            ).withColumn(
+                "prev_unit_price", 
+                lag("unit_price", 1).over(window_spec)
             ).withColumn(
                 "is_latest", 
                 row_number().over(window_spec_desc) == 1
             ).withColumn(
                 "date", 
-                date_format(col("crawl_time"), "yyyy-MM-dd")
+                date_format(col("observed_at"), "yyyy-MM-dd")
             ).withColumn(
                 "prev_date", 
                 lag("date", 1).over(window_spec)
             )
             
-            # 过滤出有价格变化记录的房源
+            # 每个房源的第一条记录是首次入库时的价格，不算变化
             price_changes_df = price_changes_df.filter(col("prev_price").isNotNull())
             
             # 计算价格变化和变化率
@@ -1062,6 +1119,9 @@ class RentalDataProcessor:
                 when(col("prev_price") > 0, 
                      spark_round((col("price") - col("prev_price")) / col("prev_price") * 100, 2)
                 ).otherwise(None)
+            ).withColumn(
+                "unit_price_change", 
+                spark_round(col("unit_price") - col("prev_unit_price"), 2)
             ).withColumn(
                 "price_change_category", 
                 when(col("price_change") > 0, "上涨")
@@ -1074,6 +1134,7 @@ class RentalDataProcessor:
                 "house_id", "title", "location_qu", "location_small",
                 "prev_date", "date", "prev_price", "price",
                 "price_change", "price_change_percent", "price_change_category",
+                "prev_unit_price", "unit_price", "unit_price_change",
                 "is_latest"
             )
             
@@ -1204,16 +1265,9 @@ class RentalDataProcessor:
                 if result_df is None or result_df.count() == 0:
                     continue
                     
-                # 将分析结果转换为JSON字符串
+                # 将分析结果转换为JSON字符串并插入
                 pandas_df = result_df.toPandas()
-                result_json = pandas_df.to_json(orient="records")
-                
-                # 插入分析结果
-                analysis_type = f"price_changes_{result_type}"
-                cursor.execute(
-                    "INSERT INTO analysis_result (analysis_type, city, analysis_time, result_data) VALUES (%s, %s, %s, %s)",
-                    (analysis_type, city, datetime.datetime.now(), result_json)
-                )
+                self._insert_analysis_result(cursor, f"price_changes_{result_type}", city, pandas_df)
             
             conn.commit()
             logger.info(f"价格变化分析结果已保存到数据库，城市: {city}")
@@ -1552,26 +1606,41 @@ class RentalDataProcessor:
         """
         if df is None or df.count() == 0:
             logger.warning("没有数据需要分析")
+            event_bus.publish_analysis(city, status="no_data", phase=None)
             return {}
         
         # 清洗数据
+        event_bus.publish_analysis(city, status="running", phase="clean_data", phase_index=0,
+                                   phase_total=ANALYSIS_PHASE_TOTAL, failed_phases=0, error="")
         try:
             cleaned_df = self.clean_data(df)
             if cleaned_df is None or cleaned_df.count() == 0:
                 logger.warning("清洗后没有有效数据进行分析")
+                event_bus.publish_analysis(city, status="no_data", phase="clean_data")
                 return {}
                 
             # 缓存清洗后的数据以提高性能
             cleaned_df.cache()
         except Exception as e:
             logger.error(f"数据清洗失败: {str(e)}")
+            event_bus.publish_analysis(city, status="failed", phase="clean_data", error=str(e))
             return {}
         
         # 运行各项分析
         results = {}
+        progress = {"phase_index": 0, "failed_phases": 0}
         
         # 定义辅助函数处理单个分析任务，包含错误处理和重试逻辑
         def run_analysis_task(analysis_func, analysis_name, *args, **kwargs):
+            progress["phase_index"] += 1
+            event_bus.publish_analysis(city, status="running", phase=analysis_name,
+                                       phase_index=progress["phase_index"])
+            with metrics.Timer(metrics.ANALYSIS_DURATION, analysis=analysis_name) as timer:
+                succeeded = _run_analysis_with_retries(analysis_func, analysis_name, *args, **kwargs)
+                timer.result = "success" if succeeded else "failed"
+            return succeeded
+        
+        def _run_analysis_with_retries(analysis_func, analysis_name, *args, **kwargs):
             max_retries = 2
             for attempt in range(max_retries + 1):
                 try:
@@ -1622,6 +1691,9 @@ class RentalDataProcessor:
                         time.sleep(wait_time)
                     else:
                         logger.error(f"{analysis_name}分析最终失败，跳过此项分析")
+                        progress["failed_phases"] += 1
+                        event_bus.publish_analysis(city, failed_phases=progress["failed_phases"],
+                                                   error=f"{analysis_name}: {str(e)}")
                         return False
         
         # 运行所有分析任务，错误处理确保单个任务失败不会影响其他任务
@@ -1685,6 +1757,8 @@ class RentalDataProcessor:
             pass
             
         logger.info(f"所有分析已完成，成功完成 {len(results)} 个分析任务")
+        event_bus.publish_analysis(city, status="completed", phase=None,
+                                   completed_phases=len(results))
         return results
     
     def close(self):
@@ -1740,7 +1814,64 @@ class RentalDataProcessor:
             logger.error(f"清理资源时发生错误: {str(e)}")
             logger.error(f"错误堆栈: {traceback.format_exc()}")
 
+def get_db_params():
+    """从环境变量读取分析使用的数据库连接参数，与API、爬虫使用同一个数据库"""
+    return {
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", "123456"),
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+        "database": os.getenv("DB_NAME", "rental_analysis")
+    }
+
+def run_city_analysis(city=None, task_id=None, trigger="manual", db_params=None):
+    """
+    加载数据并执行全部分析，供API后台任务、爬虫完成回调和分析worker共用
+    
+    Args:
+        city: 城市名称，为None时分析全部城市
+        task_id: 只分析指定爬虫任务的数据
+        trigger: 触发来源，manual/crawl/schedule，随进度事件推送
+        db_params: 数据库连接参数，默认读取环境变量
+    
+    Returns:
+        dict: 分析结果，没有数据时返回None
+    
+    Raises:
+        Exception: 分析失败时在推送failed事件后重新抛出
+    """
+    logger.info(f"开始数据分析，城市: {city}, 任务ID: {task_id}, 触发来源: {trigger}")
+    event_bus.publish_analysis(city, status="loading", phase="load_data", task_id=task_id,
+                               trigger=trigger, error="")
+    processor = None
+    try:
+        processor = RentalDataProcessor(db_params or get_db_params())
+        df = processor.load_data_from_db(city=city, task_id=task_id)
+        if df is None:
+            logger.warning(f"没有找到数据进行分析，城市: {city}, 任务ID: {task_id}")
+            event_bus.publish_analysis(city, status="no_data", phase=None)
+            return None
+        results = processor.run_all_analysis(df, city=city)
+        logger.info(f"数据分析完成，城市: {city}, 任务ID: {task_id}")
+        return results
+    except Exception as e:
+        logger.error(f"数据分析失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        event_bus.publish_analysis(city, status="failed", phase=None, error=str(e))
+        raise
+    finally:
+        if processor:
+            try:
+                processor.close()
+            except Exception as close_err:
+                logger.error(f"关闭数据处理器失败: {str(close_err)}")
+        import gc
+        gc.collect()
+
 if __name__ == "__main__":
+    # 独立运行时可以用 kill -USR2 <pid> 采样
+    sampling_profiler.install_signal_handler()
+    
     # 示例用法
     processor = RentalDataProcessor()
     
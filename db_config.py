@@ -1,12 +1,17 @@
 """
 数据库连接配置
 分离API和爬虫的数据库连接池，避免资源竞争
+所有连接池的连接都会记录SQL执行耗时，见 sql_timing；超过阈值的语句记入慢查询日志
 """
 import os
 import logging
+import threading
 import psycopg2
 from psycopg2 import pool
 
+import sql_timing
+import slow_query_log  # 注册慢查询记录，API和爬虫连接池都会生效
+
 # 确保logs目录存在
 logs_dir = "logs"
 if not os.path.exists(logs_dir):
@@ -46,6 +51,32 @@ CRAWLER_MAX_CONNECTIONS = 30  # 最大连接数
 AUTH_MIN_CONNECTIONS = 3
 AUTH_MAX_CONNECTIONS = 15
 
+# 已创建的连接池，按application_name登记，供监控指标读取使用情况
+_registered_pools = {}
+
+def register_pool(name, connection_pool):
+    """登记连接池，同名连接池以最新创建的为准"""
+    if connection_pool:
+        _registered_pools[name] = connection_pool
+    return connection_pool
+
+def get_registered_pools():
+    """获取所有已登记的连接池，返回 {名称: 连接池} 的副本"""
+    return dict(_registered_pools)
+
+def get_pool_usage(connection_pool):
+    """
+    获取连接池的使用情况
+    
+    Returns:
+        dict: in_use(已借出), idle(空闲), max(最大连接数)
+    """
+    return {
+        "in_use": len(getattr(connection_pool, "_used", {})),
+        "idle": len(getattr(connection_pool, "_pool", [])),
+        "max": getattr(connection_pool, "maxconn", 0),
+    }
+
 # 创建通用连接池
 def create_pool(min_conn=2, max_conn=10, application_name="rental_app"):
     """
@@ -66,10 +97,11 @@ def create_pool(min_conn=2, max_conn=10, application_name="rental_app"):
         custom_pool = psycopg2.pool.SimpleConnectionPool(
             min_conn, 
             max_conn,
+            connection_factory=sql_timing.InstrumentedConnection,
             **params
         )
         logger.info(f"{application_name}数据库连接池创建成功，连接数范围: {min_conn}-{max_conn}")
-        return custom_pool
+        return register_pool(application_name, custom_pool)
     except Exception as e:
         logger.error(f"{application_name}数据库连接池创建失败: {str(e)}")
         return None
@@ -81,10 +113,11 @@ def create_api_pool():
             API_MIN_CONNECTIONS, 
             API_MAX_CONNECTIONS,
             **DB_PARAMS,
-            application_name="rental_api"
+            application_name="rental_api",
+            connection_factory=sql_timing.InstrumentedConnection
         )
         logger.info(f"API服务数据库连接池创建成功，连接数范围: {API_MIN_CONNECTIONS}-{API_MAX_CONNECTIONS}")
-        return api_pool
+        return register_pool("rental_api", api_pool)
     except Exception as e:
         logger.error(f"API服务数据库连接池创建失败: {str(e)}")
         return None
@@ -96,14 +129,66 @@ def create_spider_pool():
             CRAWLER_MIN_CONNECTIONS, 
             CRAWLER_MAX_CONNECTIONS,
             **DB_PARAMS,
-            application_name="rental_spider"
+            application_name="rental_spider",
+            connection_factory=sql_timing.InstrumentedConnection
         )
         logger.info(f"爬虫服务数据库连接池创建成功，连接数范围: {CRAWLER_MIN_CONNECTIONS}-{CRAWLER_MAX_CONNECTIONS}")
-        return spider_pool
+        return register_pool("rental_spider", spider_pool)
     except Exception as e:
         logger.error(f"爬虫服务数据库连接池创建失败: {str(e)}")
         return None
 
+class LazyPool:
+    """
+    延迟创建的连接池
+    
+    模块导入时不连接数据库，第一次借出连接时才调用工厂函数创建真正的连接池，
+    只导入模块而不访问数据库的进程（如只提供HTTP服务的worker）不会占用连接。
+    创建失败时下次使用会重试，接口与SimpleConnectionPool的getconn/putconn/closeall一致
+    """
+    
+    def __init__(self, factory, name):
+        """
+        Args:
+            factory: 无参函数，返回连接池对象，失败时返回None
+            name: 连接池名称，用于日志
+        """
+        self._factory = factory
+        self._name = name
+        self._pool = None
+        self._lock = threading.Lock()
+    
+    def get_pool(self):
+        """获取真正的连接池，尚未创建时立即创建，失败时返回None"""
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = self._factory()
+                    if self._pool is None:
+                        logger.error(f"{self._name}数据库连接池不可用，将在下次使用时重试")
+        return self._pool
+    
+    @property
+    def initialized(self):
+        return self._pool is not None
+    
+    def __bool__(self):
+        return self.get_pool() is not None
+    
+    def getconn(self, *args, **kwargs):
+        connection_pool = self.get_pool()
+        if connection_pool is None:
+            raise Exception(f"{self._name}数据库连接池不可用")
+        return connection_pool.getconn(*args, **kwargs)
+    
+    def putconn(self, *args, **kwargs):
+        if self._pool is not None:
+            self._pool.putconn(*args, **kwargs)
+    
+    def closeall(self):
+        if self._pool is not None:
+            self._pool.closeall()
+
 # 获取数据库连接的辅助函数
 def get_connection(connection_pool):
     """从连接池获取数据库连接，确保在使用后正确归还"""
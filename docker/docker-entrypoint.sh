@@ -22,8 +22,9 @@ PGPASSWORD=$DB_PASSWORD psql -h $DB_HOST -U $DB_USER -d $DB_NAME -c "SELECT 1 FR
   PGPASSWORD=$DB_PASSWORD psql -h $DB_HOST -U $DB_USER -d $DB_NAME -f init.sql
 }
 
-# 确保目录权限正确
+# 确保目录存在且权限正确（analysis-worker等只挂载了logs，其他目录需要在这里创建）
 echo "设置目录权限..."
+mkdir -p /app/logs /app/screenshots /app/verification_sessions /app/verification_cookies /app/captcha_data
 chmod -R 755 /app/logs
 chmod -R 755 /app/screenshots
 chmod -R 755 /app/verification_sessions
@@ -0,0 +1,173 @@
+"""
+进度事件总线
+爬虫和数据分析在各自的线程中发布任务状态变化，
+API的SSE接口订阅后实时推送给前端，替代前端轮询
+"""
+import json
+import time
+import logging
+import asyncio
+import threading
+import itertools
+from collections import OrderedDict
+
+logger = logging.getLogger("event_bus")
+
+# 保留最近多少个任务/城市的最新状态，用于新连接的初始快照
+SNAPSHOT_LIMIT = 200
+# 每个订阅者最多积压的事件数，超过后丢弃最旧事件并通知客户端重新同步
+SUBSCRIBER_QUEUE_SIZE = 500
+
+
+class Subscription:
+    """单个SSE连接的订阅，事件投递到所属事件循环中的asyncio队列"""
+
+    def __init__(self, loop, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def _put(self, event):
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self.overflowed = True
+        self.queue.put_nowait(event)
+
+    def deliver(self, event):
+        """从任意线程投递事件"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # 事件循环已关闭，订阅者会在连接清理时移除
+            pass
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class EventBus:
+    """
+    线程安全的发布/订阅总线
+
+    同一个key（如某个爬虫任务）的事件会合并为该key的完整最新状态，
+    新订阅者先收到所有key的快照，之后接收增量推送
+    """
+
+    def __init__(self, snapshot_limit=SNAPSHOT_LIMIT):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._snapshots = OrderedDict()
+        self._snapshot_limit = snapshot_limit
+        self._seq = itertools.count(1)
+        self._listeners = []
+
+    def publish(self, event_type, key, data):
+        """
+        发布事件
+
+        Args:
+            event_type: 事件类型，如 task、analysis
+            key: 状态键，同一键的字段会合并
+            data: 本次变化的字段，会覆盖该key已有的同名字段
+
+        Returns:
+            dict: 合并后的事件
+        """
+        with self._lock:
+            previous = self._snapshots.pop(key, None)
+            state = dict(previous["data"]) if previous else {}
+            state.update(data)
+            event = {
+                "id": next(self._seq),
+                "event": event_type,
+                "key": key,
+                "time": time.time(),
+                "data": state,
+            }
+            self._snapshots[key] = event
+            while len(self._snapshots) > self._snapshot_limit:
+                self._snapshots.popitem(last=False)
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+
+        for subscription in subscribers:
+            subscription.deliver(event)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"事件监听器执行失败: {str(e)}")
+        return event
+
+    def subscribe(self, loop=None):
+        """在当前事件循环中创建订阅"""
+        subscription = Subscription(loop or asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def add_listener(self, listener):
+        """注册同步监听器，每个发布的事件都会回调 listener(event)"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def snapshot(self, event_type=None):
+        """获取当前所有key的最新状态"""
+        with self._lock:
+            events = list(self._snapshots.values())
+        if event_type:
+            events = [e for e in events if e["event"] == event_type]
+        return events
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+def _json_default(obj):
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+
+def format_sse(event):
+    """将事件格式化为SSE报文"""
+    payload = json.dumps(
+        {"key": event["key"], "time": event["time"], **event["data"]},
+        ensure_ascii=False,
+        default=_json_default,
+    )
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {payload}\n\n"
+
+
+# 进程内默认总线
+bus = EventBus()
+
+
+def publish_task(task_id, **fields):
+    """发布爬虫任务状态变化，值为None的字段视为未变化"""
+    if task_id is None:
+        return None
+    changes = {k: v for k, v in fields.items() if v is not None}
+    try:
+        return bus.publish("task", f"task:{task_id}", {"task_id": task_id, **changes})
+    except Exception as e:
+        logger.error(f"发布任务 {task_id} 事件失败: {str(e)}")
+        return None
+
+
+def publish_analysis(city, **fields):
+    """发布数据分析阶段变化"""
+    try:
+        return bus.publish("analysis", f"analysis:{city or 'all'}", {"city": city, **fields})
+    except Exception as e:
+        logger.error(f"发布分析事件失败: {str(e)}")
+        return None
@@ -105,6 +105,54 @@ export default {
     return api.get(`/tasks/${taskId}`);
   },
   
+  getTaskImagePrefetch(taskId) {
+    return api.get(`/tasks/${taskId}/image-prefetch`);
+  },
+  
+  // 订阅爬虫任务和数据分析的进度事件（Server-Sent Events），返回EventSource，使用完需调用close()
+  subscribeEvents(handlers = {}) {
+    const token = localStorage.getItem('token');
+    const query = token ? `?token=${encodeURIComponent(token)}` : '';
+    const source = new EventSource(`${apiBaseUrl}/events/stream${query}`);
+    Object.entries(handlers).forEach(([eventType, handler]) => {
+      source.addEventListener(eventType, event => {
+        try {
+          handler(JSON.parse(event.data));
+        } catch (error) {
+          console.error(`处理${eventType}事件失败:`, error);
+        }
+      });
+    });
+    return source;
+  },
+  
+  getAnalysisStatus(params) {
+    return api.get('/analysis/status', { params });
+  },
+  
+  // 慢查询（管理员）
+  getSlowQueries(params) {
+    return api.get('/admin/slow-queries', { params });
+  },
+  
+  getSlowQueryDetail(fingerprint) {
+    return api.get(`/admin/slow-queries/${fingerprint}`);
+  },
+  
+  // 性能采样（管理员），返回collapsed格式文本
+  profileProcess(params) {
+    return api.get('/admin/profile', { params, responseType: 'text', timeout: 90000 });
+  },
+  
+  // 任务队列（管理员）
+  getJobs(params) {
+    return api.get('/admin/jobs', { params });
+  },
+  
+  retryJob(jobId) {
+    return api.post(`/admin/jobs/${jobId}/retry`);
+  },
+  
   deleteTask(taskId) {
     return api.delete(`/tasks/${taskId}`);
   },
@@ -135,6 +183,16 @@ export default {
     return api.get(`/analysis/results/${resultId}`);
   },
   
+  // 各分析类型最新结果的索引（不含结果数据）
+  getAnalysisIndex(params) {
+    return api.get('/analysis/index', { params });
+  },
+  
+  // 获取单个分析类型的最新结果
+  getLatestAnalysis(analysisType, params) {
+    return api.get(`/analysis/latest/${analysisType}`, { params });
+  },
+  
   getAnalysisTypes() {
     return api.get('/analysis/types');
   },
@@ -277,6 +335,10 @@ export default {
     return api.delete(`/scheduled-tasks/${id}`);
   },
   
+  getScheduledTaskRuns(id, params = { limit: 20 }) {
+    return api.get(`/scheduled-tasks/${id}/runs`, { params });
+  },
+  
   // IP管理相关接口
   getCurrentIp() {
     return api.get('/api/ip/current');
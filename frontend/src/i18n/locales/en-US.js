@@ -237,7 +237,12 @@ export default {
     fetchCitiesError: 'Failed to fetch cities',
     everyDayAt: 'Daily at {time}',
     everyWeekAt: '{day} at {time}',
-    everyMonthAt: 'Monthly on day {day} at {time}'
+    everyMonthAt: 'Monthly on day {day} at {time}',
+    cron: 'Cron',
+    cronExpression: 'Cron expression',
+    cronRequired: 'Please enter a cron expression',
+    cronPlaceholder: 'minute hour day month weekday, e.g. 0 9 * * 1-5',
+    cronAt: 'Cron {expression}'
   },
   cancel: 'Cancel',
   ipManagement: {
@@ -296,6 +301,7 @@ export default {
       cannotAnalyzeInProgress: 'Task is in progress, cannot analyze data yet',
       noDataToAnalyze: 'No successfully crawled data to analyze',
       analysisStarted: 'Data analysis task started',
+      analysisMerged: 'An analysis for this city is already queued; this request was merged into it',
       analysisStartFailed: 'Failed to start data analysis task',
       cannotDeleteInProgress: 'Cannot delete a task that is in progress',
       confirmDelete: 'Are you sure you want to delete the {city} crawler task with ID {id}? This action will delete the task and related data, and cannot be undone.',
@@ -313,8 +319,10 @@ export default {
       totalItems: 'Total Items',
       successItems: 'Success Items',
       progress: 'Progress',
+      browserStartup: 'Browser Startup',
       actions: 'Actions'
     },
+    browserSaved: 'reused, saved',
     crawlerRunning: 'Crawler Task Initializing',
     waitForCrawler: 'Crawler task just started, database is processing, please check the task list later',
     remainingTime: 'Estimated time remaining',
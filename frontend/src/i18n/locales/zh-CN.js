@@ -235,7 +235,12 @@ export default {
     fetchCitiesError: '获取城市列表失败',
     everyDayAt: '每天 {time}',
     everyWeekAt: '每周{day} {time}',
-    everyMonthAt: '每月{day}日 {time}'
+    everyMonthAt: '每月{day}日 {time}',
+    cron: 'Cron表达式',
+    cronExpression: 'Cron表达式',
+    cronRequired: '请输入Cron表达式',
+    cronPlaceholder: '分 时 日 月 周，如 0 9 * * 1-5',
+    cronAt: 'Cron {expression}'
   },
   cancel: '取消',
   ipManagement: {
@@ -294,6 +299,7 @@ export default {
       cannotAnalyzeInProgress: '爬虫任务进行中，暂无法分析数据',
       noDataToAnalyze: '没有成功爬取的数据，无法进行分析',
       analysisStarted: '数据分析任务已启动',
+      analysisMerged: '该城市已有排队中的分析任务，本次请求已合并',
       analysisStartFailed: '启动数据分析任务失败',
       cannotDeleteInProgress: '爬虫任务进行中，无法删除',
       confirmDelete: '确定要删除ID为{id}的{city}爬虫任务吗？此操作将删除任务及相关数据，且不可恢复。',
@@ -311,8 +317,10 @@ export default {
       totalItems: '总条目',
       successItems: '成功条目',
       progress: '进度',
+      browserStartup: '浏览器启动',
       actions: '操作'
     },
+    browserSaved: '复用，节省',
     crawlerRunning: '爬虫任务正在初始化',
     waitForCrawler: '爬虫任务刚刚启动，数据库正在处理中，请稍后再查看任务列表',
     remainingTime: '预计剩余时间',
@@ -235,7 +235,12 @@ export default {
     fetchCitiesError: '獲取城市列表失敗',
     everyDayAt: '每天 {time}',
     everyWeekAt: '每週{day} {time}',
-    everyMonthAt: '每月{day}日 {time}'
+    everyMonthAt: '每月{day}日 {time}',
+    cron: 'Cron表達式',
+    cronExpression: 'Cron表達式',
+    cronRequired: '請輸入Cron表達式',
+    cronPlaceholder: '分 時 日 月 週，如 0 9 * * 1-5',
+    cronAt: 'Cron {expression}'
   },
   cancel: '取消',
   ipManagement: {
@@ -294,6 +299,7 @@ export default {
       cannotAnalyzeInProgress: '爬蟲任務進行中，暫無法分析數據',
       noDataToAnalyze: '沒有成功爬取的數據，無法進行分析',
       analysisStarted: '數據分析任務已啟動',
+      analysisMerged: '該城市已有排隊中的分析任務，本次請求已合併',
       analysisStartFailed: '啟動數據分析任務失敗',
       cannotDeleteInProgress: '爬蟲任務進行中，無法刪除',
       confirmDelete: '確定要刪除ID為{id}的{city}爬蟲任務嗎？此操作將刪除任務及相關數據，且不可恢復。',
@@ -311,8 +317,10 @@ export default {
       totalItems: '總條目',
       successItems: '成功條目',
       progress: '進度',
+      browserStartup: '瀏覽器啟動',
       actions: '操作'
     },
+    browserSaved: '複用，節省',
     crawlerRunning: '爬蟲任務正在初始化',
     waitForCrawler: '爬蟲任務剛剛啟動，數據庫正在處理中，請稍後再查看任務列表',
     remainingTime: '預計剩餘時間',
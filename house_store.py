@@ -0,0 +1,298 @@
+"""
+房源批量入库
+一页房源用一条多行 INSERT ... ON CONFLICT (house_id) DO UPDATE 写入，
+RETURNING (xmax = 0) 区分新插入和更新的行，一次往返得到插入/更新数量，
+不再逐个房源先 SELECT 再 UPDATE/INSERT（一页30个房源60多条语句，且检查和写入之间存在竞争）。
+
+每行带有关键字段的内容哈希（content_hash）。已存在且哈希相同的房源不重写整行，
+只在批量更新 last_seen 时标记“本次仍在列表中”，避免重复爬取同一城市时产生大量WAL、
+表膨胀和索引变动。每批返回新增、变化、未变化的房源数。
+
+新增房源和价格（或单价）与该房源最近一条历史不同的房源，同时追加一行到
+house_price_history（只追加不修改），供价格变化分析使用；house_info 中每个房源只有一行，
+重新爬取会覆盖旧价格，无法从中得到价格变化。内容未变化的房源价格一定没变，不需要检查。
+
+同一批中house_id重复的房源只保留最后一条（ON CONFLICT 不能在一条语句里两次更新同一行）。
+整批写入失败时（如旧数据中同一链接对应了不同的house_id，触发 link+city_code 唯一索引）
+退回逐行写入，每行一个保存点，单行失败不影响其他行。
+"""
+import os
+import hashlib
+import json
+import logging
+import threading
+
+import psycopg2
+from psycopg2 import errors as psycopg2_errors
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger("house_store")
+
+# 写入house_info的列，build_house_row 生成的字典使用相同的键
+HOUSE_COLUMNS = (
+    "house_id", "task_id", "link", "title", "price", "layout", "size", "floor", "direction",
+    "subway", "location_qu", "location_big", "city_code", "publish_date", "features", "image",
+    "room", "room_count", "hall_count", "bath_count", "unit_price", "created_at", "last_updated",
+    "content_hash", "last_seen",
+)
+# 参与内容哈希的字段：列表页上能看到的房源信息，派生字段（单价、户型拆分）和时间戳不参与
+HASHED_COLUMNS = (
+    "link", "title", "price", "layout", "size", "floor", "direction", "subway",
+    "location_qu", "location_big", "city_code", "publish_date", "features", "image",
+)
+# 已存在的房源更新时保留原来的 task_id 和 created_at
+UPDATE_COLUMNS = tuple(column for column in HOUSE_COLUMNS if column not in ("house_id", "task_id", "created_at"))
+
+HOUSE_UPSERT_SQL = f"""
+    INSERT INTO house_info ({", ".join(HOUSE_COLUMNS)})
+    VALUES %s
+    ON CONFLICT (house_id) DO UPDATE SET
+        {", ".join(f"{column} = EXCLUDED.{column}" for column in UPDATE_COLUMNS)}
+    WHERE house_info.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+    RETURNING (xmax = 0) AS inserted, image, house_id
+"""
+
+# 内容未变化的房源只更新last_seen（不在索引中，可以走HOT更新）
+HOUSE_TOUCH_SQL = "UPDATE house_info SET last_seen = %s WHERE house_id = ANY(%s)"
+
+# 链接已被其他house_id的旧记录占用时，按链接更新并改用新的house_id
+HOUSE_UPDATE_BY_LINK_SQL = f"""
+    UPDATE house_info SET
+        {", ".join(f"{column} = %({column})s" for column in UPDATE_COLUMNS + ("house_id",))}
+    WHERE link = %(link)s AND city_code = %(city_code)s
+"""
+
+HOUSE_ROW_TEMPLATE = "(" + ", ".join(f"%({column})s" for column in HOUSE_COLUMNS) + ")"
+
+# 与该房源最近一条价格历史比较，价格或单价不同（或还没有历史）时追加一行，
+# LATERAL子查询走 (house_id, observed_at) 索引
+PRICE_HISTORY_COLUMNS = ("house_id", "city_code", "task_id", "price", "unit_price", "observed_at")
+PRICE_HISTORY_INSERT_SQL = f"""
+    INSERT INTO house_price_history ({", ".join(PRICE_HISTORY_COLUMNS)})
+    SELECT {", ".join(f"v.{column}" for column in PRICE_HISTORY_COLUMNS)}
+    FROM (VALUES %s) AS v ({", ".join(PRICE_HISTORY_COLUMNS)})
+    LEFT JOIN LATERAL (
+        SELECT price, unit_price FROM house_price_history h
+        WHERE h.house_id = v.house_id
+        ORDER BY h.observed_at DESC
+        LIMIT 1
+    ) latest ON TRUE
+    WHERE latest.price IS DISTINCT FROM v.price OR latest.unit_price IS DISTINCT FROM v.unit_price
+"""
+PRICE_HISTORY_TEMPLATE = (
+    "(%(house_id)s, %(city_code)s, %(task_id)s::integer, %(price)s::integer, "
+    "%(unit_price)s::double precision, %(last_seen)s::timestamp)"
+)
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+# 升级表结构时等待表锁的上限
+SCHEMA_LOCK_TIMEOUT = os.getenv("HOUSE_SCHEMA_LOCK_TIMEOUT", "5s")
+
+
+def content_hash(row):
+    """房源关键字段的MD5，字段顺序固定"""
+    values = [row.get(column) for column in HASHED_COLUMNS]
+    payload = json.dumps(values, ensure_ascii=False, default=str, separators=(",", ":"))
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def _schema_missing(cursor):
+    """返回缺少的列、表和索引，全部存在时为空列表（只查询系统目录，不加表锁）"""
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'house_info'
+          AND column_name IN ('content_hash', 'last_seen')
+    """)
+    missing = [f"house_info.{column}" for column in ("content_hash", "last_seen")
+               if column not in {row[0] for row in cursor.fetchall()}]
+    for relation in ("house_price_history", "house_price_history_house_time_idx", "house_price_history_city_time_idx"):
+        cursor.execute("SELECT to_regclass(%s)", (relation,))
+        if cursor.fetchone()[0] is None:
+            missing.append(relation)
+    return missing
+
+
+def ensure_schema(conn):
+    """
+    为已有数据库补充 content_hash、last_seen 列和价格历史表（新库由init.sql创建）
+
+    在爬取开始前调用，不在入库事务中执行。先查询系统目录，只有确实缺少时才执行DDL：
+    ALTER TABLE 即使列已存在也要取得 ACCESS EXCLUSIVE 锁，会排在分析任务的长查询之后，
+    并阻塞之后所有读取 house_info 的请求，因此设置 lock_timeout，拿不到锁时放弃并报错
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        # SET LOCAL 只在事务中生效
+        autocommit = conn.autocommit
+        conn.autocommit = False
+        cursor = conn.cursor()
+        try:
+            missing = _schema_missing(cursor)
+            if missing:
+                logger.info(f"房源表结构缺少 {', '.join(missing)}，开始升级")
+                cursor.execute(f"SET LOCAL lock_timeout = '{SCHEMA_LOCK_TIMEOUT}'")
+                cursor.execute("""
+                    ALTER TABLE house_info
+                    ADD COLUMN IF NOT EXISTS content_hash VARCHAR(32),
+                    ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS house_price_history (
+                        id BIGSERIAL PRIMARY KEY,
+                        house_id VARCHAR(50) NOT NULL,
+                        city_code TEXT,
+                        task_id INTEGER,
+                        price INTEGER NOT NULL,
+                        unit_price DOUBLE PRECISION,
+                        observed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS house_price_history_house_time_idx
+                    ON house_price_history (house_id, observed_at)
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS house_price_history_city_time_idx
+                    ON house_price_history (city_code, observed_at)
+                """)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.autocommit = autocommit
+        _schema_ready = True
+
+
+def dedupe_rows(rows):
+    """按house_id去重，保留最后一条，返回(去重后的行, 被合并的行数)"""
+    unique = {}
+    for row in rows:
+        unique[row["house_id"]] = row
+    return list(unique.values()), len(rows) - len(unique)
+
+
+def record_price_history(cursor, rows):
+    """为价格或单价与最近一条历史不同的房源追加价格历史，返回追加的行数"""
+    if not rows:
+        return 0
+    execute_values(cursor, PRICE_HISTORY_INSERT_SQL, rows, template=PRICE_HISTORY_TEMPLATE, page_size=len(rows))
+    return cursor.rowcount
+
+
+def _upsert(cursor, rows):
+    """
+    执行多行upsert，内容未变化的行只更新last_seen，写入的行检查是否需要追加价格历史
+
+    Returns:
+        tuple: (插入数, 更新数, 未变化数, 价格历史行数, 新插入房源的图片)
+    """
+    returned = execute_values(
+        cursor, HOUSE_UPSERT_SQL, rows, template=HOUSE_ROW_TEMPLATE, page_size=max(len(rows), 1), fetch=True
+    )
+    written = {house_id for _, _, house_id in returned}
+    unchanged = [row["house_id"] for row in rows if row["house_id"] not in written]
+    if unchanged:
+        cursor.execute(HOUSE_TOUCH_SQL, (rows[0]["last_seen"], unchanged))
+    price_changes = record_price_history(cursor, [row for row in rows if row["house_id"] in written])
+    inserted = [image for is_insert, image, _ in returned if is_insert]
+    return (len(inserted), len(returned) - len(inserted), len(unchanged), price_changes,
+            [image for image in inserted if image])
+
+
+def _upsert_row_by_row(cursor, rows):
+    """整批失败后逐行写入，返回(插入数, 更新数, 未变化数, 价格历史行数, 失败数, 新插入房源的图片)"""
+    inserted = updated = unchanged = price_changes = failed = 0
+    new_images = []
+    for row in rows:
+        cursor.execute("SAVEPOINT house_row")
+        try:
+            row_inserted, row_updated, row_unchanged, row_price_changes, row_images = _upsert(cursor, [row])
+            inserted += row_inserted
+            updated += row_updated
+            unchanged += row_unchanged
+            price_changes += row_price_changes
+            new_images.extend(row_images)
+        except psycopg2_errors.UniqueViolation:
+            # house_id不存在但链接已被旧记录占用
+            cursor.execute("ROLLBACK TO SAVEPOINT house_row")
+            try:
+                cursor.execute(HOUSE_UPDATE_BY_LINK_SQL, row)
+                if cursor.rowcount:
+                    updated += cursor.rowcount
+                    price_changes += record_price_history(cursor, [row])
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT house_row")
+                logger.error(f"保存房源 {row['house_id']} 失败: {str(e)}")
+                failed += 1
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT house_row")
+            logger.error(f"保存房源 {row['house_id']} 失败: {str(e)}")
+            failed += 1
+        cursor.execute("RELEASE SAVEPOINT house_row")
+    return inserted, updated, unchanged, price_changes, failed, new_images
+
+
+def upsert_house_rows(conn, rows):
+    """
+    在一个事务中写入一批房源行
+
+    Args:
+        conn: 数据库连接
+        rows: 房源行字典列表，键为HOUSE_COLUMNS，content_hash为空时在这里计算
+
+    Returns:
+        dict: success（新增+变化+未变化）、failed、inserted（新增）、updated（内容变化）、
+              unchanged（内容未变化，只更新了last_seen）、price_changes（追加的价格历史行数）、
+              duplicates（同批重复被合并的行数）、new_images（新插入房源的图片URL）
+    """
+    for row in rows:
+        if not row.get("content_hash"):
+            row["content_hash"] = content_hash(row)
+    unique_rows, duplicates = dedupe_rows(rows)
+    if duplicates:
+        logger.info(f"同一批中有 {duplicates} 个重复房源，按house_id合并")
+
+    try:
+        conn.autocommit = False
+    except Exception as e:
+        logger.warning(f"设置autocommit=False失败: {str(e)}，将尝试继续执行")
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.execute("SAVEPOINT house_batch")
+            inserted, updated, unchanged, price_changes, new_images = _upsert(cursor, unique_rows)
+            failed = 0
+        except psycopg2.Error as e:
+            logger.warning(f"批量写入房源失败，改为逐行写入: {str(e)}")
+            cursor.execute("ROLLBACK TO SAVEPOINT house_batch")
+            inserted, updated, unchanged, price_changes, failed, new_images = _upsert_row_by_row(
+                cursor, unique_rows
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        try:
+            conn.autocommit = True
+        except Exception as e:
+            logger.warning(f"恢复autocommit状态失败: {str(e)}")
+
+    return {
+        "success": inserted + updated + unchanged,
+        "failed": failed,
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": unchanged,
+        "price_changes": price_changes,
+        "duplicates": duplicates,
+        "new_images": new_images,
+    }
@@ -0,0 +1,422 @@
+"""
+房源缩略图缓存
+供 /proxy/image 接口和爬虫预取阶段共用：内存缓存 + 本地磁盘缓存，
+并提供爬取完成后按限速后台预取新房源图片的功能
+"""
+import os
+import io
+import time
+import base64
+import hashlib
+import logging
+import threading
+import queue
+import datetime
+import requests
+import metrics
+
+# 确保logs目录存在
+logs_dir = "logs"
+if not os.path.exists(logs_dir):
+    os.makedirs(logs_dir)
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(logs_dir, "image_cache.log"), encoding="utf-8"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger("image_cache")
+
+# 缓存过期时间（秒）
+CACHE_EXPIRY = 3600  # 1小时
+# 内存缓存最大条目数
+MAX_MEMORY_ENTRIES = 500
+# 磁盘缓存目录，API进程与爬虫进程共享
+CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join("cache", "images"))
+# 缩略图最大宽高
+MAX_IMAGE_SIZE = (800, 600)
+
+# 预取设置
+PREFETCH_ENABLED = os.getenv("IMAGE_PREFETCH_ENABLED", "false").lower() == "true"
+PREFETCH_RATE = float(os.getenv("IMAGE_PREFETCH_RATE", "2"))  # 每秒最多请求的图片数
+PREFETCH_QUEUE_SIZE = 5000
+
+REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# 图片缓存，避免重复请求相同图片
+_memory_cache = {}
+_cache_lock = threading.Lock()
+
+
+class ImageFetchError(Exception):
+    """获取图片失败"""
+
+
+class ImageProcessError(Exception):
+    """图片处理失败"""
+
+
+def _cache_path(url):
+    """根据URL计算磁盘缓存文件路径"""
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, digest[:2], f"{digest}.b64")
+
+
+def _remember(url, data, timestamp):
+    """写入内存缓存，超出上限时清理最旧的20%"""
+    with _cache_lock:
+        _memory_cache[url] = {"data": data, "timestamp": timestamp}
+        if len(_memory_cache) > MAX_MEMORY_ENTRIES:
+            sorted_items = sorted(_memory_cache.items(), key=lambda x: x[1]["timestamp"])
+            for key, _ in sorted_items[:int(len(sorted_items) * 0.2)]:
+                del _memory_cache[key]
+
+
+def get_cached(url):
+    """
+    从缓存中读取图片
+
+    Args:
+        url: 原始图片URL
+
+    Returns:
+        str: base64编码的图片（data URI），未命中或已过期返回None
+    """
+    current_time = time.time()
+    with _cache_lock:
+        entry = _memory_cache.get(url)
+    if entry and current_time - entry["timestamp"] < CACHE_EXPIRY:
+        metrics.IMAGE_CACHE_LOOKUPS.labels(layer="memory").inc()
+        return entry["data"]
+
+    path = _cache_path(url)
+    try:
+        mtime = os.path.getmtime(path)
+        if current_time - mtime < CACHE_EXPIRY:
+            with open(path, "r", encoding="utf-8") as f:
+                data = f.read()
+            _remember(url, data, mtime)
+            metrics.IMAGE_CACHE_LOOKUPS.labels(layer="disk").inc()
+            return data
+    except OSError:
+        pass
+    metrics.IMAGE_CACHE_LOOKUPS.labels(layer="miss").inc()
+    return None
+
+
+def _store(url, data):
+    """写入内存缓存和磁盘缓存"""
+    now = time.time()
+    _remember(url, data, now)
+    path = _cache_path(url)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"写入图片磁盘缓存失败: {str(e)}")
+
+
+def _to_thumbnail(content):
+    """将原始图片缩放并转换为JPEG格式的base64 data URI"""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(content))
+
+    # 调整为合理的大小，如果图片太大
+    if image.width > MAX_IMAGE_SIZE[0] or image.height > MAX_IMAGE_SIZE[1]:
+        image.thumbnail(MAX_IMAGE_SIZE, Image.LANCZOS)
+
+    # JPEG不支持调色板和透明通道，先转换为RGB模式
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=85)
+    base64_data = base64.b64encode(output.getvalue()).decode('utf-8')
+    return f"data:image/jpeg;base64,{base64_data}"
+
+
+def fetch_image(url, timeout=10, session=None):
+    """
+    获取图片的base64编码，优先使用缓存
+
+    Args:
+        url: 原始图片URL
+        timeout: 请求超时时间（秒）
+        session: 可选的requests.Session，用于复用连接
+
+    Returns:
+        str: base64编码的图片（data URI）
+
+    Raises:
+        ImageFetchError: 下载图片失败
+        ImageProcessError: 图片处理失败
+    """
+    cached = get_cached(url)
+    if cached:
+        return cached
+
+    try:
+        response = (session or requests).get(url, headers=REQUEST_HEADERS, timeout=timeout)
+        response.raise_for_status()
+    except requests.RequestException as err:
+        raise ImageFetchError(str(err)) from err
+
+    try:
+        data = _to_thumbnail(response.content)
+    except Exception as img_err:
+        raise ImageProcessError(str(img_err)) from img_err
+
+    _store(url, data)
+    return data
+
+
+# ---------------------------------------------------------------------------
+# 爬取后的缩略图预取
+# ---------------------------------------------------------------------------
+
+class _TaskProgress:
+    """
+    单个爬虫任务的预取进度，定期把上次写回之后的增量累加到数据库
+
+    按增量写回，任务的图片全部处理完后可以从内存中移除，之后同一任务再提交图片时
+    新建的进度对象继续累加，不会覆盖已写入的计数
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.queued = 0
+        self.done = 0
+        self.cached = 0
+        self.failed = 0
+        self.last_error = None
+        self.dirty = False
+        # 已写回数据库的 (queued, done, cached, failed)
+        self.flushed = (0, 0, 0, 0)
+        # 同一进度的写回串行执行，避免重复累加同一段增量
+        self.flush_lock = threading.Lock()
+
+    def counts(self):
+        return self.queued, self.done, self.cached, self.failed
+
+    def finished(self):
+        return self.done + self.cached + self.failed >= self.queued
+
+
+class ThumbnailPrefetcher:
+    """
+    按限速在后台线程中预取房源缩略图
+
+    爬虫每保存一页房源后调用 enqueue 提交新插入房源的图片URL，
+    后台线程按 PREFETCH_RATE 的速度下载并缩放图片写入缓存，
+    各任务的进度和失败情况记录到 image_prefetch_status 表
+    """
+
+    FLUSH_EVERY = 10
+
+    def __init__(self, connection_pool, rate=PREFETCH_RATE):
+        self.connection_pool = connection_pool
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._queue = queue.Queue(maxsize=PREFETCH_QUEUE_SIZE)
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._session = requests.Session()
+        self._table_checked = False
+
+    def enqueue(self, task_id, urls):
+        """
+        提交需要预取的图片URL
+
+        Args:
+            task_id: 爬虫任务ID
+            urls: 图片URL列表
+
+        Returns:
+            int: 实际加入队列的URL数量
+        """
+        urls = [u for u in dict.fromkeys(urls or []) if u and u.startswith("http")]
+        if not urls:
+            return 0
+
+        with self._lock:
+            progress = self._progress.setdefault(task_id, _TaskProgress(task_id))
+
+        added = 0
+        for url in urls:
+            try:
+                self._queue.put_nowait((task_id, url))
+                added += 1
+            except queue.Full:
+                logger.warning(f"图片预取队列已满，丢弃任务 {task_id} 的剩余 {len(urls) - added} 个URL")
+                break
+
+        with self._lock:
+            progress.queued += added
+            progress.dirty = True
+        self._flush(progress)
+        self._ensure_worker()
+        return added
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="image-prefetch", daemon=True)
+            self._thread.start()
+            logger.info(f"图片预取线程已启动，速率: {PREFETCH_RATE}/秒")
+
+    def _run(self):
+        while True:
+            try:
+                task_id, url = self._queue.get(timeout=60)
+            except queue.Empty:
+                # 长时间空闲时把剩余进度写回数据库
+                self._flush_all()
+                continue
+
+            started = time.time()
+            with self._lock:
+                progress = self._progress.setdefault(task_id, _TaskProgress(task_id))
+            try:
+                if get_cached(url):
+                    outcome = "cached"
+                else:
+                    fetch_image(url, timeout=10, session=self._session)
+                    outcome = "done"
+            except (ImageFetchError, ImageProcessError) as e:
+                outcome = "failed"
+                error = f"{url}: {str(e)}"
+                logger.warning(f"任务 {task_id} 预取图片失败: {error}")
+            except Exception as e:
+                outcome = "failed"
+                error = f"{url}: {str(e)}"
+                logger.error(f"任务 {task_id} 预取图片出现异常: {error}")
+
+            with self._lock:
+                if outcome == "cached":
+                    progress.cached += 1
+                elif outcome == "done":
+                    progress.done += 1
+                else:
+                    progress.failed += 1
+                    progress.last_error = error[:500]
+                progress.dirty = True
+                finished = progress.done + progress.cached + progress.failed
+            if finished % self.FLUSH_EVERY == 0 or progress.finished():
+                self._flush(progress)
+            self._queue.task_done()
+
+            # 限速：缓存命中不计入请求速率
+            if outcome != "cached" and self.interval:
+                elapsed = time.time() - started
+                if elapsed < self.interval:
+                    time.sleep(self.interval - elapsed)
+
+    def _flush_all(self):
+        with self._lock:
+            pending = [p for p in self._progress.values() if p.dirty]
+        for progress in pending:
+            self._flush(progress)
+
+    def _ensure_table(self, cursor):
+        if self._table_checked:
+            return
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS image_prefetch_status (
+                task_id INTEGER PRIMARY KEY REFERENCES crawl_task(id) ON DELETE CASCADE,
+                queued INTEGER DEFAULT 0 NOT NULL,
+                done INTEGER DEFAULT 0 NOT NULL,
+                cached INTEGER DEFAULT 0 NOT NULL,
+                failed INTEGER DEFAULT 0 NOT NULL,
+                last_error TEXT,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+            )
+        """)
+        self._table_checked = True
+
+    def _flush(self, progress):
+        """将任务进度的增量累加到 image_prefetch_status 表，全部处理完且已写回的任务从内存中移除"""
+        if not self.connection_pool:
+            return
+        with progress.flush_lock:
+            with self._lock:
+                if not progress.dirty:
+                    return
+                counts = progress.counts()
+                delta = tuple(current - flushed for current, flushed in zip(counts, progress.flushed))
+                row = (progress.task_id, *delta, progress.last_error, datetime.datetime.now())
+                progress.dirty = False
+
+            conn = None
+            try:
+                conn = self.connection_pool.getconn()
+                cursor = conn.cursor()
+                self._ensure_table(cursor)
+                cursor.execute("""
+                    INSERT INTO image_prefetch_status
+                        (task_id, queued, done, cached, failed, last_error, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (task_id) DO UPDATE SET
+                        queued = image_prefetch_status.queued + EXCLUDED.queued,
+                        done = image_prefetch_status.done + EXCLUDED.done,
+                        cached = image_prefetch_status.cached + EXCLUDED.cached,
+                        failed = image_prefetch_status.failed + EXCLUDED.failed,
+                        last_error = COALESCE(EXCLUDED.last_error, image_prefetch_status.last_error),
+                        updated_at = EXCLUDED.updated_at
+                """, row)
+                conn.commit()
+            except Exception as e:
+                logger.error(f"记录任务 {progress.task_id} 图片预取进度失败: {str(e)}")
+                if conn:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                # 写回失败，保留增量等下次写回
+                with self._lock:
+                    progress.dirty = True
+                return
+            finally:
+                if conn:
+                    self.connection_pool.putconn(conn)
+
+            with self._lock:
+                progress.flushed = counts
+                if not progress.dirty and progress.finished() and self._progress.get(progress.task_id) is progress:
+                    del self._progress[progress.task_id]
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def prefetch_images(task_id, urls, connection_pool):
+    """
+    提交爬虫任务新插入房源的图片进行后台预取
+
+    需要设置环境变量 IMAGE_PREFETCH_ENABLED=true 才会生效
+
+    Args:
+        task_id: 爬虫任务ID
+        urls: 图片URL列表
+        connection_pool: 用于记录预取进度的数据库连接池
+
+    Returns:
+        int: 加入预取队列的URL数量
+    """
+    global _prefetcher
+    if not PREFETCH_ENABLED or not urls:
+        return 0
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = ThumbnailPrefetcher(connection_pool)
+    return _prefetcher.enqueue(task_id, urls)
@@ -100,7 +100,9 @@ CREATE TABLE public.analysis_result (
     city character varying(50),
     task_id integer,
     analysis_time timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
-    result_data jsonb NOT NULL
+    result_data jsonb NOT NULL,
+    row_count integer,
+    byte_size integer
 );
 
 
@@ -162,7 +164,9 @@ CREATE TABLE public.crawl_task (
     error text,
     planned_pages integer,
     expected_end_time timestamp without time zone,
-    queue_position integer DEFAULT 0
+    queue_position integer DEFAULT 0,
+    browser_startup_ms integer,
+    browser_startup_saved_ms integer
 );
 
 
@@ -202,7 +206,10 @@ CREATE TABLE public.crawled_pages (
     crawl_time timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
     success boolean DEFAULT false NOT NULL,
     retry_count integer DEFAULT 0,
-    error_message text
+    error_message text,
+    new_items integer,
+    changed_items integer,
+    unchanged_items integer
 );
 
 
@@ -338,7 +345,9 @@ CREATE TABLE public.house_info (
     publish_date text,
     features text,
     created_at timestamp without time zone,
-    last_updated timestamp without time zone
+    last_updated timestamp without time zone,
+    content_hash character varying(32),
+    last_seen timestamp without time zone
 );
 
 ALTER TABLE public.house_info OWNER TO postgres;
@@ -365,6 +374,62 @@ ALTER TABLE public.house_info_id_seq OWNER TO postgres;
 ALTER SEQUENCE public.house_info_id_seq OWNED BY public.house_info.id;
 
 
+--
+-- Name: house_price_history; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.house_price_history (
+    id bigint NOT NULL,
+    house_id character varying(50) NOT NULL,
+    city_code text,
+    task_id integer,
+    price integer NOT NULL,
+    unit_price double precision,
+    observed_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+
+ALTER TABLE public.house_price_history OWNER TO postgres;
+
+--
+-- Name: house_price_history_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+CREATE SEQUENCE public.house_price_history_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+ALTER TABLE public.house_price_history_id_seq OWNER TO postgres;
+
+--
+-- Name: house_price_history_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: postgres
+--
+
+ALTER SEQUENCE public.house_price_history_id_seq OWNED BY public.house_price_history.id;
+
+
+--
+-- Name: image_prefetch_status; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.image_prefetch_status (
+    task_id integer NOT NULL,
+    queued integer DEFAULT 0 NOT NULL,
+    done integer DEFAULT 0 NOT NULL,
+    cached integer DEFAULT 0 NOT NULL,
+    failed integer DEFAULT 0 NOT NULL,
+    last_error text,
+    started_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    updated_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+
+ALTER TABLE public.image_prefetch_status OWNER TO postgres;
+
 --
 -- Name: ip_settings; Type: TABLE; Schema: public; Owner: postgres
 --
@@ -403,6 +468,52 @@ ALTER TABLE public.ip_settings_id_seq OWNER TO postgres;
 ALTER SEQUENCE public.ip_settings_id_seq OWNED BY public.ip_settings.id;
 
 
+--
+-- Name: jobs; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.jobs (
+    id bigint NOT NULL,
+    kind character varying(30) NOT NULL,
+    payload jsonb DEFAULT '{}'::jsonb NOT NULL,
+    priority integer DEFAULT 0 NOT NULL,
+    status character varying(20) DEFAULT 'queued'::character varying NOT NULL,
+    attempts integer DEFAULT 0 NOT NULL,
+    max_attempts integer DEFAULT 3 NOT NULL,
+    run_after timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    locked_by character varying(100),
+    locked_until timestamp without time zone,
+    last_error text,
+    created_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    started_at timestamp without time zone,
+    finished_at timestamp without time zone,
+    dedupe_key character varying(100)
+);
+
+
+ALTER TABLE public.jobs OWNER TO postgres;
+
+--
+-- Name: jobs_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+CREATE SEQUENCE public.jobs_id_seq
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+ALTER TABLE public.jobs_id_seq OWNER TO postgres;
+
+--
+-- Name: jobs_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: postgres
+--
+
+ALTER SEQUENCE public.jobs_id_seq OWNED BY public.jobs.id;
+
+
 --
 -- Name: password_resets; Type: TABLE; Schema: public; Owner: postgres
 --
@@ -482,6 +593,48 @@ ALTER TABLE public.proxies_id_seq OWNER TO postgres;
 ALTER SEQUENCE public.proxies_id_seq OWNED BY public.proxies.id;
 
 
+--
+-- Name: scheduled_task_runs; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.scheduled_task_runs (
+    id integer NOT NULL,
+    scheduled_task_id integer NOT NULL,
+    scheduled_for timestamp without time zone NOT NULL,
+    status character varying(20) NOT NULL,
+    missed_runs integer DEFAULT 0 NOT NULL,
+    crawl_task_id integer,
+    job_id bigint,
+    leader character varying(100),
+    error text,
+    created_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+
+ALTER TABLE public.scheduled_task_runs OWNER TO postgres;
+
+--
+-- Name: scheduled_task_runs_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+CREATE SEQUENCE public.scheduled_task_runs_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+ALTER TABLE public.scheduled_task_runs_id_seq OWNER TO postgres;
+
+--
+-- Name: scheduled_task_runs_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: postgres
+--
+
+ALTER SEQUENCE public.scheduled_task_runs_id_seq OWNED BY public.scheduled_task_runs.id;
+
+
 --
 -- Name: scheduled_tasks; Type: TABLE; Schema: public; Owner: postgres
 --
@@ -735,6 +888,13 @@ ALTER TABLE ONLY public.current_ip ALTER COLUMN id SET DEFAULT nextval('public.c
 ALTER TABLE ONLY public.house_info ALTER COLUMN id SET DEFAULT nextval('public.house_info_id_seq'::regclass);
 
 
+--
+-- Name: house_price_history id; Type: DEFAULT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.house_price_history ALTER COLUMN id SET DEFAULT nextval('public.house_price_history_id_seq'::regclass);
+
+
 --
 -- Name: ip_settings id; Type: DEFAULT; Schema: public; Owner: postgres
 --
@@ -742,6 +902,13 @@ ALTER TABLE ONLY public.house_info ALTER COLUMN id SET DEFAULT nextval('public.h
 ALTER TABLE ONLY public.ip_settings ALTER COLUMN id SET DEFAULT nextval('public.ip_settings_id_seq'::regclass);
 
 
+--
+-- Name: jobs id; Type: DEFAULT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.jobs ALTER COLUMN id SET DEFAULT nextval('public.jobs_id_seq'::regclass);
+
+
 --
 -- Name: password_resets id; Type: DEFAULT; Schema: public; Owner: postgres
 --
@@ -756,6 +923,13 @@ ALTER TABLE ONLY public.password_resets ALTER COLUMN id SET DEFAULT nextval('pub
 ALTER TABLE ONLY public.proxies ALTER COLUMN id SET DEFAULT nextval('public.proxies_id_seq'::regclass);
 
 
+--
+-- Name: scheduled_task_runs id; Type: DEFAULT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.scheduled_task_runs ALTER COLUMN id SET DEFAULT nextval('public.scheduled_task_runs_id_seq'::regclass);
+
+
 --
 -- Name: scheduled_tasks id; Type: DEFAULT; Schema: public; Owner: postgres
 --
@@ -811,7 +985,7 @@ COPY public.city_locks (city, lock_time, lock_expiry) FROM stdin;
 -- Data for Name: crawl_task; Type: TABLE DATA; Schema: public; Owner: postgres
 --
 
-COPY public.crawl_task (id, city, city_code, start_time, end_time, status, total_items, success_items, error_message, success_count, success_pages, failed_pages, total_pages, error, planned_pages, expected_end_time, queue_position) FROM stdin;
+COPY public.crawl_task (id, city, city_code, start_time, end_time, status, total_items, success_items, error_message, success_count, success_pages, failed_pages, total_pages, error, planned_pages, expected_end_time, queue_position, browser_startup_ms, browser_startup_saved_ms) FROM stdin;
 \.
 
 
@@ -819,7 +993,7 @@ COPY public.crawl_task (id, city, city_code, start_time, end_time, status, total
 -- Data for Name: crawled_pages; Type: TABLE DATA; Schema: public; Owner: postgres
 --
 
-COPY public.crawled_pages (id, task_id, page_number, page_url, crawl_time, success, retry_count, error_message) FROM stdin;
+COPY public.crawled_pages (id, task_id, page_number, page_url, crawl_time, success, retry_count, error_message, new_items, changed_items, unchanged_items) FROM stdin;
 \.
 
 
@@ -843,7 +1017,7 @@ COPY public.current_ip (id, ip, location, isp, country, region, city, last_chang
 -- Data for Name: house_info; Type: TABLE DATA; Schema: public; Owner: postgres
 --
 
-COPY public.house_info (id, house_id, task_id, title, price, location_qu, location_big, location_small, size, direction, room, floor, image, link, unit_price, room_count, hall_count, bath_count, crawl_time, layout, subway, city_code, publish_date, features, created_at, last_updated) FROM stdin;
+COPY public.house_info (id, house_id, task_id, title, price, location_qu, location_big, location_small, size, direction, room, floor, image, link, unit_price, room_count, hall_count, bath_count, crawl_time, layout, subway, city_code, publish_date, features, created_at, last_updated, content_hash, last_seen) FROM stdin;
 \.
 
 
@@ -970,6 +1144,13 @@ SELECT pg_catalog.setval('public.current_ip_id_seq', 5, true);
 SELECT pg_catalog.setval('public.house_info_id_seq', 1, false);
 
 
+--
+-- Name: house_price_history_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
+--
+
+SELECT pg_catalog.setval('public.house_price_history_id_seq', 1, false);
+
+
 --
 -- Name: ip_settings_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
 --
@@ -977,6 +1158,13 @@ SELECT pg_catalog.setval('public.house_info_id_seq', 1, false);
 SELECT pg_catalog.setval('public.ip_settings_id_seq', 1, true);
 
 
+--
+-- Name: jobs_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
+--
+
+SELECT pg_catalog.setval('public.jobs_id_seq', 1, false);
+
+
 --
 -- Name: password_resets_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
 --
@@ -991,6 +1179,13 @@ SELECT pg_catalog.setval('public.password_resets_id_seq', 1, false);
 SELECT pg_catalog.setval('public.proxies_id_seq', 1, false);
 
 
+--
+-- Name: scheduled_task_runs_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
+--
+
+SELECT pg_catalog.setval('public.scheduled_task_runs_id_seq', 1, false);
+
+
 --
 -- Name: scheduled_tasks_id_seq; Type: SEQUENCE SET; Schema: public; Owner: postgres
 --
@@ -1106,6 +1301,22 @@ ALTER TABLE ONLY public.house_info
     ADD CONSTRAINT house_info_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: house_price_history house_price_history_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.house_price_history
+    ADD CONSTRAINT house_price_history_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: image_prefetch_status image_prefetch_status_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.image_prefetch_status
+    ADD CONSTRAINT image_prefetch_status_pkey PRIMARY KEY (task_id);
+
+
 --
 -- Name: ip_settings ip_settings_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -1114,6 +1325,14 @@ ALTER TABLE ONLY public.ip_settings
     ADD CONSTRAINT ip_settings_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: jobs jobs_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.jobs
+    ADD CONSTRAINT jobs_pkey PRIMARY KEY (id);
+
+
 --
 -- Name: password_resets password_resets_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -1146,6 +1365,22 @@ ALTER TABLE ONLY public.proxies
     ADD CONSTRAINT proxies_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: scheduled_task_runs scheduled_task_runs_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.scheduled_task_runs
+    ADD CONSTRAINT scheduled_task_runs_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: scheduled_task_runs scheduled_task_runs_scheduled_task_id_scheduled_for_key; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.scheduled_task_runs
+    ADD CONSTRAINT scheduled_task_runs_scheduled_task_id_scheduled_for_key UNIQUE (scheduled_task_id, scheduled_for);
+
+
 --
 -- Name: scheduled_tasks scheduled_tasks_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -1218,6 +1453,13 @@ ALTER TABLE ONLY public.verification_session
     ADD CONSTRAINT verification_session_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: analysis_result_type_city_time_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX analysis_result_type_city_time_idx ON public.analysis_result USING btree (analysis_type, city, analysis_time DESC);
+
+
 --
 -- Name: house_info_url_city_idx; Type: INDEX; Schema: public; Owner: postgres
 --
@@ -1225,6 +1467,34 @@ ALTER TABLE ONLY public.verification_session
 CREATE UNIQUE INDEX house_info_url_city_idx ON public.house_info USING btree (link, city_code);
 
 
+--
+-- Name: house_price_history_city_time_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX house_price_history_city_time_idx ON public.house_price_history USING btree (city_code, observed_at);
+
+
+--
+-- Name: house_price_history_house_time_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX house_price_history_house_time_idx ON public.house_price_history USING btree (house_id, observed_at);
+
+
+--
+-- Name: jobs_claim_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX jobs_claim_idx ON public.jobs USING btree (kind, priority DESC, run_after, id) WHERE ((status)::text = ANY ((ARRAY['queued'::character varying, 'running'::character varying])::text[]));
+
+
+--
+-- Name: jobs_dedupe_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE UNIQUE INDEX jobs_dedupe_idx ON public.jobs USING btree (kind, dedupe_key) WHERE (((status)::text = 'queued'::text) AND (dedupe_key IS NOT NULL));
+
+
 --
 -- Name: analysis_result analysis_result_task_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -1249,6 +1519,30 @@ ALTER TABLE ONLY public.house_info
     ADD CONSTRAINT house_info_task_id_fkey FOREIGN KEY (task_id) REFERENCES public.crawl_task(id);
 
 
+--
+-- Name: image_prefetch_status image_prefetch_status_task_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.image_prefetch_status
+    ADD CONSTRAINT image_prefetch_status_task_id_fkey FOREIGN KEY (task_id) REFERENCES public.crawl_task(id) ON DELETE CASCADE;
+
+
+--
+-- Name: scheduled_task_runs scheduled_task_runs_crawl_task_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.scheduled_task_runs
+    ADD CONSTRAINT scheduled_task_runs_crawl_task_id_fkey FOREIGN KEY (crawl_task_id) REFERENCES public.crawl_task(id) ON DELETE SET NULL;
+
+
+--
+-- Name: scheduled_task_runs scheduled_task_runs_scheduled_task_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.scheduled_task_runs
+    ADD CONSTRAINT scheduled_task_runs_scheduled_task_id_fkey FOREIGN KEY (scheduled_task_id) REFERENCES public.scheduled_tasks(id) ON DELETE CASCADE;
+
+
 --
 -- Name: user_settings user_settings_user_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -34,17 +34,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger("ip_manager")
 
-# 创建IP管理器专用的数据库连接池
-try:
-    ip_manager_pool = db_config.create_pool(
+# IP管理器专用的数据库连接池，第一次使用时才建立连接
+ip_manager_pool = db_config.LazyPool(
+    lambda: db_config.create_pool(
         min_conn=1, 
         max_conn=5, 
         application_name="ip_manager"
-    )
-    logger.info("IP管理器数据库连接池创建成功")
-except Exception as e:
-    logger.error(f"IP管理器数据库连接池创建失败: {str(e)}")
-    ip_manager_pool = None
+    ),
+    "IP管理器"
+)
 
 # 创建装饰器实例
 with_db_connection = db_utils.with_db_connection(ip_manager_pool)
@@ -0,0 +1,656 @@
+"""
+基于PostgreSQL的持久化任务队列
+爬取、分析、维护等后台工作统一写入 jobs 表，任意数量的worker用 FOR UPDATE SKIP LOCKED 安全地认领：
+
+- 可见性超时：认领后在 locked_until 之前必须完成或续期（heartbeat），
+  超时未续期视为worker已退出，任务可以被其他worker重新认领
+- 重试：失败后按指数退避（带随机抖动）重新排队
+- 死信：重试次数用尽后状态改为 dead，保留错误信息，可由管理员手动重试
+- 合并：带 dedupe_key 的任务在排队期间只保留一条，重复提交合并到已排队的任务上
+
+进程退出不会丢失排队中的任务
+
+入队时 NOTIFY rental_jobs（负载为任务类型），空闲的worker在专用连接上 LISTEN，
+收到对应类型的通知后立即认领；轮询间隔只作为后备（延迟重试的任务、通知连接断开时）
+"""
+import os
+import json
+import time
+import random
+import select
+import logging
+import threading
+import psycopg2
+from psycopg2 import errors as psycopg2_errors
+from psycopg2.extras import RealDictCursor, Json
+
+import db_config
+
+logger = logging.getLogger("job_queue")
+
+# 认领后的默认可见性超时（秒）
+VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+# 默认最大尝试次数
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# 重试退避的基础时间和上限（秒）
+RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = 3600
+# 唤醒worker的NOTIFY通道
+JOB_CHANNEL = "rental_jobs"
+
+# 任务队列专用的数据库连接池
+connection_pool = db_config.LazyPool(
+    lambda: db_config.create_pool(
+        min_conn=1,
+        max_conn=5,
+        application_name="job_queue"
+    ),
+    "任务队列"
+)
+
+_schema_ready = False
+
+
+class RetryLater(Exception):
+    """处理函数抛出此异常时任务重新排队，不计入尝试次数（如资源暂时被占用）"""
+
+    def __init__(self, delay_seconds=30, reason=""):
+        super().__init__(reason or f"{delay_seconds} 秒后重试")
+        self.delay_seconds = delay_seconds
+
+
+def ensure_schema():
+    """创建jobs表，旧数据库升级时使用，新库由init.sql创建"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id BIGSERIAL PRIMARY KEY,
+                kind VARCHAR(30) NOT NULL,
+                payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 3,
+                run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                dedupe_key VARCHAR(100),
+                locked_by VARCHAR(100),
+                locked_until TIMESTAMP,
+                last_error TEXT,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+            """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS jobs_claim_idx
+            ON jobs (kind, priority DESC, run_after, id)
+            WHERE status IN ('queued', 'running')
+            """
+        )
+        cursor.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS dedupe_key VARCHAR(100)")
+        cursor.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedupe_idx
+            ON jobs (kind, dedupe_key)
+            WHERE status = 'queued' AND dedupe_key IS NOT NULL
+            """
+        )
+        conn.commit()
+        _schema_ready = True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"创建jobs表失败: {str(e)}")
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+# 合并时默认的负载处理：新提交的参数覆盖旧参数，并记录合并次数
+DEFAULT_MERGE_PAYLOAD = "jobs.payload || EXCLUDED.payload"
+
+
+def enqueue(kind, payload=None, priority=0, delay_seconds=0, max_attempts=None, cursor=None,
+            dedupe_key=None, merge_payload=DEFAULT_MERGE_PAYLOAD):
+    """
+    写入任务
+
+    Args:
+        kind: 任务类型，如 crawl、analysis、maintenance
+        payload: 任务参数，保存为jsonb
+        priority: 优先级，数值越大越先执行
+        delay_seconds: 延迟多少秒后才可被认领
+        max_attempts: 最大尝试次数，默认 JOB_MAX_ATTEMPTS
+        cursor: 传入时在调用方的事务中写入，由调用方提交
+        dedupe_key: 合并键，已有相同kind和合并键的任务在排队时不再新增，
+            而是合并到该任务：优先级取较高者、可执行时间取较早者
+        merge_payload: 合并时新负载的SQL表达式，jobs为已排队的任务，EXCLUDED为本次提交
+
+    Returns:
+        dict: {"id": 任务ID, "coalesced": 是否合并到了已排队的任务}
+    """
+    sql = f"""
+        INSERT INTO jobs (kind, payload, priority, max_attempts, run_after, dedupe_key)
+        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s), %s)
+        ON CONFLICT (kind, dedupe_key) WHERE status = 'queued' AND dedupe_key IS NOT NULL
+        DO UPDATE SET
+            payload = jsonb_set({merge_payload}, '{{coalesced}}',
+                                to_jsonb(COALESCE((jobs.payload->>'coalesced')::int, 0) + 1)),
+            priority = GREATEST(jobs.priority, EXCLUDED.priority),
+            run_after = LEAST(jobs.run_after, EXCLUDED.run_after)
+        RETURNING id, (xmax <> 0) AS coalesced
+    """
+    params = (kind, Json(payload or {}), priority, max_attempts or DEFAULT_MAX_ATTEMPTS, delay_seconds, dedupe_key)
+
+    if cursor is not None:
+        # 调用方可能使用RealDictCursor，在同一连接（同一事务）上另开普通游标
+        cur = cursor.connection.cursor()
+        cur.execute(sql, params)
+        job_id, coalesced = cur.fetchone()
+        cur.execute("SELECT pg_notify(%s, %s)", (JOB_CHANNEL, kind))
+        return {"id": job_id, "coalesced": coalesced}
+
+    ensure_schema()
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        job_id, coalesced = cur.fetchone()
+        cur.execute("SELECT pg_notify(%s, %s)", (JOB_CHANNEL, kind))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+    if coalesced:
+        logger.info(f"{kind} 任务已合并到排队中的任务 {job_id}（合并键 {dedupe_key}）")
+    else:
+        logger.info(f"已写入 {kind} 任务 {job_id}")
+    return {"id": job_id, "coalesced": coalesced}
+
+
+def claim(kinds, worker, visibility_timeout=VISIBILITY_TIMEOUT):
+    """
+    认领一个可执行的任务
+
+    可执行指：排队中且到了run_after时间，或执行中但可见性超时已过且还有剩余尝试次数。
+    按优先级、可执行时间、ID顺序认领
+
+    Returns:
+        dict: 任务记录，没有可执行的任务时返回None
+    """
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET status = 'running',
+                attempts = attempts + 1,
+                locked_by = %s,
+                locked_until = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                started_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE kind = ANY(%s)
+                  AND (
+                      (status = 'queued' AND run_after <= CURRENT_TIMESTAMP)
+                      OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP
+                          AND attempts < max_attempts)
+                  )
+                ORDER BY priority DESC, run_after, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+            """,
+            (worker, visibility_timeout, list(kinds))
+        )
+        job = cursor.fetchone()
+        conn.commit()
+        return dict(job) if job else None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def _update_owned(job_id, worker, sql, params):
+    """只更新仍由该worker持有的任务，返回是否更新成功"""
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql + " WHERE id = %s AND locked_by = %s AND status = 'running'",
+                       params + (job_id, worker))
+        updated = cursor.rowcount > 0
+        conn.commit()
+        return updated
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def heartbeat(job_id, worker, visibility_timeout=VISIBILITY_TIMEOUT):
+    """续期可见性超时，返回False表示任务已不再由该worker持有"""
+    return _update_owned(
+        job_id, worker,
+        "UPDATE jobs SET locked_until = CURRENT_TIMESTAMP + make_interval(secs => %s)",
+        (visibility_timeout,)
+    )
+
+
+def complete(job_id, worker):
+    """标记任务完成"""
+    return _update_owned(
+        job_id, worker,
+        "UPDATE jobs SET status = 'completed', finished_at = CURRENT_TIMESTAMP, "
+        "locked_by = NULL, locked_until = NULL, last_error = NULL",
+        ()
+    )
+
+
+def retry_delay(attempts):
+    """第attempts次失败后的退避时间（秒）"""
+    delay = min(RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def fail(job, worker, error):
+    """
+    记录失败：还有尝试次数时按退避时间重新排队，否则转为死信
+
+    Returns:
+        str: queued 或 dead
+    """
+    dead = job["attempts"] >= job["max_attempts"]
+    if dead:
+        _update_owned(
+            job["id"], worker,
+            "UPDATE jobs SET status = 'dead', last_error = %s, finished_at = CURRENT_TIMESTAMP, "
+            "locked_by = NULL, locked_until = NULL",
+            (error,)
+        )
+        logger.error(f"{job['kind']} 任务 {job['id']} 已重试 {job['attempts']} 次仍失败，转为死信: {error}")
+        return "dead"
+
+    delay = retry_delay(job["attempts"])
+    if not _requeue(
+        job, worker,
+        "UPDATE jobs SET status = 'queued', last_error = %s, "
+        "run_after = CURRENT_TIMESTAMP + make_interval(secs => %s), locked_by = NULL, locked_until = NULL",
+        (error, delay)
+    ):
+        return "merged"
+    logger.warning(f"{job['kind']} 任务 {job['id']} 第 {job['attempts']} 次执行失败，{delay:.0f} 秒后重试: {error}")
+    return "queued"
+
+
+def release(job, worker, delay_seconds):
+    """放回队列且不计入尝试次数"""
+    return _requeue(
+        job, worker,
+        "UPDATE jobs SET status = 'queued', attempts = GREATEST(attempts - 1, 0), "
+        "run_after = CURRENT_TIMESTAMP + make_interval(secs => %s), locked_by = NULL, locked_until = NULL",
+        (delay_seconds,)
+    )
+
+
+def _requeue(job, worker, sql, params):
+    """
+    重新排队；已有相同合并键的任务在排队时，本任务直接结束，由排队中的任务代为执行
+
+    Returns:
+        bool: 是否重新排队
+    """
+    try:
+        return _update_owned(job["id"], worker, sql, params)
+    except psycopg2_errors.UniqueViolation:
+        _update_owned(
+            job["id"], worker,
+            "UPDATE jobs SET status = 'completed', finished_at = CURRENT_TIMESTAMP, "
+            "locked_by = NULL, locked_until = NULL, last_error = %s",
+            ("已有相同的任务在排队，合并到该任务执行",)
+        )
+        logger.info(f"{job['kind']} 任务 {job['id']} 已有相同的任务在排队，不再重新排队")
+        return False
+
+
+def reap_expired():
+    """把可见性超时且尝试次数已用尽的任务转为死信"""
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET status = 'dead', finished_at = CURRENT_TIMESTAMP,
+                last_error = COALESCE(last_error, '') || '[可见性超时，worker可能已退出]',
+                locked_by = NULL, locked_until = NULL
+            WHERE status = 'running'
+              AND locked_until < CURRENT_TIMESTAMP
+              AND attempts >= max_attempts
+            """
+        )
+        count = cursor.rowcount
+        conn.commit()
+        if count:
+            logger.warning(f"{count} 个超时任务已转为死信")
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def execute(job, handler, worker, visibility_timeout=VISIBILITY_TIMEOUT):
+    """
+    执行已认领的任务，执行期间后台线程定期续期
+
+    handler(job) 正常返回视为完成；抛出 RetryLater 时不计次数重新排队；
+    抛出其他异常时按重试策略处理
+
+    Returns:
+        str: completed、queued、released、merged 或 dead
+    """
+    stop = threading.Event()
+
+    def keep_alive():
+        while not stop.wait(max(visibility_timeout / 3, 1)):
+            try:
+                if not heartbeat(job["id"], worker, visibility_timeout):
+                    logger.warning(f"{job['kind']} 任务 {job['id']} 已不再由 {worker} 持有")
+                    return
+            except Exception as e:
+                logger.error(f"任务 {job['id']} 续期失败: {str(e)}")
+
+    keeper = threading.Thread(target=keep_alive, name=f"job-heartbeat-{job['id']}", daemon=True)
+    keeper.start()
+    try:
+        handler(job)
+        complete(job["id"], worker)
+        return "completed"
+    except RetryLater as e:
+        if not release(job, worker, e.delay_seconds):
+            return "merged"
+        logger.info(f"{job['kind']} 任务 {job['id']} 暂缓执行: {str(e)}")
+        return "released"
+    except Exception as e:
+        return fail(job, worker, str(e))
+    finally:
+        stop.set()
+
+
+def count_jobs(kind, statuses=("queued", "running")):
+    """按状态统计某类任务数量"""
+    ensure_schema()
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE kind = %s AND status = ANY(%s) GROUP BY status",
+            (kind, list(statuses))
+        )
+        counts = {status: 0 for status in statuses}
+        counts.update(dict(cursor.fetchall()))
+        conn.commit()
+        return counts
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def list_queue(kind, dedupe_key=None):
+    """
+    排队中和执行中的任务，按认领顺序给出排队位置（执行中的位置为0）
+
+    Args:
+        kind: 任务类型
+        dedupe_key: 只返回该合并键的任务
+    """
+    ensure_schema()
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            """
+            SELECT * FROM (
+                SELECT id, kind, status, priority, payload, dedupe_key, attempts, run_after,
+                       locked_by, created_at, started_at,
+                       CASE WHEN status = 'queued'
+                            THEN ROW_NUMBER() OVER (PARTITION BY status ORDER BY priority DESC, run_after, id)
+                            ELSE 0
+                       END AS queue_position
+                FROM jobs
+                WHERE kind = %s AND status IN ('queued', 'running')
+            ) queue
+            WHERE %s IS NULL OR dedupe_key = %s
+            ORDER BY queue_position, id
+            """,
+            (kind, dedupe_key, dedupe_key)
+        )
+        jobs = [dict(row) for row in cursor.fetchall()]
+        conn.commit()
+        return jobs
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def queue_position(job_id):
+    """任务当前的排队位置：执行中为0，已结束或不存在时为None"""
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT CASE WHEN j.status = 'running' THEN 0 ELSE (
+                       SELECT COUNT(*) + 1 FROM jobs o
+                       WHERE o.kind = j.kind AND o.status = 'queued'
+                         AND (o.priority, -EXTRACT(EPOCH FROM o.run_after), -o.id)
+                             > (j.priority, -EXTRACT(EPOCH FROM j.run_after), -j.id)
+                   ) END
+            FROM jobs j
+            WHERE j.id = %s AND j.status IN ('queued', 'running')
+            """,
+            (job_id,)
+        )
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def list_jobs(kind=None, status=None, limit=50):
+    """按ID倒序列出任务"""
+    ensure_schema()
+    conditions, params = [], []
+    if kind:
+        conditions.append("kind = %s")
+        params.append(kind)
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"SELECT * FROM jobs {where} ORDER BY id DESC LIMIT %s", params + [limit])
+        jobs = [dict(row) for row in cursor.fetchall()]
+        conn.commit()
+        return jobs
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def retry_job(job_id):
+    """把死信任务重新排队并清零尝试次数，返回是否成功"""
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET status = 'queued', attempts = 0, run_after = CURRENT_TIMESTAMP,
+                locked_by = NULL, locked_until = NULL, finished_at = NULL
+            WHERE id = %s AND status = 'dead'
+            RETURNING kind
+            """,
+            (job_id,)
+        )
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("SELECT pg_notify(%s, %s)", (JOB_CHANNEL, row[0]))
+        conn.commit()
+        return row is not None
+    except psycopg2_errors.UniqueViolation:
+        conn.rollback()
+        logger.info(f"死信任务 {job_id} 已有相同的任务在排队，无需重试")
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def purge_finished(days=30):
+    """删除完成超过指定天数的任务，死信保留"""
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            DELETE FROM jobs
+            WHERE status = 'completed'
+              AND finished_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+            """,
+            (days,)
+        )
+        count = cursor.rowcount
+        conn.commit()
+        logger.info(f"已清理 {count} 个 {days} 天前完成的任务")
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+class JobNotifier:
+    """
+    在专用连接（autocommit，不占用连接池）上 LISTEN 任务通知，供空闲的worker等待
+
+    连接失败或断开时退化为普通等待，下次等待时重新连接
+    """
+
+    def __init__(self, kinds, worker):
+        self.kinds = set(kinds)
+        self.worker = worker
+        self.conn = None
+
+    def _connect(self):
+        try:
+            self.conn = psycopg2.connect(**db_config.DB_PARAMS, application_name=f"job_listener:{self.worker}")
+            self.conn.autocommit = True
+            self.conn.cursor().execute(f"LISTEN {JOB_CHANNEL}")
+        except Exception as e:
+            logger.warning(f"{self.worker} 监听任务通知失败，改为轮询: {str(e)}")
+            self.close()
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def wait(self, timeout, stop_event):
+        """
+        等待相关类型的任务通知，最多timeout秒，stop_event设置时提前返回
+
+        Returns:
+            bool: 是否收到了相关类型的通知
+        """
+        if self.conn is None:
+            self._connect()
+        if self.conn is None:
+            stop_event.wait(timeout)
+            return False
+
+        deadline = time.monotonic() + timeout
+        while not stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                # 每次最多等1秒，及时响应stop_event
+                if select.select([self.conn], [], [], min(remaining, 1.0))[0]:
+                    self.conn.poll()
+                    notified = any(notify.payload in self.kinds for notify in self.conn.notifies)
+                    self.conn.notifies.clear()
+                    if notified:
+                        return True
+            except Exception as e:
+                logger.warning(f"{self.worker} 任务通知连接断开，改为轮询: {str(e)}")
+                self.close()
+                stop_event.wait(max(0.0, deadline - time.monotonic()))
+                return False
+        return False
+
+
+def run_worker(kinds, handlers, worker, stop_event, poll_interval=5, visibility_timeout=VISIBILITY_TIMEOUT,
+               before_claim=None):
+    """
+    worker主循环：认领并执行任务，直到stop_event被设置
+
+    Args:
+        kinds: 认领的任务类型
+        handlers: {kind: handler(job)}
+        worker: worker标识
+        stop_event: threading.Event，设置后在当前任务结束后退出
+        poll_interval: 队列为空时最长的等待时间（秒），收到对应类型的任务通知时提前认领
+        visibility_timeout: 可见性超时（秒）
+        before_claim: 认领前调用，返回False时本轮不认领（如资源被占用）
+    """
+    ensure_schema()
+    notifier = JobNotifier(kinds, worker)
+    last_reap = 0.0
+    try:
+        while not stop_event.is_set():
+            try:
+                now = time.monotonic()
+                if now - last_reap > 60:
+                    reap_expired()
+                    last_reap = now
+
+                if before_claim and not before_claim():
+                    stop_event.wait(poll_interval)
+                    continue
+
+                job = claim(kinds, worker, visibility_timeout)
+                if not job:
+                    notifier.wait(poll_interval, stop_event)
+                    continue
+
+                logger.info(f"{worker} 认领 {job['kind']} 任务 {job['id']}（第 {job['attempts']} 次）: "
+                            f"{json.dumps(job['payload'], ensure_ascii=False)}")
+                result = execute(job, handlers[job["kind"]], worker, visibility_timeout)
+                logger.info(f"{job['kind']} 任务 {job['id']} 结束: {result}")
+            except Exception as e:
+                logger.error(f"{worker} 主循环出错: {str(e)}")
+                stop_event.wait(poll_interval)
+    finally:
+        notifier.close()
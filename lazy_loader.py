@@ -0,0 +1,51 @@
+"""
+延迟导入
+爬虫（DrissionPage、OpenCV）和数据分析（PySpark、pandas）依赖的库导入很慢、占用内存多，
+API进程只在真正用到时才导入，保证只提供HTTP服务的worker快速启动
+"""
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    模块代理，第一次访问属性时才导入真实模块
+
+    用法:
+        data_processor = lazy_import("data_processor")
+        data_processor.RentalDataProcessor()  # 此时才导入
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            with self.__dict__["_lock"]:
+                module = self.__dict__["_module"]
+                if module is None:
+                    module = importlib.import_module(self.__dict__["_name"])
+                    self.__dict__["_module"] = module
+        return module
+
+    @property
+    def is_loaded(self):
+        return self.__dict__["_module"] is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = "已导入" if self.is_loaded else "未导入"
+        return f"<LazyModule {self.__dict__['_name']} ({state})>"
+
+
+def lazy_import(name):
+    """返回延迟导入的模块代理"""
+    return LazyModule(name)
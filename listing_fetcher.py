@@ -0,0 +1,264 @@
+"""
+列表页HTTP抓取
+房源列表页是服务端渲染的，房源数据都在返回的HTML里，不需要浏览器执行脚本、加载图片。
+爬取时先用普通HTTP请求带上浏览器会话的cookie、User-Agent和代理获取列表页，直接交给
+listing_parser 解析；遇到验证码、跳转或页面上没有房源列表时才退回浏览器加载该页，
+浏览器处理完验证码后再把新的cookie同步回HTTP会话。
+
+LISTING_FETCH_MODE=browser 时全部由浏览器加载（原来的方式）。
+每种方式的成功率和每分钟页数按任务记录在日志中，并导出为Prometheus指标。
+"""
+import os
+import time
+import logging
+from urllib.parse import urlparse
+
+import requests
+
+import metrics
+import crawl_engine
+
+logger = logging.getLogger("listing_fetcher")
+
+# http: 优先HTTP请求，失败时退回浏览器；browser: 只用浏览器
+FETCH_MODE = os.getenv("LISTING_FETCH_MODE", "http")
+# HTTP请求超时秒数
+HTTP_TIMEOUT = float(os.getenv("LISTING_HTTP_TIMEOUT", "15"))
+# 同一任务中HTTP方式连续失败多少次后，剩余页面全部改用浏览器
+HTTP_MAX_CONSECUTIVE_FAILURES = int(os.getenv("LISTING_HTTP_MAX_FAILURES", "3"))
+
+# 列表页上房源项的class，出现在HTML中说明拿到的是正常的列表页
+LISTING_MARKER = "content__list--item"
+# 出现在页面标题或跳转地址中时视为验证页面
+CAPTCHA_MARKERS = ("captcha", "验证")
+
+
+class FetchResult:
+    """
+    一次HTTP抓取的结果
+
+    Attributes:
+        ok: 是否拿到了正常的列表页
+        html: 页面HTML，ok为False时可能为None
+        reason: 失败原因：captcha、redirect、status、empty、error
+        seconds: 并发预取时请求本身的耗时
+    """
+
+    def __init__(self, ok, html=None, reason=None, status=None, seconds=0.0):
+        self.ok = ok
+        self.html = html
+        self.reason = reason
+        self.status = status
+        self.seconds = seconds
+
+
+def page_title(html):
+    start = html.find("<title")
+    if start < 0:
+        return ""
+    start = html.find(">", start) + 1
+    end = html.find("</title>", start)
+    return html[start:end] if end > start else ""
+
+
+def proxy_url(proxy):
+    """ip_manager返回的代理字典中的代理URL，没有代理时为None"""
+    if not proxy:
+        return None
+    return proxy.get("https") or proxy.get("http")
+
+
+def classify_response(status, location, html):
+    """
+    判断HTTP响应是否为正常的列表页
+
+    Returns:
+        tuple: (失败原因, 说明)，正常的列表页返回(None, None)
+    """
+    if 300 <= status < 400:
+        reason = "captcha" if any(marker in location for marker in CAPTCHA_MARKERS) else "redirect"
+        return reason, location
+    if status != 200:
+        return "status", str(status)
+    title = page_title(html)
+    if any(marker in title.lower() for marker in CAPTCHA_MARKERS):
+        return "captcha", title
+    if LISTING_MARKER not in html:
+        return "empty", None
+    return None, None
+
+
+class HttpListingFetcher:
+    """
+    用浏览器会话的cookie通过HTTP获取列表页，每个爬取任务一个实例（requests.Session不跨线程共享）
+
+    Args:
+        proxy: 与浏览器相同的代理，格式同 ip_manager.get_random_proxy 的返回值
+        throttle: crawl_engine.AimdController，抓取结果反馈给它调整速率
+    """
+
+    def __init__(self, proxy=None, throttle=None):
+        self.session = requests.Session()
+        self.proxy_url = proxy_url(proxy)
+        if proxy:
+            self.session.proxies.update(proxy)
+        self.throttle = throttle
+        self.cookie_count = 0
+        self.consecutive_failures = 0
+        self.last_failure = None
+
+    @property
+    def ready(self):
+        """已经从浏览器同步到cookie，且没有因为连续失败被停用"""
+        return self.cookie_count > 0 and self.consecutive_failures < HTTP_MAX_CONSECUTIVE_FAILURES
+
+    def sync_from_browser(self, driver):
+        """把浏览器当前的cookie和User-Agent同步到HTTP会话，浏览器每次成功加载列表页后调用"""
+        try:
+            cookies = driver.cookies(all_domains=False, all_info=True)
+            for cookie in cookies:
+                self.session.cookies.set(
+                    cookie["name"],
+                    cookie["value"],
+                    domain=cookie.get("domain", ""),
+                    path=cookie.get("path", "/"),
+                )
+            self.session.headers["User-Agent"] = driver.user_agent
+            self.cookie_count = len(cookies)
+            # 因验证码退回浏览器的，浏览器通过验证后重新给HTTP方式机会
+            if self.last_failure == "captcha":
+                self.consecutive_failures = 0
+        except Exception as e:
+            logger.warning(f"同步浏览器cookie失败，本页之后继续使用浏览器: {str(e)}")
+            self.cookie_count = 0
+
+    def fetch(self, url, referer=None):
+        """获取列表页，不跟随跳转：被重定向通常意味着验证码或登录页"""
+        headers = {"Referer": referer} if referer else {}
+        crawl_engine.get_bucket(urlparse(url).netloc, self.proxy_url).wait(crawl_engine.JITTER)
+        try:
+            response = self.session.get(url, headers=headers, timeout=HTTP_TIMEOUT, allow_redirects=False)
+        except requests.RequestException as e:
+            return self.report_failure(url, "error", detail=str(e))
+
+        html = response.text if response.status_code == 200 else None
+        reason, detail = classify_response(response.status_code, response.headers.get("Location", ""), html)
+        if reason:
+            return self.report_failure(url, reason, status=response.status_code, detail=detail)
+        return FetchResult(True, html=html, status=response.status_code)
+
+    def fetch_many(self, urls, referer=None):
+        """
+        通过异步抓取引擎在速率预算内并发获取多个列表页
+
+        Args:
+            urls: {key: url}，如 {页码: 页面地址}
+
+        Returns:
+            dict: {key: FetchResult}
+        """
+        engine = crawl_engine.AsyncFetchEngine(
+            headers=dict(self.session.headers),
+            cookies=requests.utils.dict_from_cookiejar(self.session.cookies),
+            proxy=self.proxy_url,
+        )
+        responses = engine.run(list(urls.values()), referer=referer)
+        results = {}
+        for key, response in zip(urls, responses):
+            if response.error:
+                results[key] = self.report_failure(response.url, "error", detail=response.error)
+                continue
+            reason, detail = classify_response(response.status, response.location, response.text)
+            if reason:
+                results[key] = self.report_failure(response.url, reason, status=response.status, detail=detail)
+            else:
+                results[key] = FetchResult(True, html=response.text, status=response.status, seconds=response.seconds)
+        return results
+
+    def report_success(self):
+        """HTTP取得的页面成功解析并保存了房源"""
+        self.consecutive_failures = 0
+        self.last_failure = None
+        if self.throttle is not None:
+            self.throttle.on_success()
+
+    def report_failure(self, url, reason, status=None, detail=None):
+        """记录一次HTTP方式失败（包括拿到的页面解析不出房源），该页改由浏览器加载"""
+        self.consecutive_failures += 1
+        self.last_failure = reason
+        metrics.CRAWLER_FETCH_FALLBACKS.labels(reason=reason).inc()
+        if self.throttle is not None:
+            self.throttle.on_failure(reason)
+        logger.warning(f"HTTP获取列表页失败（{reason}{'，' + detail if detail else ''}），改用浏览器: {url}")
+        if self.consecutive_failures == HTTP_MAX_CONSECUTIVE_FAILURES:
+            logger.warning(f"HTTP方式连续失败 {self.consecutive_failures} 次，浏览器通过验证前不再使用")
+        return FetchResult(False, reason=reason, status=status)
+
+
+class FetchStats:
+    """一个爬取任务中各获取方式的页数、成功率和每分钟页数"""
+
+    STRATEGIES = ("http", "browser")
+
+    def __init__(self, city_code):
+        self.city_code = city_code
+        self.started = time.monotonic()
+        self.attempts = {strategy: 0 for strategy in self.STRATEGIES}
+        self.successes = {strategy: 0 for strategy in self.STRATEGIES}
+        self.seconds = {strategy: 0.0 for strategy in self.STRATEGIES}
+
+    def record(self, strategy, success, seconds):
+        """记录一次获取并处理列表页的尝试"""
+        self.attempts[strategy] += 1
+        self.seconds[strategy] += seconds
+        if success:
+            self.successes[strategy] += 1
+        metrics.CRAWLER_FETCHES.labels(strategy=strategy, result="success" if success else "failed").inc()
+        metrics.CRAWLER_FETCH_SECONDS.labels(strategy=strategy).observe(seconds)
+
+    def pages_per_minute(self, strategy=None):
+        """成功页数按耗时折算的每分钟页数；strategy为None时按任务总耗时（含页面间等待）计算"""
+        if strategy is None:
+            elapsed = time.monotonic() - self.started
+            pages = sum(self.successes.values())
+        else:
+            elapsed = self.seconds[strategy]
+            pages = self.successes[strategy]
+        return pages * 60 / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        result = {"pages_per_minute": round(self.pages_per_minute(), 2)}
+        for strategy in self.STRATEGIES:
+            attempts = self.attempts[strategy]
+            result[strategy] = {
+                "attempts": attempts,
+                "successes": self.successes[strategy],
+                "success_rate": round(self.successes[strategy] / attempts, 3) if attempts else None,
+                "pages_per_minute": round(self.pages_per_minute(strategy), 2),
+            }
+        return result
+
+    def log_summary(self):
+        parts = []
+        for strategy, stats in self.summary().items():
+            if isinstance(stats, dict) and stats["attempts"]:
+                parts.append(f"{strategy} {stats['successes']}/{stats['attempts']} 页成功"
+                             f"（{stats['success_rate']:.0%}，{stats['pages_per_minute']} 页/分钟）")
+        logger.info(f"城市 {self.city_code} 列表页获取统计: {'；'.join(parts) or '无'}，"
+                    f"整体 {self.pages_per_minute():.2f} 页/分钟")
+
+
+def create_throttle(driver, host, task_id=None):
+    """为爬取任务创建自适应限速器，HTTP请求和浏览器加载共用 host + 浏览器代理 的令牌桶"""
+    return crawl_engine.AimdController(host, proxy_url(getattr(driver, "crawler_proxy", None)), task_id=task_id)
+
+
+def create_fetcher(driver, throttle=None):
+    """按 LISTING_FETCH_MODE 为爬取任务创建HTTP抓取器，只用浏览器时返回None"""
+    if FETCH_MODE != "http":
+        return None
+    fetcher = HttpListingFetcher(proxy=getattr(driver, "crawler_proxy", None), throttle=throttle)
+    # 复用的保温浏览器已经带有该城市的cookie，可以从第一页开始走HTTP
+    if urlparse(driver.url or "").netloc.endswith("ke.com"):
+        fetcher.sync_from_browser(driver)
+    return fetcher
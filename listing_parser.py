@@ -0,0 +1,199 @@
+"""
+房源列表页解析
+对整页HTML快照做一次进程内解析，得到与 selenium_spider.extract_house_info 相同结构的房源字典。
+原来每个房源的标题、价格、描述、标签都要通过DrissionPage单独查询元素、读取文本和属性，
+每次都是一次到Chromium的CDP往返，一页约30个房源要几百次；现在只取一次 driver.html。
+
+描述、价格、发布时间的文本解析规则由两种提取方式共用，保证结果一致。
+"""
+import datetime
+import re
+from urllib.parse import urljoin
+
+import lxml.html
+
+# 房源列表项及其中各字段的CSS选择器，与DrissionPage提取方式一致
+ITEM_SELECTOR = "div.content__list--item"
+TITLE_SELECTOR = ".content__list--item--title a"
+IMAGE_SELECTOR = ".content__list--item--aside img"
+PRICE_SELECTOR = ".content__list--item-price"
+DESC_SELECTOR = ".content__list--item--des"
+TIME_SELECTOR = ".content__list--item--time"
+TAG_SELECTOR = ".content__list--item--bottom i"
+# 图片懒加载：未滚动到的图片src是占位图，真实地址在data-src（部分页面为data-original）
+IMAGE_ATTRIBUTES = ("data-src", "data-original", "src")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def element_text(element):
+    """元素文本，连续空白合并为一个空格，与DrissionPage的 .text 一致"""
+    return _WHITESPACE.sub(" ", element.text_content()).strip()
+
+
+def image_source(get_attribute):
+    """按 IMAGE_ATTRIBUTES 的顺序取第一个非空的图片地址，get_attribute为读取属性的函数"""
+    for attribute in IMAGE_ATTRIBUTES:
+        value = get_attribute(attribute)
+        if value:
+            return value
+    return ""
+
+
+def parse_price(price_text):
+    """价格文本（如“3500 元/月”）中的第一个数字，没有时为0"""
+    match = re.search(r"\d+", price_text)
+    return int(match.group()) if match else 0
+
+
+def parse_description(desc_text):
+    """
+    解析描述行（区域-商圈-小区 / 面积 / 朝向 / 户型 / 楼层，部分房源带地铁信息）
+
+    Returns:
+        dict: layout, area, floor, direction, district, community, subway
+    """
+    result = {
+        "layout": "",
+        "area": 0,
+        "floor": "",
+        "direction": "",
+        "district": "",
+        "community": "",
+        "subway": "",
+    }
+    # 用 / 或 \n 分割成若干部分
+    desc_parts = [part.strip() for part in re.split(r"[\/\n]", desc_text) if part.strip()]
+    for part in desc_parts:
+        # 区域和小区（如：浦东-张江-玫瑰湾(别墅)）
+        if "-" in part and not result["district"]:
+            location_parts = part.split("-")
+            if len(location_parts) >= 2:
+                result["district"] = location_parts[0]
+                result["community"] = location_parts[-1]
+
+        # 面积
+        elif "㎡" in part and not result["area"]:
+            area_match = re.search(r"(\d+(\.\d+)?)", part)
+            if area_match:
+                result["area"] = float(area_match.group(1))
+
+        # 户型
+        elif "室" in part and "厅" in part and not result["layout"]:
+            result["layout"] = part
+
+        # 楼层
+        elif "楼层" in part and not result["floor"]:
+            result["floor"] = part
+
+        # 朝向（只判断方向的汉字）
+        elif any(d in part for d in ["东", "南", "西", "北"]) and not result["direction"]:
+            result["direction"] = part
+
+        # 地铁
+        elif "号线" in part and not result["subway"]:
+            result["subway"] = part
+    return result
+
+
+def parse_publish_date(publish_text, now=None):
+    """
+    解析维护/发布时间文本
+
+    支持“3天前维护”、“今天维护”、“05.12发布”，无法识别时返回当天日期
+
+    Returns:
+        str: YYYY-MM-DD
+    """
+    now = now or datetime.datetime.now()
+    publish_date = now.strftime("%Y-%m-%d")
+
+    # 1. 格式：3天前维护
+    match_before = re.search(r"(\d+)天前", publish_text)
+    if match_before:
+        days = int(match_before.group(1))
+        publish_date = (now - datetime.timedelta(days=days)).strftime("%Y-%m-%d")
+
+    # 2. 格式：今天维护
+    elif "今天维护" in publish_text:
+        publish_date = now.strftime("%Y-%m-%d")
+
+    # 3. 格式：05.12发布
+    else:
+        date_match = re.search(r"(\d{2})\.(\d{2})", publish_text)
+        if date_match:
+            month, day = date_match.groups()
+            publish_date = f"{now.year}-{month}-{day}"
+    return publish_date
+
+
+def parse_listing_item(item, city_code, task_id=None, base_url=None):
+    """
+    从一个房源列表项（lxml元素）中提取房源信息
+
+    Returns:
+        dict: 与 extract_house_info 相同结构的房源信息
+    """
+    title_element = item.cssselect(TITLE_SELECTOR)[0]
+    title = element_text(title_element)
+    # DrissionPage读取的href/src是浏览器解析后的绝对地址
+    url = urljoin(base_url or "", title_element.get("href", ""))
+
+    image_url = ""
+    images = item.cssselect(IMAGE_SELECTOR)
+    if images:
+        source = image_source(images[0].get)
+        if source:
+            image_url = urljoin(base_url or "", source)
+
+    price = parse_price(element_text(item.cssselect(PRICE_SELECTOR)[0]))
+    description = parse_description(element_text(item.cssselect(DESC_SELECTOR)[0]))
+
+    publish_elements = item.cssselect(TIME_SELECTOR)
+    publish_date = parse_publish_date(element_text(publish_elements[0])) if publish_elements else None
+
+    features = [element_text(tag) for tag in item.cssselect(TAG_SELECTOR)]
+
+    return {
+        "url": url,
+        "title": title,
+        "price": price,
+        "layout": description["layout"],
+        "area": description["area"],
+        "floor": description["floor"],
+        "direction": description["direction"],
+        "subway": description["subway"],
+        "district": description["district"],
+        "community": description["community"],
+        "city_code": city_code,
+        "publish_date": publish_date,
+        "features": features,
+        "task_id": task_id,
+        "image_url": image_url,
+    }
+
+
+def parse_listing_page(html, city_code, task_id=None, base_url=None):
+    """
+    解析整页HTML快照中的所有房源
+
+    单个房源解析失败时跳过并在结果中计数，不影响同页其他房源
+
+    Args:
+        html: driver.html 取得的页面HTML
+        city_code: 城市代码
+        task_id: 爬虫任务ID
+        base_url: 页面地址，用于把相对链接转换为绝对地址
+
+    Returns:
+        tuple: (房源信息列表, 页面上的房源总数, 解析失败的房源错误列表)
+    """
+    document = lxml.html.fromstring(html)
+    items = document.cssselect(ITEM_SELECTOR)
+    houses, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            houses.append(parse_listing_item(item, city_code, task_id, base_url))
+        except Exception as e:
+            errors.append(f"第 {index + 1} 个房源: {str(e)}")
+    return houses, len(items), errors
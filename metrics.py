@@ -0,0 +1,286 @@
+"""
+Prometheus监控指标
+集中定义API、爬虫、数据分析和图片缓存的指标，由 /metrics 接口统一导出。
+计数器和直方图的记录只是加锁的内存累加，不会给热点路径带来可感知的开销；
+连接池使用情况在抓取时才读取
+"""
+import os
+import time
+from prometheus_client import (
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    start_http_server,
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+import db_config
+
+# 设置后 /metrics 需要携带 Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# ---------------------------------------------------------------------------
+# API
+# ---------------------------------------------------------------------------
+
+HTTP_REQUEST_DURATION = Histogram(
+    "rental_http_request_duration_seconds",
+    "API请求耗时",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "rental_http_requests_in_progress",
+    "正在处理的API请求数",
+)
+ADMISSION_REQUESTS = Counter(
+    "rental_admission_requests_total",
+    "准入控制结果，outcome为admitted、queue_full或timeout",
+    ["endpoint_class", "outcome"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "rental_admission_in_flight",
+    "各类接口正在处理的请求数",
+    ["endpoint_class"],
+)
+ADMISSION_WAITING = Gauge(
+    "rental_admission_waiting",
+    "各类接口排队等待并发额度的请求数",
+    ["endpoint_class"],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "rental_admission_wait_seconds",
+    "请求排队等待并发额度的时间",
+    ["endpoint_class"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+
+# ---------------------------------------------------------------------------
+# 爬虫
+# ---------------------------------------------------------------------------
+
+BROWSER_POOL_IN_USE = Gauge(
+    "rental_browser_pool_in_use",
+    "浏览器池中已租用的浏览器数",
+)
+BROWSER_LAUNCHES = Counter(
+    "rental_browser_launches_total",
+    "浏览器启动次数，result为success或failed",
+    ["result"],
+)
+BROWSER_REUSES = Counter(
+    "rental_browser_leases_total",
+    "租用浏览器次数，result为warm（复用保温的浏览器）或cold（新启动）",
+    ["result"],
+)
+BROWSER_RECYCLES = Counter(
+    "rental_browser_recycles_total",
+    "保温浏览器被回收的次数，reason为pages、memory、idle、city或error",
+    ["reason"],
+)
+BROWSER_HEALTH_CHECK_FAILURES = Counter(
+    "rental_browser_health_check_failures_total",
+    "租用中的浏览器健康检查失败（随后重新启动）的次数",
+)
+CRAWLER_PAGES = Counter(
+    "rental_crawler_pages_total",
+    "爬取的列表页数量",
+    ["city_code", "result"],
+)
+CRAWLER_ITEMS_SAVED = Counter(
+    "rental_crawler_items_saved_total",
+    "保存到数据库的房源数",
+    ["city_code"],
+)
+CRAWLER_ITEMS_FAILED = Counter(
+    "rental_crawler_items_failed_total",
+    "保存失败的房源数",
+    ["city_code"],
+)
+CRAWLER_ITEMS_CHANGES = Counter(
+    "rental_crawler_items_changes_total",
+    "保存的房源按内容变化分类的数量，change为new、changed或unchanged（只更新last_seen）",
+    ["city_code", "change"],
+)
+LISTING_PARSE_SECONDS = Histogram(
+    "rental_listing_parse_seconds",
+    "每页房源列表的提取耗时，mode为snapshot（整页HTML解析）或cdp（逐个元素读取）",
+    ["mode"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+CRAWLER_FETCHES = Counter(
+    "rental_crawler_fetches_total",
+    "按获取方式统计的列表页处理次数，strategy为http（HTTP请求+浏览器cookie）或browser",
+    ["strategy", "result"],
+)
+CRAWLER_FETCH_SECONDS = Histogram(
+    "rental_crawler_fetch_seconds",
+    "获取并处理一个列表页的耗时（不含页面间的随机等待）",
+    ["strategy"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+CRAWLER_FETCH_FALLBACKS = Counter(
+    "rental_crawler_fetch_fallbacks_total",
+    "HTTP获取列表页失败、退回浏览器的次数，reason为captcha、redirect、status、empty、error或parse",
+    ["reason"],
+)
+CRAWLER_RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "rental_crawler_rate_limit_wait_seconds",
+    "HTTP抓取列表页前等待令牌桶和随机抖动的时间",
+    buckets=(0, 0.1, 0.5, 1, 2, 5, 10, 20, 30, 60),
+)
+CRAWLER_RATE = Gauge(
+    "rental_crawler_rate",
+    "自适应调整后对各站点的抓取速率（次/秒）",
+    ["host"],
+)
+CRAWLER_RATE_CHANGES = Counter(
+    "rental_crawler_rate_changes_total",
+    "抓取速率调整次数，direction为increase或decrease，reason为success或失败原因",
+    ["direction", "reason"],
+)
+CRAWLER_WAIT_SECONDS = Histogram(
+    "rental_crawler_wait_seconds",
+    "爬虫等待页面条件（列表页加载、验证码加载、验证结果等）的耗时，result为met或timeout",
+    ["condition", "result"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 15, 30),
+)
+CAPTCHA_ENCOUNTERS = Counter(
+    "rental_captcha_encounters_total",
+    "遇到验证码的次数",
+    ["city_code"],
+)
+CAPTCHA_SOLVES = Counter(
+    "rental_captcha_solves_total",
+    "验证码处理结果",
+    ["city_code", "result"],
+)
+
+# ---------------------------------------------------------------------------
+# 数据分析
+# ---------------------------------------------------------------------------
+
+ANALYSIS_DURATION = Histogram(
+    "rental_analysis_duration_seconds",
+    "单项分析耗时（含保存结果）",
+    ["analysis", "result"],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+# ---------------------------------------------------------------------------
+# 图片缓存
+# ---------------------------------------------------------------------------
+
+IMAGE_CACHE_LOOKUPS = Counter(
+    "rental_image_cache_lookups_total",
+    "图片缓存查询次数，layer为命中的缓存层或miss",
+    ["layer"],
+)
+
+
+class _PoolCollector:
+    """抓取时读取db_config中登记的连接池使用情况"""
+
+    def collect(self):
+        in_use = GaugeMetricFamily("rental_db_pool_connections_in_use", "连接池已借出的连接数", labels=["pool"])
+        idle = GaugeMetricFamily("rental_db_pool_connections_idle", "连接池空闲连接数", labels=["pool"])
+        maximum = GaugeMetricFamily("rental_db_pool_connections_max", "连接池最大连接数", labels=["pool"])
+        for name, connection_pool in db_config.get_registered_pools().items():
+            usage = db_config.get_pool_usage(connection_pool)
+            in_use.add_metric([name], usage["in_use"])
+            idle.add_metric([name], usage["idle"])
+            maximum.add_metric([name], usage["max"])
+        yield in_use
+        yield idle
+        yield maximum
+
+
+REGISTRY.register(_PoolCollector())
+
+
+class Timer:
+    """计时上下文管理器，退出时把耗时记录到直方图，result标签按是否发生异常区分"""
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.result = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        result = self.result or ("error" if exc_type else "success")
+        self.histogram.labels(result=result, **self.labels).observe(time.perf_counter() - self.start)
+        return False
+
+
+def start_worker_metrics_server(port):
+    """
+    worker进程没有HTTP服务，单独监听端口导出指标
+
+    Args:
+        port: 监听端口，为0或None时不启动
+    """
+    if not port:
+        return False
+    start_http_server(int(port))
+    return True
+
+
+def render_latest(registry=REGISTRY):
+    """生成Prometheus文本格式的指标"""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    记录每个请求的耗时
+
+    route标签使用路由模板（如 /tasks/{task_id}），避免路径参数造成标签基数膨胀；
+    未匹配到路由的请求统一记为 unmatched
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths = None
+
+    def _route_path(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            routes = getattr(scope.get("app"), "routes", [])
+            self._route_paths = {
+                getattr(route, "endpoint", None): route.path
+                for route in routes if hasattr(route, "path")
+            }
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            HTTP_REQUEST_DURATION.labels(
+                method=scope.get("method", ""),
+                route=self._route_path(scope),
+                status=str(status_holder["status"]),
+            ).observe(time.perf_counter() - start)
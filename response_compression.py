@@ -0,0 +1,249 @@
+"""
+响应压缩中间件
+根据请求的 Accept-Encoding 协商 br/gzip 压缩，只压缩超过阈值的响应，
+跳过图片、导出文件、事件流等不适合或已压缩的内容
+
+强ETag必须区分内容编码：协商出编码的可压缩响应在ETag引号内加上编码后缀（"abc" -> "abc-gzip"），
+未达到压缩阈值原样返回的200和对应的304也加同样的后缀，保证同一请求的200与304的ETag一致；
+比较If-None-Match时用 strip_etag_encoding 去掉后缀
+"""
+import os
+import gzip
+import io
+import logging
+
+try:
+    import brotli
+except ImportError:  # brotli为可选依赖，未安装时只提供gzip
+    brotli = None
+
+logger = logging.getLogger("response_compression")
+
+# 小于该字节数的响应不压缩
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# 不压缩的内容类型前缀：图片本身已压缩，导出文件和事件流需要原样逐块输出
+EXCLUDED_CONTENT_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "text/csv",
+    "text/event-stream",
+    "application/zip",
+    "application/gzip",
+    "application/octet-stream",
+    "application/vnd.openxmlformats",
+)
+
+
+ETAG_ENCODING_SUFFIXES = ("-br", "-gzip")
+
+
+def encoded_etag(etag, encoding):
+    """返回压缩后响应使用的ETag，弱ETag本身不要求逐字节相同，保持不变"""
+    if etag.startswith("W/") or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_etag_encoding(etag):
+    """去掉 encoded_etag 添加的编码后缀，得到与响应体编码无关的ETag"""
+    for suffix in ETAG_ENCODING_SUFFIXES:
+        if etag.endswith(suffix + '"'):
+            return etag[:-len(suffix) - 1] + '"'
+    return etag
+
+
+def _encode_etag_header(headers, encoding):
+    return [
+        (k, encoded_etag(v.decode("latin-1"), encoding).encode("latin-1") if k.lower() == b"etag" else v)
+        for k, v in headers
+    ]
+
+
+def _add_vary(headers):
+    """合并已有的Vary头并加上Accept-Encoding"""
+    vary = [v for k, v in headers if k.lower() == b"vary"]
+    headers = [(k, v) for k, v in headers if k.lower() != b"vary"]
+    headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"]) if vary else b"Accept-Encoding"))
+    return headers
+
+
+def choose_encoding(accept_encoding, brotli_available=None):
+    """
+    根据 Accept-Encoding 头选择压缩算法
+
+    Args:
+        accept_encoding: 请求的 Accept-Encoding 头
+        brotli_available: 是否可以使用br，默认根据brotli模块是否安装判断
+
+    Returns:
+        str: "br"、"gzip"，不支持压缩时返回None
+    """
+    if brotli_available is None:
+        brotli_available = brotli is not None
+
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token] = quality
+
+    candidates = ["br", "gzip"] if brotli_available else ["gzip"]
+    best = None
+    for encoding in candidates:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+class _GzipStream:
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.file = gzip.GzipFile(mode="wb", fileobj=self.buffer, compresslevel=GZIP_LEVEL)
+
+    def _drain(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def compress(self, data):
+        self.file.write(data)
+        self.file.flush()
+        return self._drain()
+
+    def finish(self):
+        self.file.close()
+        return self._drain()
+
+
+class _BrotliStream:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    ASGI响应压缩中间件
+
+    响应体先缓冲到超过 minimum_size 再决定是否压缩，
+    小响应原样返回；流式响应超过阈值后按块压缩输出
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder)
+
+
+class _CompressionResponder:
+    def __init__(self, send, encoding, minimum_size):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.passthrough = False
+        self.stream = None
+        self.pending = []
+        self.pending_size = 0
+
+    async def __call__(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            self.start_message = message
+            response_headers = {k.lower(): v for k, v in message.get("headers", [])}
+            content_type = response_headers.get(b"content-type", b"").decode("latin-1").lower()
+            if (
+                b"content-encoding" in response_headers
+                or content_type.startswith(EXCLUDED_CONTENT_TYPES)
+                or message.get("status", 200) in (204, 304)
+            ):
+                self.passthrough = True
+                if message.get("status") == 304 and b"content-encoding" not in response_headers:
+                    # 与同一请求下200响应的ETag一致（无论200是否达到压缩阈值）
+                    message = {**message, "headers": _encode_etag_header(message.get("headers", []), self.encoding)}
+                await self.send(message)
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.stream is not None:
+            # 已开始压缩，逐块压缩输出
+            data = self.stream.compress(body) if body else b""
+            if not more_body:
+                data += self.stream.finish()
+            if data or not more_body:
+                await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        self.pending.append(body)
+        self.pending_size += len(body)
+
+        if self.pending_size < self.minimum_size:
+            if more_body:
+                return
+            # 响应结束仍未达到阈值，原样输出；ETag仍加编码后缀，与同一请求的304保持一致
+            start_message = self.start_message
+            start_headers = start_message.get("headers", [])
+            if any(k.lower() == b"etag" for k, _ in start_headers):
+                start_message = {**start_message, "headers": _add_vary(_encode_etag_header(start_headers, self.encoding))}
+            await self.send(start_message)
+            await self.send({"type": "http.response.body", "body": b"".join(self.pending), "more_body": False})
+            return
+
+        # 超过阈值，开始压缩
+        self.stream = _BrotliStream() if self.encoding == "br" else _GzipStream()
+        buffered = b"".join(self.pending)
+        self.pending = []
+        data = self.stream.compress(buffered)
+        if not more_body:
+            data += self.stream.finish()
+
+        start_headers = [
+            (k, v) for k, v in _encode_etag_header(self.start_message.get("headers", []), self.encoding)
+            if k.lower() != b"content-length"
+        ]
+        start_headers = _add_vary(start_headers)
+        start_headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        if not more_body:
+            start_headers.append((b"content-length", str(len(data)).encode("latin-1")))
+
+        await self.send({**self.start_message, "headers": start_headers})
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -0,0 +1,139 @@
+"""
+采样分析器
+在运行中的进程里按固定间隔采样所有线程的调用栈，输出火焰图工具（flamegraph.pl、speedscope）
+可直接读取的collapsed格式：每行为“根帧;...;叶帧 次数”。
+采样只读取 sys._current_frames()，不需要给代码插桩，对被采样线程几乎没有影响。
+
+API进程通过管理员接口触发；爬虫和分析作为独立进程运行时，
+向进程发送 SIGUSR2 即可采样 PROFILE_SIGNAL_SECONDS 秒，结果写入 logs/profiles/
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger("sampling_profiler")
+
+# 单次采样最长时间（秒）
+MAX_SECONDS = 60
+# 默认采样间隔（毫秒）
+DEFAULT_INTERVAL_MS = 10
+# 收到SIGUSR2后的采样时间（秒）
+PROFILE_SIGNAL_SECONDS = int(os.getenv("PROFILE_SIGNAL_SECONDS", "30"))
+# 信号触发的采样结果目录
+PROFILE_OUTPUT_DIR = os.path.join("logs", "profiles")
+
+# 同一进程同时只允许一个采样，避免叠加开销
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """已有采样正在进行"""
+    pass
+
+
+def _frame_label(frame, include_lines):
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    if include_lines:
+        return f"{code.co_name} ({filename}:{frame.f_lineno})"
+    return f"{code.co_name} ({filename})"
+
+
+def _collapse(frame, thread_name, include_lines):
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame, include_lines))
+        frame = frame.f_back
+    stack.append(thread_name)
+    stack.reverse()
+    # 分号是collapsed格式的分隔符
+    return ";".join(part.replace(";", ":") for part in stack)
+
+
+def sample(seconds, interval_ms=DEFAULT_INTERVAL_MS, thread_filter=None, include_lines=False):
+    """
+    采样当前进程所有线程的调用栈
+
+    Args:
+        seconds: 采样时长，最长 MAX_SECONDS 秒
+        interval_ms: 采样间隔（毫秒）
+        thread_filter: 只采样名称包含该字符串的线程
+        include_lines: 帧名称是否包含行号
+
+    Returns:
+        tuple: (collapsed格式文本, 采样轮数)
+
+    Raises:
+        ProfilerBusyError: 已有采样正在进行
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("已有采样正在进行")
+    try:
+        seconds = max(0.1, min(float(seconds), MAX_SECONDS))
+        interval = max(1, interval_ms) / 1000.0
+        own_ident = threading.get_ident()
+        stacks = Counter()
+        rounds = 0
+        deadline = time.monotonic() + seconds
+
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                name = names.get(ident, f"thread-{ident}")
+                if thread_filter and thread_filter not in name:
+                    continue
+                stacks[_collapse(frame, name, include_lines)] += 1
+            rounds += 1
+            time.sleep(interval)
+
+        lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+        return "\n".join(lines) + ("\n" if lines else ""), rounds
+    finally:
+        _profile_lock.release()
+
+
+def _profile_to_file(seconds):
+    try:
+        os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+        collapsed, rounds = sample(seconds)
+        filename = os.path.join(
+            PROFILE_OUTPUT_DIR,
+            f"{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+        )
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(collapsed)
+        logger.info(f"采样完成，共 {rounds} 轮，结果已写入 {filename}")
+    except ProfilerBusyError:
+        logger.warning("已有采样正在进行，忽略本次信号")
+    except Exception as e:
+        logger.error(f"信号触发的采样失败: {str(e)}")
+
+
+def _handle_signal(signum, frame):
+    # 信号处理函数运行在主线程，采样放到后台线程，避免阻塞主线程
+    threading.Thread(
+        target=_profile_to_file,
+        args=(PROFILE_SIGNAL_SECONDS,),
+        name="sampling-profiler",
+        daemon=True
+    ).start()
+
+
+def install_signal_handler():
+    """注册SIGUSR2采样，必须在主线程调用；不支持该信号的平台（Windows）直接忽略"""
+    if not hasattr(signal, "SIGUSR2"):
+        return False
+    try:
+        signal.signal(signal.SIGUSR2, _handle_signal)
+        logger.info(f"已注册SIGUSR2采样，kill -USR2 {os.getpid()} 可采样 {PROFILE_SIGNAL_SECONDS} 秒")
+        return True
+    except ValueError:
+        # 不在主线程中
+        logger.warning("只能在主线程中注册SIGUSR2采样")
+        return False
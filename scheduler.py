@@ -0,0 +1,489 @@
+"""
+定时任务调度器
+从 scheduled_tasks 读取调度配置（cron表达式，兼容旧的 daily / weekly|N / monthly|N 格式），
+计算下次运行时间，到期时把爬虫任务写入jobs队列：
+
+- 多个API进程都会启动调度线程，通过PostgreSQL会话级咨询锁选出唯一的leader，
+  只有leader触发定时任务；leader退出后连接断开、锁自动释放，其他进程接替
+- 每次触发记录在 scheduled_task_runs 中，(scheduled_task_id, scheduled_for) 唯一，
+  leader切换时同一时刻不会重复触发
+- 停机期间错过的运行在恢复后合并补跑一次，超过补跑窗口的只记录为 skipped
+"""
+import os
+import time
+import datetime
+import logging
+import threading
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import db_config
+import event_bus
+import job_queue
+import task_dispatch
+from cities import get_city_code
+
+logger = logging.getLogger("scheduler")
+
+# leader检查到期任务的间隔（秒）
+POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", "30"))
+# 非leader尝试获取leader锁的间隔（秒）
+LEADER_RETRY_INTERVAL = float(os.getenv("SCHEDULER_LEADER_RETRY_INTERVAL", "30"))
+# 错过的运行在多长时间内仍然补跑（小时）
+CATCHUP_WINDOW_HOURS = float(os.getenv("SCHEDULER_CATCHUP_WINDOW_HOURS", "24"))
+# 完成的任务队列记录保留天数，由leader每天凌晨提交清理任务
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "30"))
+# leader选举使用的咨询锁
+LEADER_LOCK_NAME = "rental_scheduler_leader"
+
+# 调度器自身的维护任务：(cron表达式, maintenance任务参数)
+MAINTENANCE_SCHEDULES = [
+    ("0 4 * * *", {"action": "purge_jobs", "days": JOB_RETENTION_DAYS}),
+]
+
+# 调度器专用的数据库连接池
+connection_pool = db_config.LazyPool(
+    lambda: db_config.create_pool(
+        min_conn=1,
+        max_conn=3,
+        application_name="scheduler"
+    ),
+    "定时任务调度"
+)
+
+_schema_ready = False
+
+
+# ---------------------------------------------------------------------------
+# cron表达式
+# ---------------------------------------------------------------------------
+
+class CronExpression:
+    """
+    标准5段cron表达式：分 时 日 月 周
+
+    每段支持 *、数字、范围 a-b、步长 */n 或 a-b/n、逗号分隔的列表；
+    月和周支持英文缩写（jan、mon）；周的0和7都表示周日。
+    日和周都被限制时，两者满足其一即可（与crontab一致）
+    """
+
+    FIELDS = [
+        ("minute", 0, 59),
+        ("hour", 0, 23),
+        ("day", 1, 31),
+        ("month", 1, 12),
+        ("weekday", 0, 7),
+    ]
+    NAMES = {
+        "month": {name: i + 1 for i, name in enumerate(
+            ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])},
+        "weekday": {name: i for i, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])},
+    }
+    # 向后搜索下次运行时间的最大天数
+    MAX_SEARCH_DAYS = 366 * 5
+
+    def __init__(self, expression):
+        self.expression = " ".join(expression.split())
+        parts = self.expression.split(" ")
+        if len(parts) != 5:
+            raise ValueError(f"cron表达式需要5段（分 时 日 月 周）: {expression}")
+
+        values = {}
+        for text, (name, low, high) in zip(parts, self.FIELDS):
+            values[name] = self._parse_field(text.lower(), name, low, high)
+
+        self.minutes = sorted(values["minute"])
+        self.hours = sorted(values["hour"])
+        self.days = values["day"]
+        self.months = values["month"]
+        self.weekdays = {0 if day == 7 else day for day in values["weekday"]}
+        self.day_restricted = parts[2] != "*"
+        self.weekday_restricted = parts[4] != "*"
+
+    def _parse_value(self, text, name, low, high):
+        value = self.NAMES.get(name, {}).get(text)
+        if value is None:
+            if not text.isdigit():
+                raise ValueError(f"cron表达式 {name} 段的取值无效: {text}")
+            value = int(text)
+        if not low <= value <= high:
+            raise ValueError(f"cron表达式 {name} 段的取值超出范围 {low}-{high}: {text}")
+        return value
+
+    def _parse_field(self, text, name, low, high):
+        result = set()
+        for item in text.split(","):
+            base, _, step = item.partition("/")
+            step = int(step) if step else 1
+            if step < 1:
+                raise ValueError(f"cron表达式 {name} 段的步长无效: {item}")
+            if base == "*":
+                start, end = low, high
+            elif "-" in base:
+                start, end = (self._parse_value(v, name, low, high) for v in base.split("-", 1))
+                if start > end:
+                    raise ValueError(f"cron表达式 {name} 段的范围无效: {item}")
+            else:
+                start = self._parse_value(base, name, low, high)
+                end = high if "/" in item else start
+            result.update(range(start, end + 1, step))
+        return result
+
+    def matches_date(self, date):
+        """日期是否满足 日/月/周 三段"""
+        if date.month not in self.months:
+            return False
+        day_ok = date.day in self.days
+        # Python的weekday()周一为0，cron周日为0
+        weekday_ok = (date.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        if self.day_restricted:
+            return day_ok
+        if self.weekday_restricted:
+            return weekday_ok
+        return True
+
+    def next_after(self, moment):
+        """严格晚于moment的下一次运行时间（精确到分钟）"""
+        start = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        date = start.date()
+        for offset in range(self.MAX_SEARCH_DAYS):
+            day = date + datetime.timedelta(days=offset)
+            if not self.matches_date(day):
+                continue
+            for hour in self.hours:
+                if offset == 0 and hour < start.hour:
+                    continue
+                for minute in self.minutes:
+                    if offset == 0 and hour == start.hour and minute < start.minute:
+                        continue
+                    return datetime.datetime(day.year, day.month, day.day, hour, minute)
+        raise ValueError(f"cron表达式 {self.expression} 在 {self.MAX_SEARCH_DAYS} 天内没有可运行的时间")
+
+
+def to_cron(schedule, run_time=None):
+    """
+    把scheduled_tasks中的调度配置转换为cron表达式
+
+    Args:
+        schedule: cron|<表达式>，或旧格式 daily、weekly|<0-6，0为周日>、monthly|<1-31>
+        run_time: 旧格式的运行时间 HH:MM，默认 00:00
+
+    Returns:
+        str: cron表达式
+    """
+    schedule_type, _, value = (schedule or "").partition("|")
+    if schedule_type == "cron":
+        return value.strip()
+
+    hour, minute = 0, 0
+    if run_time:
+        hour_text, _, minute_text = run_time.partition(":")
+        hour, minute = int(hour_text), int(minute_text or 0)
+
+    if schedule_type == "daily":
+        return f"{minute} {hour} * * *"
+    if schedule_type == "weekly" and value:
+        return f"{minute} {hour} * * {int(value)}"
+    if schedule_type == "monthly" and value:
+        return f"{minute} {hour} {int(value)} * *"
+    raise ValueError(f"不支持的调度配置: {schedule}")
+
+
+def parse_schedule(schedule, run_time=None):
+    """解析调度配置，配置无效时抛出ValueError"""
+    return CronExpression(to_cron(schedule, run_time))
+
+
+def next_run_time(schedule, run_time=None, after=None):
+    """计算调度配置在after（默认当前时间）之后的下一次运行时间"""
+    return parse_schedule(schedule, run_time).next_after(after or datetime.datetime.now())
+
+
+# ---------------------------------------------------------------------------
+# 运行记录
+# ---------------------------------------------------------------------------
+
+def ensure_schema():
+    """创建scheduled_task_runs表，旧数据库升级时使用，新库由init.sql创建"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scheduled_task_runs (
+                id SERIAL PRIMARY KEY,
+                scheduled_task_id INTEGER NOT NULL REFERENCES scheduled_tasks(id) ON DELETE CASCADE,
+                scheduled_for TIMESTAMP NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                missed_runs INTEGER NOT NULL DEFAULT 0,
+                crawl_task_id INTEGER REFERENCES crawl_task(id) ON DELETE SET NULL,
+                job_id BIGINT,
+                leader VARCHAR(100),
+                error TEXT,
+                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (scheduled_task_id, scheduled_for)
+            )
+            """
+        )
+        conn.commit()
+        _schema_ready = True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"创建scheduled_task_runs表失败: {str(e)}")
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def list_runs(scheduled_task_id, limit=20):
+    """定时任务最近的运行记录，附带爬虫任务和队列任务的当前状态"""
+    ensure_schema()
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            """
+            SELECT r.*, c.status AS crawl_status, j.status AS job_status, j.last_error AS job_error
+            FROM scheduled_task_runs r
+            LEFT JOIN crawl_task c ON c.id = r.crawl_task_id
+            LEFT JOIN jobs j ON j.id = r.job_id
+            WHERE r.scheduled_task_id = %s
+            ORDER BY r.scheduled_for DESC
+            LIMIT %s
+            """,
+            (scheduled_task_id, limit)
+        )
+        runs = [dict(row) for row in cursor.fetchall()]
+        conn.commit()
+        return runs
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+# ---------------------------------------------------------------------------
+# 触发
+# ---------------------------------------------------------------------------
+
+def _record_run(cursor, task_id, scheduled_for, status, leader, missed_runs=0, error=None):
+    """写入运行记录，同一时刻已经有记录时返回None"""
+    cursor.execute(
+        """
+        INSERT INTO scheduled_task_runs (scheduled_task_id, scheduled_for, status, missed_runs, leader, error)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (scheduled_task_id, scheduled_for) DO NOTHING
+        RETURNING id
+        """,
+        (task_id, scheduled_for, status, missed_runs, leader, error)
+    )
+    row = cursor.fetchone()
+    return row["id"] if row else None
+
+
+def _fire(conn, task, scheduled_for, missed_runs, leader):
+    """创建爬虫任务并写入队列，运行记录、爬虫任务和队列任务在同一个事务中写入"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    crawl_task_id = None
+    try:
+        run_id = _record_run(cursor, task["id"], scheduled_for, "queued", leader, missed_runs)
+        if run_id is None:
+            conn.rollback()
+            logger.info(f"定时任务 {task['id']} 在 {scheduled_for} 的运行已由其他进程触发")
+            return
+
+        city_code = get_city_code(task["city"])
+        if not city_code:
+            raise ValueError(f"无效的城市: {task['city']}")
+
+        cursor.execute(
+            "INSERT INTO crawl_task (city, city_code, start_time, status) VALUES (%s, %s, %s, %s) RETURNING id",
+            (task["city"], city_code, datetime.datetime.now(), "Queued")
+        )
+        crawl_task_id = cursor.fetchone()["id"]
+        queue_position, planned_pages, job_id = task_dispatch.queue_crawl_in_transaction(
+            cursor, crawl_task_id, task["pages"]
+        )
+        cursor.execute(
+            "UPDATE scheduled_task_runs SET crawl_task_id = %s, job_id = %s WHERE id = %s",
+            (crawl_task_id, job_id, run_id)
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"定时任务 {task['id']} 触发失败: {str(e)}")
+        _record_run(cursor, task["id"], scheduled_for, "failed", leader, missed_runs, str(e))
+        conn.commit()
+        return
+
+    logger.info(f"定时任务 {task['id']}（{task['name']}）已触发，计划时间 {scheduled_for}，"
+                f"爬虫任务 {crawl_task_id}，队列位置 {queue_position}"
+                + (f"，合并了 {missed_runs} 次错过的运行" if missed_runs else ""))
+    event_bus.publish_task(crawl_task_id, city=task["city"], city_code=city_code, status="Queued",
+                           queue_position=queue_position, total_pages=planned_pages,
+                           start_time=datetime.datetime.now())
+
+
+def _run_due_tasks(leader):
+    """触发所有到期的定时任务并更新下次运行时间"""
+    now = datetime.datetime.now()
+    window = datetime.timedelta(hours=CATCHUP_WINDOW_HOURS)
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            "SELECT * FROM scheduled_tasks WHERE status = '正常' AND (next_run IS NULL OR next_run <= %s)",
+            (now,)
+        )
+        tasks = cursor.fetchall()
+        conn.commit()
+
+        for task in tasks:
+            try:
+                cron = parse_schedule(task["schedule"], task["time"])
+            except ValueError as e:
+                logger.error(f"定时任务 {task['id']} 的调度配置无效: {str(e)}")
+                cursor.execute("UPDATE scheduled_tasks SET status = '错误', next_run = NULL WHERE id = %s",
+                               (task["id"],))
+                conn.commit()
+                continue
+
+            if task["next_run"] is not None:
+                # 停机期间错过的运行合并为最近一次
+                latest, missed_runs = task["next_run"], 0
+                following = cron.next_after(latest)
+                while following <= now:
+                    latest, missed_runs = following, missed_runs + 1
+                    following = cron.next_after(latest)
+
+                if now - latest > window:
+                    logger.warning(f"定时任务 {task['id']} 错过的运行 {latest} 超出补跑窗口，跳过")
+                    _record_run(cursor, task["id"], latest, "skipped", leader, missed_runs,
+                                f"超出 {CATCHUP_WINDOW_HOURS} 小时补跑窗口")
+                    conn.commit()
+                else:
+                    _fire(conn, task, latest, missed_runs, leader)
+
+            cursor.execute(
+                "UPDATE scheduled_tasks SET next_run = %s WHERE id = %s",
+                (cron.next_after(now), task["id"])
+            )
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+class Scheduler:
+    """调度线程：竞选leader，当选后定期触发到期的定时任务"""
+
+    def __init__(self):
+        self.name = task_dispatch.worker_name("scheduler")
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._leader_conn = None
+        self._maintenance = [(CronExpression(expr), payload, None) for expr, payload in MAINTENANCE_SCHEDULES]
+
+    @property
+    def is_leader(self):
+        return self._leader_conn is not None and not self._leader_conn.closed
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._release_leadership()
+
+    def _try_become_leader(self):
+        """用独立连接获取会话级咨询锁，连接保持期间一直是leader"""
+        params = db_config.DB_PARAMS.copy()
+        params["application_name"] = "scheduler_leader"
+        conn = psycopg2.connect(**params)
+        conn.set_session(autocommit=True)
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (LEADER_LOCK_NAME,))
+        if cursor.fetchone()[0]:
+            self._leader_conn = conn
+            logger.info(f"{self.name} 成为定时任务调度leader")
+            return True
+        conn.close()
+        return False
+
+    def _check_leadership(self):
+        """确认leader连接仍然可用，连接断开时锁已被数据库释放"""
+        try:
+            self._leader_conn.cursor().execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.warning(f"leader连接已断开，放弃leader身份: {str(e)}")
+            self._release_leadership()
+            return False
+
+    def _release_leadership(self):
+        conn, self._leader_conn = self._leader_conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _run_maintenance(self, now):
+        """到时间时提交maintenance任务"""
+        schedules = []
+        for cron, payload, next_time in self._maintenance:
+            if next_time is None:
+                next_time = cron.next_after(now)
+            elif next_time <= now:
+                job_queue.enqueue("maintenance", payload)
+                next_time = cron.next_after(now)
+            schedules.append((cron, payload, next_time))
+        self._maintenance = schedules
+
+    def _run(self):
+        logger.info(f"定时任务调度线程 {self.name} 启动")
+        while not self._stop_event.is_set():
+            try:
+                if not self.is_leader and not self._try_become_leader():
+                    self._stop_event.wait(LEADER_RETRY_INTERVAL)
+                    continue
+                if not self._check_leadership():
+                    continue
+
+                ensure_schema()
+                started = time.perf_counter()
+                _run_due_tasks(self.name)
+                self._run_maintenance(datetime.datetime.now())
+                elapsed = time.perf_counter() - started
+                self._stop_event.wait(max(POLL_INTERVAL - elapsed, 1))
+            except Exception as e:
+                logger.error(f"定时任务调度出错: {str(e)}")
+                self._stop_event.wait(POLL_INTERVAL)
+        self._release_leadership()
+        logger.info(f"定时任务调度线程 {self.name} 已退出")
+
+
+_scheduler = None
+
+
+def start():
+    """启动本进程的调度线程，重复调用返回同一个实例"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+        _scheduler.start()
+    return _scheduler
+
+
+def stop():
+    """停止调度线程并释放leader锁"""
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
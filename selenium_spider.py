@@ -10,31 +10,46 @@ import psycopg2
 from psycopg2 import pool
 from psycopg2 import errors as psycopg2_errors
 from urllib.parse import urlparse
-import pandas as pd
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 import requests
 import threading
-import concurrent.futures  # 导入并行处理模块
 import ip_manager  # 导入IP管理模块
 # 导入数据库配置
 import db_config
 # 导入数据库工具
 import db_utils
-# 导入数据分析模块
-import data_processor
+# 数据分析模块依赖PySpark，只在爬取完成后执行分析时才导入
+from lazy_loader import lazy_import
+data_processor = lazy_import("data_processor")
+# 导入城市列表
+import cities
+# 导入任务分发
+import task_dispatch
+# 导入持久化任务队列
+import job_queue
 
 # 导入DrissionPage
 from DrissionPage import ChromiumPage
 from DrissionPage.errors import ElementNotFoundError
 from DrissionPage._configs.chromium_options import ChromiumOptions
-import cv2
-import numpy as np
 # 导入验证管理器
 import verification_manager
+# 导入图片缓存模块
+import image_cache
+# 导入进度事件总线
+import event_bus
+# 导入监控指标
+import metrics
+# 导入采样分析器
+import sampling_profiler
+# 导入浏览器池
+import browser_pool
+# 导入房源列表页解析
+import listing_parser
+# 房源批量upsert
+import house_store
+# 列表页HTTP抓取（带浏览器cookie），失败时退回浏览器
+import listing_fetcher
+import crawl_engine
 
 # 确保logs目录存在
 logs_dir = "logs"
@@ -61,10 +76,8 @@ console_handler.setLevel(logging.INFO)
 # 重新配置logger处理器
 logger.handlers = [file_handler, console_handler]
 
-# 创建爬虫专用的数据库连接池
-connection_pool = db_config.create_spider_pool()
-if not connection_pool:
-    logger.error("无法创建爬虫数据库连接池，程序可能无法正常工作")
+# 爬虫专用的数据库连接池，第一次使用时才建立连接
+connection_pool = db_config.LazyPool(db_config.create_spider_pool, "rental_spider")
 
 # 获取数据库连接的辅助函数
 def get_db_connection():
@@ -81,6 +94,21 @@ _thread_driver_map = {}
 BROWSER_WINDOW_WIDTH = 1920
 BROWSER_WINDOW_HEIGHT = 1080
 
+# 队列任务遇到爬虫锁被占用时的重试间隔（秒）
+CRAWL_LOCK_RETRY_SECONDS = int(os.getenv("CRAWL_LOCK_RETRY_SECONDS", "30"))
+# 房源列表的提取方式：snapshot 解析整页HTML快照；cdp 逐个元素通过DrissionPage读取
+LISTING_PARSE_MODE = os.getenv("LISTING_PARSE_MODE", "snapshot")
+# 等待页面出现房源列表或验证码的最长秒数
+PAGE_READY_TIMEOUT = float(os.getenv("PAGE_READY_TIMEOUT", "15"))
+# 等待验证码加载、拖动滑块后等待验证结果的最长秒数
+CAPTCHA_WAIT_TIMEOUT = float(os.getenv("CAPTCHA_WAIT_TIMEOUT", "10"))
+# 轮询页面条件的间隔秒数
+WAIT_POLL_INTERVAL = 0.2
+
+LISTING_ITEM_LOCATOR = f"css:{listing_parser.ITEM_SELECTOR}"
+CAPTCHA_BG_JS = 'return window.getComputedStyle(document.getElementsByClassName("geetest_bg")[0]).backgroundImage.slice(5, -2)'
+CAPTCHA_ELEMENT_LOCATOR = 'xpath://*[contains(text(), "验证码") or contains(text(), "人机验证") or contains(text(), "安全验证") or contains(@id, "captcha")]'
+
 def register_driver(driver):
     """注册当前线程的WebDriver对象"""
     thread_id = threading.current_thread().ident
@@ -214,6 +242,8 @@ def start_crawl_task(city, city_code):
         task_id = cursor.fetchone()[0]
         conn.commit()
         logger.info(f"创建爬虫任务成功，任务ID: {task_id}")
+        event_bus.publish_task(task_id, city=city, city_code=city_code, status="In Progress",
+                               start_time=datetime.datetime.now())
         return task_id
     except Exception as e:
         logger.error(f"创建爬虫任务失败: {str(e)}")
@@ -224,10 +254,15 @@ def start_crawl_task(city, city_code):
 
 @with_db_connection
 def update_crawl_task(conn, task_id, status, success_items=None, success_pages=None, 
-                   failed_pages=None, end_time=None, error=None, total_pages=None, expected_items=None):
+                   failed_pages=None, end_time=None, error=None, total_pages=None, expected_items=None,
+                   error_message=None):
     """
     更新爬虫任务状态
+    
+    error_message 与 error 含义相同，兼容两种调用写法
     """
+    if error is None:
+        error = error_message
     try:
         cursor = conn.cursor()
         
@@ -272,6 +307,17 @@ def update_crawl_task(conn, task_id, status, success_items=None, success_pages=N
         conn.commit()
         
         logger.info(f"更新爬虫任务成功，任务ID: {task_id}")
+        event_bus.publish_task(
+            task_id,
+            status=status,
+            success_items=success_items,
+            success_pages=success_pages,
+            failed_pages=failed_pages,
+            total_pages=total_pages,
+            total_items=expected_items,
+            end_time=end_time,
+            error_message=error
+        )
         return True
     except Exception as e:
         conn.rollback()
@@ -550,7 +596,7 @@ def is_captcha_page(driver):
         # 检查页面中是否包含验证码相关元素
         try:
             # DrissionPage的查找元素方法
-            captcha_elements = driver.eles('xpath://*[contains(text(), "验证码") or contains(text(), "人机验证") or contains(text(), "安全验证") or contains(@id, "captcha")]')
+            captcha_elements = driver.eles(CAPTCHA_ELEMENT_LOCATOR)
             if captcha_elements:
                 logger.warning("检测到验证码页面")
                 return True
@@ -568,9 +614,61 @@ def is_captcha_page(driver):
         logger.error(f"检查验证码页面时出错: {str(e)}")
         return False
 
+def wait_until(condition, name, timeout):
+    """
+    轮询直到condition()为真或超时，替代导航后的固定等待，耗时按条件记录到指标
+    
+    Args:
+        condition: 无参数的判断函数，抛出异常视为条件不满足
+        name: 条件名称，用于指标和日志
+        timeout: 最长等待秒数
+    
+    Returns:
+        条件满足时condition()的返回值，超时返回None
+    """
+    start = time.perf_counter()
+    deadline = start + timeout
+    result = None
+    while True:
+        try:
+            result = condition()
+        except Exception:
+            result = None
+        if result or time.perf_counter() >= deadline:
+            break
+        time.sleep(WAIT_POLL_INTERVAL)
+    elapsed = time.perf_counter() - start
+    metrics.CRAWLER_WAIT_SECONDS.labels(condition=name, result="met" if result else "timeout").observe(elapsed)
+    if not result:
+        logger.warning(f"等待{name}超时（{timeout} 秒）")
+    return result or None
+
+def listing_page_state(driver):
+    """页面上已出现房源列表时返回"listing"，出现验证码时返回"captcha"，都没有时返回None"""
+    if driver.ele(LISTING_ITEM_LOCATOR, timeout=0):
+        return "listing"
+    if driver.ele(CAPTCHA_ELEMENT_LOCATOR, timeout=0):
+        return "captcha"
+    title = driver.title or ""
+    if "验证" in title or "captcha" in title.lower():
+        return "captcha"
+    return None
+
+def wait_for_listing_or_captcha(driver, timeout=PAGE_READY_TIMEOUT):
+    """导航后等待房源列表或验证码出现，返回"listing"、"captcha"，超时返回None"""
+    return wait_until(lambda: listing_page_state(driver), "列表页加载", timeout)
+
+def captcha_gone(driver):
+    """验证通过、已经回到租房列表页"""
+    current_url = driver.url
+    return "zu.ke.com/zufang" in current_url and "captcha" not in current_url
+
 # 使用直接像素差分法识别滑块缺口
 def detect_gap_position(bg_bytes):
     """使用直接像素差分法识别滑块缺口位置"""
+    # OpenCV/NumPy只在遇到验证码时才需要
+    import cv2
+    import numpy as np
     try:
         # 将二进制图像转换为OpenCV格式
         bg_img = cv2.imdecode(np.frombuffer(bg_bytes, np.uint8), cv2.IMREAD_COLOR)
@@ -716,13 +814,13 @@ def solve_slider_captcha(page, session_id=None):
     except Exception as e:
         logger.warning(f"点击开始验证按钮失败: {str(e)}")
         
-    # 2. 休眠等待验证码加载
-    time.sleep(2)
+    # 2. 等待验证码背景图加载
+    wait_until(lambda: page.ele('css:.geetest_bg', timeout=0), "验证码加载", CAPTCHA_WAIT_TIMEOUT)
     while True:  # 无限循环尝试
         attempt += 1
         # 3. 获取滑块验证码有缺口的图片
         logger.info("获取背景图片")
-        bg_src = page.run_js('return window.getComputedStyle(document.getElementsByClassName("geetest_bg")[0]).backgroundImage.slice(5, -2)')
+        bg_src = page.run_js(CAPTCHA_BG_JS)
         response = requests.get(bg_src)
         response.raise_for_status()
         bg_bytes = response.content  # 保存原始字节用于处理
@@ -776,7 +874,7 @@ def solve_slider_captcha(page, session_id=None):
             # 鼠标移动到滑块按钮
             actions.move_to(slide_btn)
             
-            # 按下鼠标左键
+            # 按下鼠标左键（以下停顿是模拟人手拖动的节奏，不是等待页面）
             actions.m_hold(slide_btn)
             time.sleep(0.2)
             
@@ -795,17 +893,12 @@ def solve_slider_captcha(page, session_id=None):
             
             logger.info("滑块拖动完成")
             
-            # 等待验证结果
-            time.sleep(5)
-            verification_success = False
-            
-            # 简化验证结果检测
-            # 获取页面文本内容
+            # 等待验证结果：跳回租房列表页即验证通过
+            verification_success = bool(wait_until(lambda: captcha_gone(page), "验证结果", CAPTCHA_WAIT_TIMEOUT))
             current_url = page.url
             logger.info(f"当前URL: {current_url}")
 
-            if "zu.ke.com/zufang" in current_url and "captcha" not in current_url:
-                verification_success = True
+            if verification_success:
                 logger.info(f"已经成功跳转到租房列表页面: {current_url}")
             
             # # 判断是否通过验证
@@ -835,9 +928,9 @@ def solve_slider_captcha(page, session_id=None):
             
             # 验证失败，继续循环
             logger.warning(f"验证失败 [尝试 {attempt}]")
-            # 等待一小段时间后继续下一次尝试
-            logger.info(f"等待后进行下一次尝试 [{attempt}]")
-            time.sleep(2)
+            # 等验证码换出新的背景图后继续下一次尝试
+            logger.info(f"等待验证码刷新后进行下一次尝试 [{attempt}]")
+            wait_until(lambda: page.run_js(CAPTCHA_BG_JS) not in (None, "", bg_src), "验证码刷新", CAPTCHA_WAIT_TIMEOUT)
                     
         except Exception as e:
             logger.error(f"拖动滑块失败: {str(e)}")
@@ -859,8 +952,12 @@ def handle_captcha_with_manager(driver, task_id, city_code, page_url):
         
         # ===尝试自动解决验证码===
         logger.info("尝试自动解决验证码...")
-        # 等待一段时间让页面完全加载
-        time.sleep(5)
+        # 等待验证按钮或验证码出现
+        wait_until(
+            lambda: driver.ele('xpath://div/div[@aria-label]', timeout=0) or driver.ele('css:.geetest_bg', timeout=0),
+            "验证按钮",
+            CAPTCHA_WAIT_TIMEOUT,
+        )
         
         result = solve_slider_captcha(driver)
         captcha_success = False
@@ -889,7 +986,7 @@ def handle_captcha_with_manager(driver, task_id, city_code, page_url):
             logger.info(f"处理验证码用时 {captcha_duration:.2f} 分钟，将延长锁超时时间 {captcha_minutes} 分钟")
             
             # 延长锁的超时时间
-            if extend_crawler_lock(task_id, captcha_minutes):
+            if extend_crawler_lock(task_id, captcha_minutes, city_code=city_code):
                 logger.info(f"成功延长爬虫锁超时时间 {captcha_minutes} 分钟")
             else:
                 logger.warning("延长爬虫锁超时时间失败，可能会导致爬虫过早释放锁")
@@ -902,8 +999,14 @@ def handle_captcha_with_manager(driver, task_id, city_code, page_url):
         logger.error(f"详细错误: {traceback.format_exc()}")
         return False
 
-def setup_driver():
-    """设置并返回DrissionPage对象，替代原Selenium WebDriver"""
+def setup_driver(port=None, user_data_dir=None):
+    """
+    设置并返回DrissionPage对象，替代原Selenium WebDriver
+    
+    Args:
+        port: 远程调试端口，为None时由DrissionPage自动分配
+        user_data_dir: 浏览器用户数据目录，为None时使用DrissionPage默认目录
+    """
     try:
         logger.info("初始化DrissionPage替代Selenium WebDriver")
         
@@ -920,17 +1023,17 @@ def setup_driver():
                 credentials, address = proxy_url.split('@')
                 scheme, auth = credentials.split('://')
                 username, password = auth.split(':')
-                ip, port = address.split(':')
+                ip, proxy_port = address.split(':')
                 
                 # 为DrissionPage添加代理设置
                 proxy_config = {
                     'http': {
-                        'server': f'{ip}:{port}',
+                        'server': f'{ip}:{proxy_port}',
                         'username': username,
                         'password': password
                     },
                     'https': {
-                        'server': f'{ip}:{port}',
+                        'server': f'{ip}:{proxy_port}',
                         'username': username,
                         'password': password
                     }
@@ -938,12 +1041,12 @@ def setup_driver():
             else:
                 # 无用户名密码的情况: http://ip:port
                 scheme, ip_port = proxy_url.split('://')
-                ip, port = ip_port.split(':')
+                ip, proxy_port = ip_port.split(':')
                 
                 # 为DrissionPage添加代理设置
                 proxy_config = {
-                    'http': {'server': f'{ip}:{port}'},
-                    'https': {'server': f'{ip}:{port}'}
+                    'http': {'server': f'{ip}:{proxy_port}'},
+                    'https': {'server': f'{ip}:{proxy_port}'}
                 }
         
         # 根据是否有代理信息，创建DrissionPage对象
@@ -960,7 +1063,7 @@ def setup_driver():
             co.set_argument('--no-sandbox')
             co.set_argument('--disable-dev-shm-usage')
             co.set_argument('--disable-gpu')
-            co.set_argument('--remote-debugging-port=9222')
+            set_browser_instance(co, port, user_data_dir)
             co.set_proxy(proxy_config)
             page = ChromiumPage(co)
             mode_text = "headless" if use_headless else "界面"
@@ -974,11 +1077,14 @@ def setup_driver():
             co.set_argument('--no-sandbox')
             co.set_argument('--disable-dev-shm-usage')
             co.set_argument('--disable-gpu')
-            co.set_argument('--remote-debugging-port=9222')
+            set_browser_instance(co, port, user_data_dir)
             page = ChromiumPage(co)
             mode_text = "headless" if use_headless else "界面"
             logger.info(f"DrissionPage已配置{mode_text}模式")
         
+        # 记下浏览器使用的代理，HTTP方式获取列表页时走同一个出口IP，cookie才有效
+        page.crawler_proxy = proxy
+        
         # 设置窗口大小
         page.set.window.size(1920, 1080)
         
@@ -1023,12 +1129,15 @@ def setup_driver():
 
 def get_total_pages(driver, base_url=None):
     """获取总页数"""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     try:
         # 如果提供了base_url，先访问该URL
         if base_url:
             logger.info(f"访问URL获取总页数: {base_url}")
             driver.get(base_url)
-            time.sleep(random.uniform(2, 4))
+            wait_for_listing_or_captcha(driver)
             
         # 检查是否出现验证码
         if is_captcha_page(driver):
@@ -1073,8 +1182,10 @@ def get_total_pages(driver, base_url=None):
 
 def extract_house_info(house_element, city_code, task_id=None):
     """
-    从房源元素中提取信息
+    从房源元素中提取信息（逐个元素通过CDP读取）
     返回提取到的房源数据字典
+    
+    页面快照解析失败时的后备方式，正常情况下使用listing_parser一次性解析整页HTML
     """
     try:
         # 提取标题 - 使用DrissionPage的API
@@ -1088,7 +1199,8 @@ def extract_house_info(house_element, city_code, task_id=None):
             # 尝试通过XPath获取图片
             img_element = house_element.ele('css:.content__list--item--aside img')
             if img_element:
-                image_url = img_element.attr('src')
+                # 懒加载的图片src是占位图，优先取data-src，与快照解析一致
+                image_url = listing_parser.image_source(img_element.attr)
             else:
                 logger.warning("提取图片URL时出错: 没有找到图片元素")
         except Exception as img_error:
@@ -1096,80 +1208,22 @@ def extract_house_info(house_element, city_code, task_id=None):
         
         # 提取价格
         price_element = house_element.ele('css:.content__list--item-price')
-        price_text = price_element.text.strip()
-        # print(price_text)
-        price = int(re.search(r'\d+', price_text).group()) if re.search(r'\d+', price_text) else 0
+        price = listing_parser.parse_price(price_element.text.strip())
         
         # 提取户型、面积等信息
         desc_elements = house_element.eles('css:.content__list--item--des')
-        # print(desc_elements.text)
-        # 初始化变量
-        layout = ""
-        area = 0
-        floor = ""
-        direction = ""
-        district = ""
-        community = ""
-        subway = ""
-
-        desc_text = desc_elements[0].text
-        # 用 / 或 \n 分割成若干部分
-        desc_parts = [part.strip() for part in re.split(r'[\/\n]', desc_text) if part.strip()]
-        for part in desc_parts:
-            # print(f"🧩 part: {part}")
-
-            # 区域和小区（如：浦东-张江-玫瑰湾(别墅)）
-            if "-" in part and not district:
-                location_parts = part.split("-")
-                if len(location_parts) >= 2:
-                    district = location_parts[0]
-                    community = location_parts[-1]
-
-            # 面积
-            elif "㎡" in part and not area:
-                area_match = re.search(r'(\d+(\.\d+)?)', part)
-                if area_match:
-                    area = float(area_match.group(1))
-
-            # 户型
-            elif "室" in part and "厅" in part and not layout:
-                layout = part
-
-            # 楼层
-            elif "楼层" in part and not floor:
-                floor = part
-
-            # 朝向（只判断方向的汉字）
-            elif any(d in part for d in ["东", "南", "西", "北"]) and not direction:
-                direction = part
-
-            # 地铁
-            elif "号线" in part and not subway:
-                subway = part
-        
-        publish_date = datetime.datetime.now().strftime("%Y-%m-%d")
+        description = listing_parser.parse_description(desc_elements[0].text)
+        layout = description['layout']
+        area = description['area']
+        floor = description['floor']
+        direction = description['direction']
+        district = description['district']
+        community = description['community']
+        subway = description['subway']
+        
         publish_elements = house_element.eles('css:.content__list--item--time')
-
         if publish_elements:
-            publish_text = publish_elements[0].text.strip()
-
-            # 1. 格式：3天前维护
-            match_before = re.search(r'(\d+)天前', publish_text)
-            if match_before:
-                days = int(match_before.group(1))
-                publish_date = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
-
-            # 3. 格式：今天维护
-            elif "今天维护" in publish_text:
-                publish_date = datetime.datetime.now().strftime('%Y-%m-%d')
-
-            # 4. 格式：05.12发布
-            else:
-                date_match = re.search(r'(\d{2})\.(\d{2})', publish_text)
-                if date_match:
-                    year = datetime.datetime.now().year
-                    month, day = date_match.groups()
-                    publish_date = f"{year}-{month}-{day}"
+            publish_date = listing_parser.parse_publish_date(publish_elements[0].text.strip())
         else:
             publish_date = None
         
@@ -1219,6 +1273,57 @@ def extract_house_info(house_element, city_code, task_id=None):
         logger.error(f"详细错误: {traceback.format_exc()}")
         return None
 
+def set_browser_instance(co, port, user_data_dir):
+    """设置浏览器实例的调试端口和用户数据目录，同一台机器上的多个浏览器互不干扰"""
+    if port:
+        co.set_local_port(port)
+    else:
+        co.auto_port()
+    if user_data_dir:
+        co.set_user_data_path(user_data_dir)
+
+def get_browser_pool():
+    """进程内共享的浏览器池"""
+    return browser_pool.get_pool(setup_driver)
+
+_browser_columns_ready = False
+
+@with_db_connection
+def record_browser_startup(conn, task_id, lease):
+    """
+    记录任务获取浏览器的耗时和复用保温浏览器节省的时间，显示在任务列表中
+    
+    Args:
+        task_id: 爬虫任务ID
+        lease: 浏览器池租用的槽位
+    """
+    global _browser_columns_ready
+    try:
+        cursor = conn.cursor()
+        if not _browser_columns_ready:
+            cursor.execute("""
+                ALTER TABLE crawl_task
+                ADD COLUMN IF NOT EXISTS browser_startup_ms INTEGER,
+                ADD COLUMN IF NOT EXISTS browser_startup_saved_ms INTEGER
+            """)
+        cursor.execute(
+            "UPDATE crawl_task SET browser_startup_ms = %s, browser_startup_saved_ms = %s WHERE id = %s",
+            (lease.startup_ms, lease.saved_ms, task_id)
+        )
+        conn.commit()
+        # 提交后才标记，UPDATE失败回滚时ALTER也被撤销，下次需要重新执行
+        _browser_columns_ready = True
+        logger.info(f"任务 {task_id} 获取浏览器耗时 {lease.startup_ms} ms，"
+                    f"{'复用保温浏览器，节省约 ' + str(lease.saved_ms) + ' ms' if lease.reused else '冷启动'}")
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"记录浏览器启动耗时失败: {str(e)}")
+
+@with_db_connection
+def ensure_ingest_schema(conn):
+    """爬取开始前检查并补齐房源入库需要的表结构（见 house_store.ensure_schema），DDL不放在入库事务中"""
+    house_store.ensure_schema(conn)
+
 def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
     """使用DrissionPage爬取指定城市的房源信息，可以从已有任务继续
     
@@ -1233,6 +1338,7 @@ def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
     
     try:
         logger.info(f"开始使用DrissionPage爬取 {city_name}({city_code}) 的房源信息，最大页数: {max_pages}")
+        ensure_ingest_schema()
         
         if task_id:
             # 如果提供了任务ID，则验证它是否存在
@@ -1261,8 +1367,19 @@ def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
             expected_items=max_pages * 30
         )
         
-        # 初始化浏览器
-        driver = setup_driver()
+        # 从浏览器池租用浏览器，多个城市并发爬取时各自使用独立的端口和用户数据目录；
+        # 同城市上一个任务留下的保温浏览器（含cookie和缓存）直接复用
+        pool = get_browser_pool()
+        lease = pool.acquire(city_code)
+        driver = lease.page
+        record_browser_startup(task_id, lease)
+        # 有页面失败（如验证码未通过）时不保留该浏览器会话
+        session_suspect = False
+        # 列表页优先走HTTP，复用浏览器会话的cookie；各方式的成功率和速度按任务统计
+        # 请求速率按抓取结果自适应调整（成功加速，验证码/错误/空页面减速）
+        throttle = listing_fetcher.create_throttle(driver, f"{city_code}.zu.ke.com", task_id)
+        fetcher = listing_fetcher.create_fetcher(driver, throttle)
+        fetch_stats = listing_fetcher.FetchStats(city_code)
         
         try:
             # 注册当前线程的WebDriver对象
@@ -1279,6 +1396,9 @@ def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
             crawled_pages = get_crawled_pages(task_id)
             logger.info(f"检测到已成功爬取的页面: {crawled_pages}" if crawled_pages else "未检测到已爬取页面，将从第1页开始爬取")
             
+            # 通过HTTP并发预取、尚未处理的页面 {页码: FetchResult}
+            prefetched = {}
+            
             for page in range(1, pages_to_crawl + 1):
                 # 如果页面已经成功爬取过，则跳过
                 if page in crawled_pages:
@@ -1288,6 +1408,22 @@ def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
                 page_url = f"{base_url}pg{page}/"
                 logger.info(f"开始爬取第 {page} 页: {page_url}")
                 
+                # 在令牌桶速率内并发预取接下来的几页，不再逐页固定等待
+                if page not in prefetched and fetcher is not None and fetcher.ready:
+                    window = [
+                        p for p in range(page, pages_to_crawl + 1) if p not in crawled_pages
+                    ][:crawl_engine.CONCURRENCY]
+                    prefetched.update(fetcher.fetch_many({p: f"{base_url}pg{p}/" for p in window}, referer=base_url))
+                
+                # 浏览器崩溃或失去响应时在原槽位重新启动
+                current_driver = pool.ensure_healthy(lease)
+                if current_driver is not driver:
+                    driver = current_driver
+                    register_driver(driver)
+                    # 新浏览器的代理和cookie都变了
+                    throttle = listing_fetcher.create_throttle(driver, f"{city_code}.zu.ke.com", task_id)
+                    fetcher = listing_fetcher.create_fetcher(driver, throttle)
+                
                 # 重试机制
                 retry_count = 0
                 success = False
@@ -1300,29 +1436,72 @@ def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
                         time.sleep(5 * retry_count)
                     
                     try:
-                        # 访问页面
-                        driver.get(page_url)
-                        time.sleep(random.uniform(2, 5))  # 随机等待
+                        strategy = "browser"
+                        fetch_start = time.perf_counter()
+                        success_count, total_count = 0, 0
+                        item_counts = None
                         
-                        # 检查是否出现验证码
-                        if is_captcha_page(driver):
-                            logger.warning(f"第 {page} 页出现验证码，开始处理")
-                            
-                            # 使用验证码代理系统处理验证码
-                            if handle_captcha_with_manager(driver, task_id, city_code, page_url):
-                                logger.info("验证码处理成功，继续爬取")
-                                # 重新加载页面
-                                driver.get(page_url)
-                                time.sleep(random.uniform(2, 5))
-                            else:
-                                raise Exception("验证码处理失败")
+                        # 优先用HTTP请求（带浏览器cookie）获取列表页，省去整页渲染和等待；
+                        # 预取的结果只用于第一次尝试，重试时重新请求
+                        result = prefetched.pop(page, None)
+                        if result is None and fetcher is not None and fetcher.ready:
+                            result = fetcher.fetch(page_url, referer=base_url)
+                        if result is not None:
+                            if result.ok:
+                                success_count, total_count, item_counts = process_house_items(
+                                    None, task_id, html=result.html, page_url=page_url
+                                )
+                                if success_count > 0:
+                                    strategy = "http"
+                                    fetcher.report_success()
+                                else:
+                                    fetcher.report_failure(page_url, "parse")
+                            fetch_stats.record(
+                                "http", success_count > 0, time.perf_counter() - fetch_start + result.seconds
+                            )
+                            fetch_start = time.perf_counter()
                         
-                        # 等待房源列表加载 (通过sleep替代WebDriverWait，因为DrissionPage没有WebDriverWait)
-                        time.sleep(3)
+                        # 没有可用的浏览器cookie、或HTTP遇到验证码/跳转/空页面时由浏览器加载
+                        if strategy == "browser":
+                            # 访问页面，与HTTP请求一样按当前速率取令牌
+                            throttle.wait()
+                            driver.get(page_url)
+                            # 等到房源列表或验证码出现，不再固定等待
+                            page_state = wait_for_listing_or_captcha(driver)
                         
-                        # 处理该页的所有房源
-                        success_count, total_count = process_house_items(driver, task_id)
-                        logger.info(f"第 {page} 页成功保存 {success_count}/{total_count} 个房源")
+                            # 检查是否出现验证码
+                            if page_state == "captcha" or (page_state is None and is_captcha_page(driver)):
+                                logger.warning(f"第 {page} 页出现验证码，开始处理")
+                                metrics.CAPTCHA_ENCOUNTERS.labels(city_code=city_code).inc()
+                                throttle.on_failure("captcha")
+                            
+                                # 使用验证码代理系统处理验证码
+                                captcha_solved = handle_captcha_with_manager(driver, task_id, city_code, page_url)
+                                metrics.CAPTCHA_SOLVES.labels(
+                                    city_code=city_code,
+                                    result="solved" if captcha_solved else "failed"
+                                ).inc()
+                                if captcha_solved:
+                                    logger.info("验证码处理成功，继续爬取")
+                                    # 重新加载页面
+                                    driver.get(page_url)
+                                    wait_for_listing_or_captcha(driver)
+                                else:
+                                    raise Exception("验证码处理失败")
+                        
+                            # 处理该页的所有房源
+                            success_count, total_count, item_counts = process_house_items(driver, task_id)
+                            fetch_stats.record("browser", success_count > 0, time.perf_counter() - fetch_start)
+                            if success_count > 0:
+                                throttle.on_success()
+                            else:
+                                throttle.on_failure("empty")
+                            # 浏览器可能刚通过验证，把最新的cookie交给HTTP会话
+                            if fetcher is not None and success_count > 0:
+                                fetcher.sync_from_browser(driver)
+                        logger.info(f"第 {page} 页通过{strategy}成功保存 {success_count}/{total_count} 个房源"
+                                    f"（新增 {item_counts['new']}，变化 {item_counts['changed']}，"
+                                    f"未变 {item_counts['unchanged']}）")
                         
                         # 标记为成功
                         success = success_count > 0
@@ -1346,6 +1525,8 @@ def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
                         
                     except Exception as e:
                         last_error = str(e)
+                        if strategy == "browser":
+                            fetch_stats.record("browser", False, time.perf_counter() - fetch_start)
                         logger.error(f"爬取第 {page} 页时出错 (尝试 {retry_count+1}/{MAX_RETRIES}): {last_error}")
                     
                     retry_count += 1
@@ -1357,14 +1538,19 @@ def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
                     page_url, 
                     success=success, 
                     retry_count=retry_count-1, 
-                    error_message=None if success else last_error
+                    error_message=None if success else last_error,
+                    item_counts=item_counts if success else None
                 )
+                metrics.CRAWLER_PAGES.labels(
+                    city_code=city_code,
+                    result="success" if success else "failed"
+                ).inc()
                 
+                pool.record_page(lease)
                 if not success:
+                    session_suspect = True
                     logger.error(f"第 {page} 页爬取失败，已达到最大重试次数 {MAX_RETRIES}")
                 
-                # 随机等待，避免被封
-                time.sleep(random.uniform(5, 10))
             
             logger.info(f"完成 {city_name} 的爬取任务，共计划爬取 {pages_to_crawl} 页")
             
@@ -1390,14 +1576,7 @@ def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
                     
                     # 爬虫任务完成后自动执行数据分析
                     logger.info(f"爬虫任务完成，准备执行数据分析...")
-                    # 在新线程中执行数据分析，避免阻塞主线程
-                    analysis_thread = threading.Thread(
-                        target=run_data_analysis,
-                        args=(task_id, city_name, city_code),
-                        daemon=True
-                    )
-                    analysis_thread.start()
-                    logger.info(f"数据分析任务已在后台启动")
+                    dispatch_data_analysis(task_id, city_name, city_code)
                 except Exception as e:
                     logger.error(f"计算爬取房源数时出错: {str(e)}")
                     update_crawl_task(task_id=task_id, status="Completed")
@@ -1424,11 +1603,15 @@ def crawl_city_with_selenium(city_name, city_code, max_pages=5, task_id=None):
                         error_message=f"部分页面爬取失败，已成功爬取 {len(successful_pages)}/{pages_to_crawl} 页"
                     )
             
+        except Exception:
+            session_suspect = True
+            raise
         finally:
-            # 关闭浏览器
             unregister_driver()
-            # 使用DrissionPage的关闭方法
-            driver.quit()
+            fetch_stats.log_summary()
+            throttle.log_summary()
+            # 归还浏览器池：正常结束时浏览器保温留给同城市的下一个任务
+            pool.release(lease, recycle=session_suspect)
             
     except Exception as e:
         logger.error(f"DrissionPage爬取过程中出现错误: {str(e)}")
@@ -1473,6 +1656,7 @@ def export_to_csv(houses, filename="rental_data.csv"):
         logger.warning("没有数据可导出")
         return False
     
+    import pandas as pd
     try:
         df = pd.DataFrame(houses)
         df.to_csv(filename, index=False, encoding='utf-8-sig')
@@ -1482,69 +1666,14 @@ def export_to_csv(houses, filename="rental_data.csv"):
         logger.error(f"导出数据失败: {str(e)}")
         return False
 
-def get_city_code(city_name):
-    """
-    根据城市名称获取城市代码
-    
-    Args:
-        city_name (str): 城市名称，如"北京"、"上海"等
-        
-    Returns:
-        str: 城市代码，如"bj"、"sh"等；如果城市不支持，返回None
-    """
-    cities = get_supported_cities()
-    return cities.get(city_name)
+# 城市列表已移到cities模块，这里保留原有的调用方式
+get_city_code = cities.get_city_code
+get_supported_cities = cities.get_supported_cities
 
-def get_supported_cities():
-    """获取支持的城市列表"""
-    return {
-        "北京": "bj",
-        "上海": "sh",
-        "广州": "gz",
-        "深圳": "sz",
-        "杭州": "hz",
-        "南京": "nj",
-        "成都": "cd",
-        "武汉": "wh",
-        "天津": "tj",
-        "西安": "xa",
-        "重庆": "cq",
-        "苏州": "su",
-        "郑州": "zz",
-        "长沙": "cs",
-        "合肥": "hf",
-        "宁波": "nb",
-        "青岛": "qd",
-        "大连": "dl",
-        "厦门": "xm",
-        "福州": "fz",
-        "济南": "jn",
-        "南昌": "nc",
-        "昆明": "km",
-        "沈阳": "sy",
-        "长春": "cc",
-        "哈尔滨": "hrb",
-        "石家庄": "sjz",
-        "太原": "ty",
-        "南宁": "nn",
-        "无锡": "wx",
-        "湖州": "huzhou",
-        "常州": "cz",
-        "嘉兴": "jx",
-        "海口": "hk",
-        "贵阳": "gy",
-        "三亚": "sanya",
-        "兰州": "lz",
-        "廊坊": "lf",
-        "保定": "bd",
-        "佛山": "fs",
-        "东莞": "dg",
-        "中山": "zs",
-        "珠海": "zh",
-        "湛江": "zhanjiang"
-    }
+_page_item_columns_ready = False
 
-def record_page_crawl(task_id, page_number, page_url, success=True, retry_count=0, error_message=None):
+def record_page_crawl(task_id, page_number, page_url, success=True, retry_count=0, error_message=None,
+                      item_counts=None):
     """记录页面爬取状态，用于断点续传
     
     Args:
@@ -1554,7 +1683,13 @@ def record_page_crawl(task_id, page_number, page_url, success=True, retry_count=
         success: 是否成功爬取
         retry_count: 重试次数
         error_message: 错误信息
+        item_counts: 该页房源按内容变化分类的数量 {"new", "changed", "unchanged"}
     """
+    global _page_item_columns_ready
+    item_counts = item_counts or {}
+    new_items = item_counts.get("new")
+    changed_items = item_counts.get("changed")
+    unchanged_items = item_counts.get("unchanged")
     if not connection_pool:
         logger.error("数据库连接池不可用，无法记录页面爬取状态")
         return False
@@ -1563,6 +1698,23 @@ def record_page_crawl(task_id, page_number, page_url, success=True, retry_count=
         conn = connection_pool.getconn()
         cursor = conn.cursor()
         
+        if not _page_item_columns_ready:
+            # 列已存在时不执行ALTER（即使IF NOT EXISTS也要取得表的排他锁）
+            cursor.execute("""
+                SELECT COUNT(*) FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'crawled_pages'
+                  AND column_name IN ('new_items', 'changed_items', 'unchanged_items')
+            """)
+            if cursor.fetchone()[0] < 3:
+                cursor.execute("""
+                    ALTER TABLE crawled_pages
+                    ADD COLUMN IF NOT EXISTS new_items INTEGER,
+                    ADD COLUMN IF NOT EXISTS changed_items INTEGER,
+                    ADD COLUMN IF NOT EXISTS unchanged_items INTEGER
+                """)
+            conn.commit()
+            _page_item_columns_ready = True
+        
         # 检查是否已有记录
         cursor.execute(
             "SELECT id FROM crawled_pages WHERE task_id = %s AND page_number = %s",
@@ -1577,23 +1729,37 @@ def record_page_crawl(task_id, page_number, page_url, success=True, retry_count=
             cursor.execute(
                 """
                 UPDATE crawled_pages 
-                SET success = %s, retry_count = %s, error_message = %s, crawl_time = %s 
+                SET success = %s, retry_count = %s, error_message = %s, crawl_time = %s,
+                    new_items = %s, changed_items = %s, unchanged_items = %s
                 WHERE task_id = %s AND page_number = %s
                 """,
-                (success, retry_count, error_message, current_time, task_id, page_number)
+                (success, retry_count, error_message, current_time,
+                 new_items, changed_items, unchanged_items, task_id, page_number)
             )
         else:
             # 插入新记录
             cursor.execute(
                 """
                 INSERT INTO crawled_pages 
-                (task_id, page_number, page_url, crawl_time, success, retry_count, error_message)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                (task_id, page_number, page_url, crawl_time, success, retry_count, error_message,
+                 new_items, changed_items, unchanged_items)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """,
-                (task_id, page_number, page_url, current_time, success, retry_count, error_message)
+                (task_id, page_number, page_url, current_time, success, retry_count, error_message,
+                 new_items, changed_items, unchanged_items)
             )
         
         conn.commit()
+        event_bus.publish_task(
+            task_id,
+            last_page=page_number,
+            last_page_success=success,
+            last_page_error=error_message,
+            last_page_time=current_time,
+            last_page_new_items=new_items,
+            last_page_changed_items=changed_items,
+            last_page_unchanged_items=unchanged_items
+        )
         return True
     except Exception as e:
         logger.error(f"记录页面爬取状态失败: {str(e)}")
@@ -1720,7 +1886,11 @@ def get_browser_dimensions():
         'height': BROWSER_WINDOW_HEIGHT
     }
 
-def acquire_crawler_lock(task_id, max_pages=5, lock_timeout_minutes=None):
+def crawler_lock_name(city_code=None):
+    """爬虫锁名称：每个城市一把锁，不同城市可以并发爬取；未指定城市时使用全局锁"""
+    return f"city:{city_code}" if city_code else "main_crawler_lock"
+
+def acquire_crawler_lock(task_id, max_pages=5, lock_timeout_minutes=None, city_code=None):
     """
     尝试获取爬虫锁，如果成功返回True，否则返回False
     
@@ -1728,6 +1898,7 @@ def acquire_crawler_lock(task_id, max_pages=5, lock_timeout_minutes=None):
         task_id: 爬虫任务ID
         max_pages: 计划爬取的最大页数，用于计算超时时间
         lock_timeout_minutes: 锁超时时间（分钟），如果不提供则根据页数动态计算
+        city_code: 城市代码，同一城市同时只能有一个爬虫任务
     
     Returns:
         bool: 是否成功获取锁
@@ -1770,10 +1941,17 @@ def acquire_crawler_lock(task_id, max_pages=5, lock_timeout_minutes=None):
         # 开始事务
         conn.autocommit = False
         
+        # 城市第一次爬取时创建该城市的锁记录
+        lock_name = crawler_lock_name(city_code)
+        cursor.execute(
+            "INSERT INTO crawler_lock (lock_name, is_locked) VALUES (%s, FALSE) ON CONFLICT (lock_name) DO NOTHING",
+            (lock_name,)
+        )
+        
         # 获取锁的当前状态（使用FOR UPDATE锁定行）
         cursor.execute(
             "SELECT is_locked, locked_by, locked_at, expires_at FROM crawler_lock WHERE lock_name = %s FOR UPDATE",
-            ('main_crawler_lock',)
+            (lock_name,)
         )
         lock_info = cursor.fetchone()
         
@@ -1789,7 +1967,7 @@ def acquire_crawler_lock(task_id, max_pages=5, lock_timeout_minutes=None):
         if is_locked and expires_at and current_time < expires_at:
             # 计算剩余时间
             remaining_minutes = (expires_at - current_time).total_seconds() / 60
-            logger.info(f"爬虫锁已被任务 {locked_by} 持有，剩余 {remaining_minutes:.1f} 分钟，获取失败")
+            logger.info(f"爬虫锁 {lock_name} 已被任务 {locked_by} 持有，剩余 {remaining_minutes:.1f} 分钟，获取失败")
             # 提交事务
             conn.commit()
             return False
@@ -1804,7 +1982,7 @@ def acquire_crawler_lock(task_id, max_pages=5, lock_timeout_minutes=None):
             SET is_locked = %s, locked_by = %s, locked_at = %s, expires_at = %s
             WHERE lock_name = %s
             """,
-            (True, task_id, current_time, expiration_time, 'main_crawler_lock')
+            (True, task_id, current_time, expiration_time, lock_name)
         )
         
         # 同时更新任务的预计结束时间
@@ -1819,7 +1997,7 @@ def acquire_crawler_lock(task_id, max_pages=5, lock_timeout_minutes=None):
         
         # 提交事务
         conn.commit()
-        logger.info(f"任务 {task_id} 成功获取爬虫锁，超时时间为 {lock_timeout_minutes} 分钟，过期时间 {expiration_time}")
+        logger.info(f"任务 {task_id} 成功获取爬虫锁 {lock_name}，超时时间为 {lock_timeout_minutes} 分钟，过期时间 {expiration_time}")
         return True
     except Exception as e:
         logger.error(f"获取爬虫锁失败: {str(e)}")
@@ -1831,12 +2009,13 @@ def acquire_crawler_lock(task_id, max_pages=5, lock_timeout_minutes=None):
             conn.autocommit = True
             connection_pool.putconn(conn)
 
-def release_crawler_lock(task_id):
+def release_crawler_lock(task_id, city_code=None):
     """
     释放爬虫锁，如果锁由当前任务持有
     
     Args:
         task_id: 爬虫任务ID
+        city_code: 城市代码，与获取锁时一致
     
     Returns:
         bool: 是否成功释放锁
@@ -1855,7 +2034,7 @@ def release_crawler_lock(task_id):
         # 获取锁的当前状态（使用FOR UPDATE锁定行）
         cursor.execute(
             "SELECT is_locked, locked_by FROM crawler_lock WHERE lock_name = %s FOR UPDATE",
-            ('main_crawler_lock',)
+            (crawler_lock_name(city_code),)
         )
         lock_info = cursor.fetchone()
         
@@ -1867,7 +2046,8 @@ def release_crawler_lock(task_id):
         is_locked, locked_by = lock_info
         
         # 检查锁是否由当前任务持有
-        if is_locked and locked_by == task_id:
+        # locked_by为字符串列，任务ID按字符串比较
+        if is_locked and locked_by == str(task_id):
             # 释放锁
             cursor.execute(
                 """
@@ -1875,16 +2055,13 @@ def release_crawler_lock(task_id):
                 SET is_locked = %s, locked_by = NULL, locked_at = NULL, expires_at = NULL
                 WHERE lock_name = %s
                 """,
-                (False, 'main_crawler_lock')
+                (False, crawler_lock_name(city_code))
             )
             
             # 提交事务
             conn.commit()
             logger.info(f"任务 {task_id} 成功释放爬虫锁")
             
-            # 尝试启动队列中的下一个任务
-            start_next_queued_task()
-            
             return True
         else:
             logger.warning(f"任务 {task_id} 尝试释放不属于它的锁")
@@ -1900,13 +2077,14 @@ def release_crawler_lock(task_id):
             conn.autocommit = True
             connection_pool.putconn(conn)
 
-def extend_crawler_lock(task_id, additional_minutes):
+def extend_crawler_lock(task_id, additional_minutes, city_code=None):
     """
     延长爬虫锁的超时时间
     
     Args:
         task_id: 爬虫任务ID
         additional_minutes: 要额外增加的分钟数
+        city_code: 城市代码，与获取锁时一致
     
     Returns:
         bool: 是否成功延长锁的超时时间
@@ -1925,7 +2103,7 @@ def extend_crawler_lock(task_id, additional_minutes):
         # 获取锁的当前状态（使用FOR UPDATE锁定行）
         cursor.execute(
             "SELECT is_locked, locked_by, expires_at FROM crawler_lock WHERE lock_name = %s FOR UPDATE",
-            ('main_crawler_lock',)
+            (crawler_lock_name(city_code),)
         )
         lock_info = cursor.fetchone()
         
@@ -1937,7 +2115,7 @@ def extend_crawler_lock(task_id, additional_minutes):
         is_locked, locked_by, current_expires_at = lock_info
         
         # 检查锁是否由当前任务持有
-        if is_locked and locked_by == task_id:
+        if is_locked and locked_by == str(task_id):
             # 计算新的过期时间
             if current_expires_at:
                 new_expires_at = current_expires_at + datetime.timedelta(minutes=additional_minutes)
@@ -1949,7 +2127,7 @@ def extend_crawler_lock(task_id, additional_minutes):
                     SET expires_at = %s
                     WHERE lock_name = %s
                     """,
-                    (new_expires_at, 'main_crawler_lock')
+                    (new_expires_at, crawler_lock_name(city_code))
                 )
                 
                 # 同时更新任务的预计结束时间
@@ -1984,10 +2162,13 @@ def extend_crawler_lock(task_id, additional_minutes):
             conn.autocommit = True
             connection_pool.putconn(conn)
 
-def is_crawler_locked():
+def is_crawler_locked(city_code=None):
     """
     检查爬虫锁是否被占用
     
+    Args:
+        city_code: 城市代码，为None时检查全局锁
+    
     Returns:
         tuple: (是否锁定, 锁定的任务ID) 如果未锁定则任务ID为None
     """
@@ -2001,13 +2182,13 @@ def is_crawler_locked():
         
         cursor.execute(
             "SELECT is_locked, locked_by, expires_at FROM crawler_lock WHERE lock_name = %s",
-            ('main_crawler_lock',)
+            (crawler_lock_name(city_code),)
         )
         lock_info = cursor.fetchone()
         
         if not lock_info:
-            logger.error("爬虫锁记录不存在")
-            return (True, None)
+            # 城市锁记录在第一次获取时才创建
+            return (False, None) if city_code else (True, None)
         
         is_locked, locked_by, expires_at = lock_info
         current_time = datetime.datetime.now()
@@ -2023,7 +2204,7 @@ def is_crawler_locked():
                 SET is_locked = %s, locked_by = NULL, locked_at = NULL, expires_at = NULL
                 WHERE lock_name = %s
                 """,
-                (False, 'main_crawler_lock')
+                (False, crawler_lock_name(city_code))
             )
             conn.commit()
             
@@ -2037,121 +2218,68 @@ def is_crawler_locked():
         if 'conn' in locals() and conn:
             connection_pool.putconn(conn)
 
-def queue_crawl_task(task_id):
+def queue_crawl_task(task_id, max_pages=None):
     """
     将爬虫任务添加到队列中等待执行
     
+    排队位置和jobs表中的crawl任务在同一个事务中写入，进程退出不会丢失排队的任务
+    
     Args:
         task_id: 爬虫任务ID
+        max_pages: 计划爬取页数，为None时沿用任务已有的计划页数
     
     Returns:
         bool: 是否成功添加到队列
     """
-    if not connection_pool:
-        logger.error("数据库连接池不可用，无法将任务添加到队列")
-        return False
-    
     try:
-        conn = connection_pool.getconn()
-        cursor = conn.cursor()
-        
-        # 获取当前最大队列位置
-        cursor.execute("SELECT MAX(queue_position) FROM crawl_task WHERE status = 'Queued'")
-        max_position = cursor.fetchone()[0]
-        
-        if max_position is None:
-            max_position = 0
-        
-        next_position = max_position + 1
-        
-        # 更新任务状态为队列中
-        cursor.execute(
-            """
-            UPDATE crawl_task
-            SET status = %s, queue_position = %s
-            WHERE id = %s
-            """,
-            ('Queued', next_position, task_id)
-        )
-        
-        conn.commit()
-        logger.info(f"任务 {task_id} 已添加到队列，位置 {next_position}")
+        task_dispatch.queue_crawl(task_id, max_pages)
         return True
     except Exception as e:
         logger.error(f"将任务添加到队列失败: {str(e)}")
         return False
-    finally:
-        if 'conn' in locals() and conn:
-            connection_pool.putconn(conn)
 
-def start_next_queued_task():
+def run_crawl_job(job):
     """
-    启动队列中的下一个爬虫任务
+    执行jobs队列中的crawl任务
     
-    Returns:
-        bool: 是否成功启动下一个任务
-    """
-    if not connection_pool:
-        logger.error("数据库连接池不可用，无法启动下一个任务")
-        return False
+    同一城市已在爬取（城市爬虫锁被占用）时抛出RetryLater稍后重试；爬取未全部完成时抛出异常，
+    由队列按退避策略重试，重试时已成功的页面会通过断点续传跳过
     
+    Args:
+        job: job_queue.claim返回的任务
+    """
+    task_id = job["payload"]["task_id"]
+    conn = connection_pool.getconn()
     try:
-        # 检查锁是否可用
-        is_locked, _ = is_crawler_locked()
-        if is_locked:
-            logger.info("爬虫锁仍在使用中，无法启动下一个任务")
-            return False
-        
-        conn = connection_pool.getconn()
         cursor = conn.cursor()
-        
-        # 获取队列中的下一个任务
-        cursor.execute(
-            """
-            SELECT id, city, city_code
-            FROM crawl_task
-            WHERE status = 'Queued'
-            ORDER BY queue_position ASC
-            LIMIT 1
-            """
-        )
-        next_task = cursor.fetchone()
-        
-        if not next_task:
-            logger.info("队列中没有等待的任务")
-            return False
-        
-        task_id, city, city_code = next_task
-        logger.info(f"准备启动队列中的下一个任务: {task_id} - {city}")
-        
-        # 更新任务状态为进行中
         cursor.execute(
             """
             UPDATE crawl_task
-            SET status = %s, queue_position = 0
+            SET status = 'In Progress', queue_position = 0
             WHERE id = %s
+            RETURNING city, city_code, COALESCE(planned_pages, total_pages, 5)
             """,
-            ('In Progress', task_id)
+            (task_id,)
         )
+        task = cursor.fetchone()
         conn.commit()
-        
-        # 启动爬虫任务（异步方式）
-        import threading
-        thread = threading.Thread(
-            target=start_queued_crawler_task, 
-            args=(task_id, city, city_code),
-            daemon=True
-        )
-        thread.start()
-        
-        logger.info(f"已启动队列中的下一个任务: {task_id}")
-        return True
-    except Exception as e:
-        logger.error(f"启动下一个任务失败: {str(e)}")
-        return False
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        if 'conn' in locals() and conn:
-            connection_pool.putconn(conn)
+        connection_pool.putconn(conn)
+    
+    if not task:
+        logger.warning(f"队列中的爬虫任务 {task_id} 已不存在，跳过")
+        return
+    
+    city, city_code, max_pages = task
+    status = start_queued_crawler_task(task_id, city, city_code, max_pages)
+    if status == "locked":
+        update_crawl_task(task_id, "Queued")
+        raise job_queue.RetryLater(CRAWL_LOCK_RETRY_SECONDS, f"城市 {city_code} 的爬虫锁被占用")
+    if status != "Completed":
+        raise Exception(f"爬虫任务 {task_id} 未完成，状态: {status}")
 
 def start_queued_crawler_task(task_id, city, city_code, max_pages=5):
     """
@@ -2162,43 +2290,26 @@ def start_queued_crawler_task(task_id, city, city_code, max_pages=5):
         city: 城市名称
         city_code: 城市代码
         max_pages: 最大爬取页数
+    
+    Returns:
+        str: 任务结束时crawl_task的状态，无法获取爬虫锁时返回 locked
     """
     try:
         logger.info(f"开始执行队列中的任务: {task_id} - {city}")
         
-        # 获取爬虫锁
-        if not acquire_crawler_lock(task_id, max_pages):
-            logger.error(f"无法获取爬虫锁，取消执行任务 {task_id}")
-            return
+        # 获取该城市的爬虫锁，同一城市已在爬取时由调用方决定何时重试
+        if not acquire_crawler_lock(task_id, max_pages, city_code=city_code):
+            logger.warning(f"无法获取爬虫锁，任务 {task_id} 稍后重试")
+            return "locked"
         
         try:
-            # 执行爬虫任务
+            # 执行爬虫任务，全部页面成功后crawl_city_with_selenium会触发数据分析
             crawl_city_with_selenium(city, city_code, max_pages, task_id)
-            
-            # 任务完成后，检查状态并执行数据分析
-            conn = connection_pool.getconn()
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT status FROM crawl_task WHERE id = %s",
-                (task_id,)
-            )
-            task_status = cursor.fetchone()
-            connection_pool.putconn(conn)
-            
-            if task_status and task_status[0] == "Completed":
-                logger.info(f"队列任务 {task_id} 已完成，启动数据分析...")
-                # 在新线程中执行数据分析，避免阻塞主线程
-                analysis_thread = threading.Thread(
-                    target=run_data_analysis,
-                    args=(task_id, city, city_code),
-                    daemon=True
-                )
-                analysis_thread.start()
-                logger.info(f"数据分析任务已在后台启动")
         finally:
             # 确保任务完成后释放锁
-            release_crawler_lock(task_id)
-            
+            release_crawler_lock(task_id, city_code=city_code)
+        
+        return get_crawl_task_status(task_id)
     except Exception as e:
         logger.error(f"执行队列中的任务时出错: {str(e)}")
         try:
@@ -2208,11 +2319,36 @@ def start_queued_crawler_task(task_id, city, city_code, max_pages=5):
         
         # 确保无论如何都释放锁
         try:
-            release_crawler_lock(task_id)
+            release_crawler_lock(task_id, city_code=city_code)
         except:
             pass
+        return "Failed"
+
+def get_crawl_task_status(task_id):
+    """查询爬虫任务当前状态"""
+    conn = connection_pool.getconn()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status FROM crawl_task WHERE id = %s", (task_id,))
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    finally:
+        connection_pool.putconn(conn)
 
 # 添加一个处理单个房源的函数，用于多线程调用
+def assign_house_id(house_info):
+    """为房源信息生成唯一的house_id（优先从URL中提取）"""
+    if house_info.get('url'):
+        house_info['house_id'] = get_house_id_from_url(house_info['url'])
+    else:
+        logger.warning(f"房源信息中不包含URL")
+        # 生成一个随机ID
+        import uuid
+        house_info['house_id'] = f"RAND{str(uuid.uuid4())[:20]}"
+        logger.info(f"生成随机house_id: {house_info['house_id']}")
+    return house_info
+
 def process_single_house(house_item, city_code, task_id, index, total):
     """
     处理单个房源项目，不直接保存数据库
@@ -2235,20 +2371,8 @@ def process_single_house(house_item, city_code, task_id, index, total):
         if house_info:
             logger.info(f"成功提取房源信息: {house_info.get('title', '无标题')}")
             
-            # 生成唯一的house_id (如果URL中包含)
-            if house_info.get('url'):
-                house_id = get_house_id_from_url(house_info['url'])
-                logger.info(f"从URL提取的house_id: {house_id}")
-                house_info['house_id'] = house_id
-            else:
-                logger.warning(f"房源信息中不包含URL")
-                # 生成一个随机ID
-                import uuid
-                house_info['house_id'] = f"RAND{str(uuid.uuid4())[:20]}"
-                logger.info(f"生成随机house_id: {house_info['house_id']}")
-            
             # 返回处理好的房源信息，不立即保存
-            return house_info
+            return assign_house_id(house_info)
         else:
             logger.warning(f"房源信息提取失败，跳过此项")
             return None
@@ -2256,63 +2380,67 @@ def process_single_house(house_item, city_code, task_id, index, total):
         logger.error(f"处理第 {index+1} 个房源时出错: {str(item_err)}")
         return None
 
-def process_house_items(driver, task_id):
+def process_house_items(driver, task_id, html=None, page_url=None):
     """
     处理页面上的房源项目，提取房源信息并保存到数据库
     
     Args:
-        driver: DrissionPage对象
+        driver: DrissionPage对象，提供html时可以为None
         task_id: 任务ID
+        html: 已通过HTTP获取的页面HTML，提供时直接解析，不读取浏览器
+        page_url: html对应的页面地址
     
     Returns:
-        tuple: (成功保存的房源数, 总房源数)
+        tuple: (成功保存的房源数, 总房源数, 按内容变化分类的数量 {"new", "changed", "unchanged"})
     """
+    item_counts = {"new": 0, "changed": 0, "unchanged": 0}
     try:
         # 获取城市代码，从URL中提取
-        current_url = driver.url
+        current_url = page_url or driver.url
         city_code = current_url.split(".")[0].split("//")[1]
         logger.info(f"当前页面URL: {current_url}, 提取城市代码: {city_code}")
         
-        # 获取所有房源元素
-        house_items = driver.eles('css:div.content__list--item')
-        logger.info(f"在页面上找到 {len(house_items)} 个房源项目")
-        
-        # 如果没有找到房源，直接返回
-        if len(house_items) == 0:
-            logger.warning("页面上没有找到任何房源项目，可能是被反爬虫拦截了！请更换IP后重试")
-            return 0, 0
-        
-        # 使用线程池并行处理房源信息提取
-        max_workers = min(10, len(house_items))  # 设置最大线程数，避免创建过多线程
-        logger.info(f"创建线程池，最大线程数: {max_workers}")
-        
-        # 初始化房源信息集合
-        valid_house_info_list = []
-        
-        # 使用线程池执行器并行处理房源
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有房源处理任务
-            future_to_house = {
-                executor.submit(
-                    process_single_house, 
-                    house_item, 
-                    city_code, 
-                    task_id, 
-                    i, 
-                    len(house_items)
-                ): i for i, house_item in enumerate(house_items)
-            }
-            
-            # 收集结果
-            for future in concurrent.futures.as_completed(future_to_house):
-                house_index = future_to_house[future]
-                try:
-                    house_info = future.result()
-                    if house_info:
-                        # 收集有效的房源信息
-                        valid_house_info_list.append(house_info)
-                except Exception as e:
-                    logger.error(f"处理房源 {house_index+1} 时发生异常: {str(e)}")
+        # 取一次整页HTML在进程内解析，避免每个字段一次CDP往返
+        valid_house_info_list = None
+        if html is not None or LISTING_PARSE_MODE == "snapshot":
+            try:
+                parse_start = time.perf_counter()
+                houses, total_items, parse_errors = listing_parser.parse_listing_page(
+                    html if html is not None else driver.html, city_code, task_id, base_url=current_url
+                )
+                parse_seconds = time.perf_counter() - parse_start
+                metrics.LISTING_PARSE_SECONDS.labels(mode="snapshot").observe(parse_seconds)
+                for error in parse_errors:
+                    logger.warning(f"解析房源失败，跳过此项: {error}")
+                if total_items:
+                    valid_house_info_list = [assign_house_id(house) for house in houses]
+                    logger.info(f"页面快照解析出 {len(houses)}/{total_items} 个房源，耗时 {parse_seconds * 1000:.1f} ms")
+            except Exception as e:
+                logger.warning(f"页面快照解析失败，改为逐个元素提取: {str(e)}")
+        
+        if valid_house_info_list is None and html is not None:
+            # HTTP取得的页面不在浏览器中，无法逐个元素提取，由调用方改用浏览器加载
+            return 0, 0, item_counts
+        
+        if valid_house_info_list is None:
+            # 后备方式：通过DrissionPage逐个元素提取，所有调用共用同一个浏览器连接，串行执行
+            house_items = driver.eles('css:div.content__list--item')
+            total_items = len(house_items)
+            logger.info(f"在页面上找到 {total_items} 个房源项目")
+            
+            # 如果没有找到房源，直接返回
+            if total_items == 0:
+                logger.warning("页面上没有找到任何房源项目，可能是被反爬虫拦截了！请更换IP后重试")
+                return 0, 0, item_counts
+            
+            parse_start = time.perf_counter()
+            valid_house_info_list = [
+                house_info for house_info in (
+                    process_single_house(house_item, city_code, task_id, i, total_items)
+                    for i, house_item in enumerate(house_items)
+                ) if house_info
+            ]
+            metrics.LISTING_PARSE_SECONDS.labels(mode="cdp").observe(time.perf_counter() - parse_start)
         
         # 对收集到的房源信息进行批量保存
         logger.info(f"开始批量保存 {len(valid_house_info_list)} 个房源信息")
@@ -2322,18 +2450,32 @@ def process_house_items(driver, task_id):
             save_result = batch_save_house_info(valid_house_info_list)
             success_count = save_result['success']
             failed_count = save_result['failed']
+            metrics.CRAWLER_ITEMS_SAVED.labels(city_code=city_code).inc(success_count)
+            metrics.CRAWLER_ITEMS_FAILED.labels(city_code=city_code).inc(failed_count)
+            item_counts = {
+                "new": save_result.get('inserted', 0),
+                "changed": save_result.get('updated', 0),
+                "unchanged": save_result.get('unchanged', 0),
+            }
+            for change, count in item_counts.items():
+                metrics.CRAWLER_ITEMS_CHANGES.labels(city_code=city_code, change=change).inc(count)
+            
+            # 新插入房源的缩略图交给后台预取，避免用户首次打开房源列表时集中回源
+            if save_result.get('new_images'):
+                image_cache.prefetch_images(task_id, save_result['new_images'], connection_pool)
         else:
             success_count = 0
             failed_count = 0
         
-        logger.info(f"页面处理完成，成功保存: {success_count}, 失败: {failed_count}, 总数: {len(house_items)}")
-        return success_count, len(house_items)
+        logger.info(f"页面处理完成，成功保存: {success_count}（新增 {item_counts['new']}，变化 {item_counts['changed']}，"
+                    f"未变 {item_counts['unchanged']}）, 失败: {failed_count}, 总数: {total_items}")
+        return success_count, total_items, item_counts
     
     except Exception as e:
         logger.error(f"处理房源列表时出错: {str(e)}")
         import traceback
         logger.error(f"详细错误: {traceback.format_exc()}")
-        return 0, 0
+        return 0, 0, item_counts
 
 # 在爬取完成后添加更详细的统计代码，放在process_house_items后面调用
 def get_crawl_statistics(task_id):
@@ -2381,239 +2523,101 @@ def get_crawl_statistics(task_id):
                 logger.error(f"归还数据库连接时出错: {str(conn_err)}")
                 # 连接归还错误不应影响函数返回
 
+def build_house_row(house_info, now):
+    """把提取到的房源信息转换为house_info表的一行（键见 house_store.HOUSE_COLUMNS）"""
+    # 确保有house_id
+    if 'house_id' not in house_info or not house_info['house_id']:
+        house_info['house_id'] = get_house_id_from_url(house_info['url'])
+        if not house_info['house_id']:
+            import hashlib
+            house_info['house_id'] = "HASH" + hashlib.md5(house_info['url'].encode()).hexdigest()[:20]
+    
+    # 解析户型字段，提取房间、厅和卫生间数量
+    layout_str = house_info.get('layout', '')
+    room_description, room_count, hall_count, bath_count = parse_layout_to_components(layout_str)
+    
+    # 计算单价
+    unit_price = 0
+    try:
+        price = float(house_info.get('price', 0))
+        area = float(house_info.get('area', 0))
+        if price > 0 and area > 0:
+            unit_price = round(price / area, 2)
+    except (ValueError, TypeError):
+        logger.warning(f"计算单价失败: price={house_info.get('price')}, area={house_info.get('area')}")
+    
+    row = {
+        "house_id": house_info['house_id'],
+        "task_id": house_info.get('task_id'),
+        "link": house_info['url'],
+        "title": house_info['title'],
+        "price": house_info['price'],
+        "layout": house_info['layout'],
+        "size": house_info['area'],
+        "floor": house_info['floor'],
+        "direction": house_info['direction'],
+        "subway": house_info['subway'],
+        "location_qu": house_info['district'],
+        "location_big": house_info['community'],
+        "city_code": house_info['city_code'],
+        "publish_date": house_info['publish_date'],
+        "features": json.dumps(house_info['features'], ensure_ascii=False),
+        "image": house_info.get('image_url', ''),
+        "room": room_description,
+        "room_count": room_count,
+        "hall_count": hall_count,
+        "bath_count": bath_count,
+        "unit_price": unit_price,
+        "created_at": now,
+        "last_updated": now,
+        "content_hash": None,
+        "last_seen": now,
+    }
+    row["content_hash"] = house_store.content_hash(row)
+    return row
+
 @with_db_connection
 def batch_save_house_info(conn, house_info_list):
-    """批量保存多个房源信息到数据库，减少数据库连接次数
+    """批量保存多个房源信息到数据库，一页房源用一条多行upsert语句写入（见 house_store）
     
     Args:
         conn: 数据库连接
         house_info_list: 房源信息列表
         
     Returns:
-        dict: 包含成功和失败的房源数量
+        dict: 成功(success，其中新增inserted、内容变化updated、内容未变unchanged)和失败(failed)的房源数量，
+              追加的价格历史行数(price_changes)，以及新插入房源的图片URL列表(new_images)
     """
     if not house_info_list:
         logger.warning("没有房源信息可保存")
-        return {"success": 0, "failed": 0}
+        return {"success": 0, "failed": 0, "inserted": 0, "updated": 0, "unchanged": 0, "price_changes": 0,
+                "new_images": []}
     
-    try:
-        cursor = conn.cursor()
-        success_count = 0
-        failed_count = 0
-        
-        # 开始事务
+    rows = []
+    failed_count = 0
+    now = datetime.datetime.now()
+    for house_info in house_info_list:
         try:
-            conn.autocommit = False
+            rows.append(build_house_row(house_info, now))
         except Exception as e:
-            logger.warning(f"设置autocommit=False失败: {str(e)}，将尝试继续执行")
-        
-        # 为每个房源生成house_id并尝试保存
-        for house_info in house_info_list:
-            try:
-                # 确保有house_id
-                if 'house_id' not in house_info or not house_info['house_id']:
-                    house_info['house_id'] = get_house_id_from_url(house_info['url'])
-                    if not house_info['house_id']:
-                        import hashlib
-                        house_info['house_id'] = "HASH" + hashlib.md5(house_info['url'].encode()).hexdigest()[:20]
-                
-                # 解析户型字段，提取房间、厅和卫生间数量
-                layout_str = house_info.get('layout', '')
-                room_description, room_count, hall_count, bath_count = parse_layout_to_components(layout_str)
-                
-                # 计算单价
-                unit_price = 0
-                try:
-                    price = float(house_info.get('price', 0))
-                    area = float(house_info.get('area', 0))
-                    if price > 0 and area > 0:
-                        unit_price = round(price / area, 2)
-                except (ValueError, TypeError):
-                    logger.warning(f"计算单价失败: price={house_info.get('price')}, area={house_info.get('area')}")
-                
-                # 检查是否已存在相同的house_id
-                cursor.execute(
-                    "SELECT id FROM house_info WHERE house_id = %s",
-                    (house_info['house_id'],)
-                )
-                existing_by_id = cursor.fetchone()
-                
-                if existing_by_id:
-                    # 更新已存在的记录
-                    cursor.execute("""
-                    UPDATE house_info SET
-                        title = %s,
-                        price = %s,
-                        layout = %s,
-                        size = %s,
-                        floor = %s,
-                        direction = %s,
-                        subway = %s,
-                        location_qu = %s,
-                        location_big = %s,
-                        publish_date = %s,
-                        features = %s,
-                        image = %s,
-                        link = %s,
-                        city_code = %s,
-                        room = %s,
-                        room_count = %s,
-                        hall_count = %s,
-                        bath_count = %s,
-                        unit_price = %s,
-                        last_updated = %s
-                    WHERE house_id = %s
-                    """, (
-                        house_info['title'],
-                        house_info['price'],
-                        house_info['layout'],
-                        house_info['area'],
-                        house_info['floor'],
-                        house_info['direction'],
-                        house_info['subway'],
-                        house_info['district'],
-                        house_info['community'],
-                        house_info['publish_date'],
-                        json.dumps(house_info['features'], ensure_ascii=False),
-                        house_info.get('image_url', ''),
-                        house_info['url'],
-                        house_info['city_code'],
-                        room_description,
-                        room_count,
-                        hall_count,
-                        bath_count,
-                        unit_price,
-                        datetime.datetime.now(),
-                        house_info['house_id']
-                    ))
-                    success_count += 1
-                else:
-                    # 检查是否已存在相同的URL和城市代码
-                    cursor.execute(
-                        "SELECT id FROM house_info WHERE link = %s AND city_code = %s",
-                        (house_info['url'], house_info['city_code'])
-                    )
-                    existing_by_url = cursor.fetchone()
-                    
-                    if existing_by_url:
-                        # 更新已存在记录
-                        cursor.execute("""
-                        UPDATE house_info SET
-                            title = %s,
-                            price = %s,
-                            layout = %s,
-                            size = %s,
-                            floor = %s,
-                            direction = %s,
-                            subway = %s,
-                            location_qu = %s,
-                            location_big = %s,
-                            publish_date = %s,
-                            features = %s,
-                            image = %s,
-                            house_id = %s,
-                            room = %s,
-                            room_count = %s,
-                            hall_count = %s,
-                            bath_count = %s,
-                            unit_price = %s,
-                            last_updated = %s
-                        WHERE link = %s AND city_code = %s
-                        """, (
-                            house_info['title'],
-                            house_info['price'],
-                            house_info['layout'],
-                            house_info['area'],
-                            house_info['floor'],
-                            house_info['direction'],
-                            house_info['subway'],
-                            house_info['district'],
-                            house_info['community'],
-                            house_info['publish_date'],
-                            json.dumps(house_info['features'], ensure_ascii=False),
-                            house_info.get('image_url', ''),
-                            house_info['house_id'],
-                            room_description,
-                            room_count,
-                            hall_count,
-                            bath_count,
-                            unit_price,
-                            datetime.datetime.now(),
-                            house_info['url'],
-                            house_info['city_code']
-                        ))
-                        success_count += 1
-                    else:
-                        # 插入新记录
-                        cursor.execute("""
-                        INSERT INTO house_info (
-                            link, title, price, layout, size, floor, direction,
-                            subway, location_qu, location_big, city_code, publish_date, 
-                            features, image, created_at, last_updated, task_id, house_id,
-                            room, room_count, hall_count, bath_count, unit_price
-                        ) VALUES (
-                            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                            %s, %s, %s, %s, %s
-                        )
-                        """, (
-                            house_info['url'],
-                            house_info['title'],
-                            house_info['price'],
-                            house_info['layout'],
-                            house_info['area'],
-                            house_info['floor'],
-                            house_info['direction'],
-                            house_info['subway'],
-                            house_info['district'],
-                            house_info['community'],
-                            house_info['city_code'],
-                            house_info['publish_date'],
-                            json.dumps(house_info['features'], ensure_ascii=False),
-                            house_info.get('image_url', ''),
-                            datetime.datetime.now(),
-                            datetime.datetime.now(),
-                            house_info.get('task_id'),
-                            house_info['house_id'],
-                            room_description,
-                            room_count,
-                            hall_count,
-                            bath_count,
-                            unit_price
-                        ))
-                        success_count += 1
-            except Exception as e:
-                logger.error(f"保存房源 {house_info.get('house_id', '未知')} 失败: {str(e)}")
-                failed_count += 1
-                # 继续处理下一个房源，而不是整体失败
-                continue
-        
-        # 所有操作成功，提交事务
-        try:
-            conn.commit()
-            logger.info(f"批量保存房源完成，成功: {success_count}，失败: {failed_count}")
-        except Exception as commit_err:
-            logger.error(f"提交事务失败: {str(commit_err)}")
-            try:
-                conn.rollback()
-            except:
-                pass
-            return {"success": 0, "failed": len(house_info_list)}
-            
-        return {"success": success_count, "failed": failed_count}
+            logger.error(f"保存房源 {house_info.get('house_id', '未知')} 失败: {str(e)}")
+            failed_count += 1
+    
+    if not rows:
+        return {"success": 0, "failed": failed_count, "inserted": 0, "updated": 0, "unchanged": 0, "price_changes": 0,
+                "new_images": []}
     
+    try:
+        result = house_store.upsert_house_rows(conn, rows)
     except Exception as e:
         logger.error(f"批量保存房源失败: {str(e)}")
-        try:
-            conn.rollback()
-        except Exception as rollback_err:
-            logger.error(f"回滚事务失败: {str(rollback_err)}")
-        return {"success": 0, "failed": len(house_info_list)}
-    finally:
-        # 确保恢复autocommit状态
-        try:
-            conn.autocommit = True
-        except Exception as ac_err:
-            logger.warning(f"恢复autocommit状态失败: {str(ac_err)}")
+        return {"success": 0, "failed": len(house_info_list), "inserted": 0, "updated": 0, "unchanged": 0,
+                "price_changes": 0, "new_images": []}
+    
+    result["failed"] += failed_count
+    logger.info(f"批量保存房源完成，新增: {result['inserted']}，变化: {result['updated']}，"
+                f"未变: {result['unchanged']}，价格变化: {result['price_changes']}，失败: {result['failed']}")
+    return result
 
 def run_data_analysis(task_id, city, city_code):
     """
@@ -2626,36 +2630,31 @@ def run_data_analysis(task_id, city, city_code):
     """
     try:
         logger.info(f"爬虫任务 {task_id} 完成，开始执行数据分析...")
-        
-        # 创建RentalDataProcessor实例
-        processor = data_processor.RentalDataProcessor()
-        
-        try:
-            # 加载当前任务的数据
-            logger.info(f"正在加载任务 {task_id} 的数据...")
-            df = processor.load_data_from_db(city=city, task_id=task_id)
-            
-            if df:
-                # 执行所有分析
-                logger.info(f"开始为城市 {city} 执行数据分析...")
-                processor.run_all_analysis(df, city=city)
-                logger.info(f"数据分析完成，结果已保存到数据库")
-            else:
-                logger.warning(f"未找到任务 {task_id} 的有效数据，跳过分析")
-        finally:
-            # 确保关闭Spark会话
-            processor.close()
-            
+        data_processor.run_city_analysis(city=city, task_id=task_id, trigger="crawl")
     except Exception as e:
+        # 失败事件和详细错误已由run_city_analysis记录
         logger.error(f"执行数据分析时出错: {str(e)}")
-        import traceback
-        logger.error(f"详细错误: {traceback.format_exc()}")
+
+def dispatch_data_analysis(task_id, city, city_code):
+    """
+    爬取完成后提交数据分析任务，由分析worker执行，爬虫进程不加载PySpark
+
+    同一城市还有排队中的分析时合并为一次，连续爬取不会各自触发一次全量分析
+    """
+    result = task_dispatch.enqueue_analysis(city, task_id=task_id, trigger="crawl")
+    if result["coalesced"]:
+        logger.info(f"城市 {city} 已有排队中的分析任务 {result['job_id']}，本次分析请求已合并")
+    else:
+        logger.info(f"已提交数据分析任务 {result['job_id']}，排队位置 {result['queue_position']}")
 
 # 如果直接运行此文件，则初始化验证管理器
 if __name__ == '__main__':
     # 初始化验证管理器
     verification_manager.init()
     
+    # 独立运行时可以用 kill -USR2 <pid> 采样
+    sampling_profiler.install_signal_handler()
+    
     # 检查是否有未完成的任务
     try:
         conn = connection_pool.getconn()
@@ -2672,12 +2671,6 @@ if __name__ == '__main__':
         )
         unfinished_tasks = cursor.fetchall()
         
-        # 检查爬虫锁状态
-        is_locked, locked_task_id = is_crawler_locked()
-        if is_locked:
-            print("\n⚠️ 警告: 爬虫正在运行中，任务ID:", locked_task_id)
-            print("新任务将被添加到队列中等待执行")
-        
         if unfinished_tasks:
             print("\n===== 检测到未完成的爬取任务 =====")
             print("ID\t城市\t城市代码\t开始时间\t\t\t状态")
@@ -2719,19 +2712,19 @@ if __name__ == '__main__':
                         print(f"继续爬取 {city}({city_code}) 的租房信息，最大页数: {max_pages}")
                         
                         # 检查爬虫锁状态
-                        is_locked, locked_task_id = is_crawler_locked()
-                        if is_locked and locked_task_id != task_id:
+                        is_locked, locked_task_id = is_crawler_locked(city_code)
+                        if is_locked and locked_task_id != str(task_id):
                             print(f"\n⚠️ 爬虫正在运行中，任务将被添加到队列等待执行")
                             update_crawl_task(task_id, "Queued")
-                            queue_crawl_task(task_id)
+                            queue_crawl_task(task_id, max_pages)
                             print(f"任务 {task_id} 已添加到队列，当前爬虫完成后将自动执行")
                         else:
                             # 开始爬取
-                            if is_locked and locked_task_id == task_id:
+                            if is_locked and locked_task_id == str(task_id):
                                 print(f"当前任务已经在执行中")
                             else:
                                 # 获取爬虫锁
-                                if acquire_crawler_lock(task_id, max_pages):
+                                if acquire_crawler_lock(task_id, max_pages, city_code=city_code):
                                     try:
                                         # 开始爬取
                                         task_id = crawl_city_with_selenium(city, city_code, max_pages, task_id)
@@ -2761,12 +2754,12 @@ if __name__ == '__main__':
                                             print("数据分析完成")
                                     finally:
                                         # 确保释放锁
-                                        release_crawler_lock(task_id)
+                                        release_crawler_lock(task_id, city_code=city_code)
                                 else:
                                     print("无法获取爬虫锁，可能另一个爬虫正在运行")
                                     # 将任务添加到队列
                                     update_crawl_task(task_id, "Queued")
-                                    queue_crawl_task(task_id)
+                                    queue_crawl_task(task_id, max_pages)
                                     print(f"任务 {task_id} 已添加到队列，当前爬虫完成后将自动执行")
                         
                         exit(0)
@@ -2812,15 +2805,15 @@ if __name__ == '__main__':
     
     if task_id:
         # 检查爬虫锁状态
-        is_locked, locked_task_id = is_crawler_locked()
+        is_locked, locked_task_id = is_crawler_locked(city_code)
         if is_locked:
             print(f"\n⚠️ 爬虫正在运行中，任务将被添加到队列等待执行")
             update_crawl_task(task_id, "Queued")
-            queue_crawl_task(task_id)
+            queue_crawl_task(task_id, max_pages)
             print(f"任务 {task_id} 已添加到队列，当前爬虫完成后将自动执行")
         else:
             # 获取爬虫锁
-            if acquire_crawler_lock(task_id, max_pages):
+            if acquire_crawler_lock(task_id, max_pages, city_code=city_code):
                 try:
                     # 开始爬取
                     task_id = crawl_city_with_selenium(city_name, city_code, max_pages, task_id)
@@ -2847,4 +2840,4 @@ if __name__ == '__main__':
                             print("数据分析完成")
                 finally:
                     # 确保释放锁
-                    release_crawler_lock(task_id)
\ No newline at end of file
+                    release_crawler_lock(task_id, city_code=city_code)
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""
+慢查询日志
+超过阈值的SQL（API和爬虫连接池）按指纹去重汇总，记录归一化SQL、参数形态、耗时，
+并在首次出现时通过 EXPLAIN (ANALYZE off) 采集执行计划。
+汇总保存在内存中（有上限），每次出现同时追加到 logs/slow_queries.log
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from psycopg2 import extensions
+
+import sql_timing
+
+# 确保logs目录存在
+logs_dir = "logs"
+if not os.path.exists(logs_dir):
+    os.makedirs(logs_dir)
+
+logger = logging.getLogger("slow_query_log")
+
+# 每次慢查询一行JSON，不写入其他日志
+slow_logger = logging.getLogger("slow_queries")
+slow_logger.setLevel(logging.INFO)
+slow_logger.propagate = False
+if not slow_logger.handlers:
+    _slow_handler = logging.FileHandler(os.path.join(logs_dir, "slow_queries.log"), encoding="utf-8")
+    _slow_handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_logger.addHandler(_slow_handler)
+
+# 慢查询阈值（毫秒），小于等于0时关闭
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+# 内存中最多保留的指纹数，超过后淘汰最久未出现的
+SLOW_QUERY_MAX_ENTRIES = int(os.getenv("SLOW_QUERY_MAX_ENTRIES", "200"))
+# 同一指纹的执行计划多久重新采集一次（秒）
+PLAN_REFRESH_SECONDS = 3600
+# 保存的SQL最大长度
+MAX_SQL_LENGTH = 4000
+
+# 可以EXPLAIN的语句
+_EXPLAINABLE = ("select", "insert", "update", "delete", "with", "values")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+# 采集执行计划时执行的EXPLAIN本身不应再触发慢查询记录
+_local = threading.local()
+
+
+def normalize_sql(sql):
+    """归一化SQL：字面量和占位符替换为?，IN列表合并，空白压缩"""
+    text = _STRING_LITERAL.sub("?", sql)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER_LITERAL.sub("?", text)
+    text = _IN_LIST.sub("(?...)", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def fingerprint(normalized_sql):
+    """归一化SQL的指纹"""
+    return hashlib.sha1(normalized_sql.lower().encode("utf-8")).hexdigest()[:16]
+
+
+def _value_shape(value):
+    if value is None:
+        return "null"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, dict):
+        return f"dict[{len(value)}]"
+    return type(value).__name__
+
+
+def param_shape(params):
+    """参数形态：只记录类型和长度，不记录取值，避免把密码等敏感数据写入日志"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {str(k): _value_shape(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [_value_shape(v) for v in params]
+    return _value_shape(params)
+
+
+def _application_name(connection):
+    try:
+        return connection.get_dsn_parameters().get("application_name")
+    except Exception:
+        return None
+
+
+def _capture_plan(cursor):
+    """
+    对刚执行的语句采集执行计划
+
+    使用cursor.query（已绑定参数的最终SQL）。连接处于事务中时在保存点内执行，
+    不影响调用方的事务；事务已出错时不采集
+    """
+    query = cursor.query
+    if not query:
+        return None
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", errors="replace")
+    if not query.lstrip().lower().startswith(_EXPLAINABLE):
+        return None
+
+    connection = cursor.connection
+    status = connection.get_transaction_status()
+    if status == extensions.TRANSACTION_STATUS_INERROR or connection.closed:
+        return None
+    in_transaction = status == extensions.TRANSACTION_STATUS_INTRANS and not connection.autocommit
+
+    explain_cursor = connection.cursor()
+    try:
+        if in_transaction:
+            explain_cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            explain_cursor.execute("EXPLAIN (ANALYZE off, VERBOSE off, COSTS on) " + query)
+            plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+            if in_transaction:
+                explain_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            return plan
+        except Exception as e:
+            if in_transaction:
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                explain_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            return f"执行计划采集失败: {str(e)}"
+    finally:
+        explain_cursor.close()
+        # 原本不在事务中时，EXPLAIN隐式开启的事务需要结束
+        if status == extensions.TRANSACTION_STATUS_IDLE and not connection.autocommit:
+            connection.rollback()
+
+
+def _on_statement(cursor, query, params, duration):
+    if SLOW_QUERY_THRESHOLD_MS <= 0 or duration * 1000 < SLOW_QUERY_THRESHOLD_MS:
+        return
+    if getattr(_local, "capturing", False):
+        return
+
+    sql = sql_timing.statement_text(cursor, query)[:MAX_SQL_LENGTH]
+    normalized = normalize_sql(sql)
+    fp = fingerprint(normalized)
+    duration_ms = round(duration * 1000, 1)
+    now = time.time()
+    source = _application_name(cursor.connection)
+    shape = param_shape(params)
+
+    with _lock:
+        entry = _entries.pop(fp, None)
+        if entry is None:
+            entry = {
+                "fingerprint": fp,
+                "normalized_sql": normalized,
+                "sql": sql,
+                "param_shape": shape,
+                "sources": [],
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "first_seen": now,
+                "plan": None,
+                "plan_captured_at": None,
+            }
+        entry["count"] += 1
+        entry["total_ms"] = round(entry["total_ms"] + duration_ms, 1)
+        entry["max_ms"] = max(entry["max_ms"], duration_ms)
+        entry["last_ms"] = duration_ms
+        entry["last_seen"] = now
+        entry["param_shape"] = shape
+        if source and source not in entry["sources"]:
+            entry["sources"].append(source)
+        need_plan = entry["plan_captured_at"] is None or now - entry["plan_captured_at"] > PLAN_REFRESH_SECONDS
+        if need_plan:
+            # 先占位，避免并发的同类查询重复采集
+            entry["plan_captured_at"] = now
+        _entries[fp] = entry
+        while len(_entries) > SLOW_QUERY_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+    plan = None
+    if need_plan:
+        _local.capturing = True
+        try:
+            plan = _capture_plan(cursor)
+        except Exception as e:
+            plan = f"执行计划采集失败: {str(e)}"
+        finally:
+            _local.capturing = False
+        with _lock:
+            if fp in _entries:
+                _entries[fp]["plan"] = plan
+
+    slow_logger.info(json.dumps({
+        "time": datetime.datetime.fromtimestamp(now).isoformat(timespec="milliseconds"),
+        "fingerprint": fp,
+        "duration_ms": duration_ms,
+        "source": source,
+        "normalized_sql": normalized,
+        "param_shape": shape,
+        "plan": plan,
+    }, ensure_ascii=False))
+
+
+def _summary(entry, include_plan=False):
+    item = dict(entry)
+    item["sources"] = list(entry["sources"])
+    item["avg_ms"] = round(entry["total_ms"] / entry["count"], 1) if entry["count"] else 0
+    for key in ("first_seen", "last_seen", "plan_captured_at"):
+        if item.get(key):
+            item[key] = datetime.datetime.fromtimestamp(item[key]).isoformat(timespec="seconds")
+    if not include_plan:
+        item.pop("plan", None)
+        item["has_plan"] = bool(entry.get("plan"))
+    return item
+
+
+def list_entries(sort_by="total_ms", limit=50):
+    """按指定字段倒序列出慢查询汇总（不含执行计划）"""
+    with _lock:
+        entries = [_summary(entry) for entry in _entries.values()]
+    if sort_by not in ("total_ms", "max_ms", "count", "last_seen", "avg_ms"):
+        sort_by = "total_ms"
+    entries.sort(key=lambda item: item.get(sort_by) or 0, reverse=True)
+    return entries[:limit]
+
+
+def get_entry(fp):
+    """获取单个指纹的详情（含执行计划），不存在时返回None"""
+    with _lock:
+        entry = _entries.get(fp)
+        return _summary(entry, include_plan=True) if entry else None
+
+
+def clear():
+    """清空内存中的汇总"""
+    with _lock:
+        _entries.clear()
+
+
+sql_timing.add_statement_hook(_on_statement)
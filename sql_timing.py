@@ -0,0 +1,210 @@
+"""
+SQL执行计时
+通过psycopg2的connection_factory为连接池中的连接包装计时游标，
+在每个API请求的上下文中累计查询次数、数据库总耗时和最慢的语句，
+由中间件输出到Server-Timing响应头和结构化访问日志
+"""
+import os
+import json
+import time
+import logging
+import datetime
+import contextvars
+import psycopg2
+import psycopg2.extensions
+
+# 确保logs目录存在
+logs_dir = "logs"
+if not os.path.exists(logs_dir):
+    os.makedirs(logs_dir)
+
+# 访问日志单独写入 access.log，每行一个JSON对象
+access_logger = logging.getLogger("access")
+access_logger.setLevel(logging.INFO)
+access_logger.propagate = False
+if not access_logger.handlers:
+    _access_handler = logging.FileHandler(os.path.join(logs_dir, "access.log"), encoding="utf-8")
+    _access_handler.setFormatter(logging.Formatter("%(message)s"))
+    access_logger.addHandler(_access_handler)
+
+logger = logging.getLogger("sql_timing")
+
+# 访问日志中最慢语句保留的最大长度
+MAX_STATEMENT_LENGTH = 500
+
+# 语句执行完成后的回调，签名为 hook(cursor, query, params, duration_seconds)，
+# query为传给execute的原始对象，需要文本时调用 statement_text
+_statement_hooks = []
+
+
+class RequestStats:
+    """单个请求的SQL统计"""
+
+    __slots__ = ("query_count", "db_time", "slowest_time", "slowest_sql")
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_sql = None
+
+    def record(self, sql, duration):
+        self.query_count += 1
+        self.db_time += duration
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_sql = sql
+
+
+_current_stats = contextvars.ContextVar("sql_request_stats", default=None)
+
+
+def current_stats():
+    """获取当前请求的SQL统计，不在请求上下文中时返回None"""
+    return _current_stats.get()
+
+
+def add_statement_hook(hook):
+    """注册语句执行完成后的回调"""
+    _statement_hooks.append(hook)
+
+
+def statement_text(cursor, sql):
+    """把execute收到的查询对象转换为文本"""
+    if isinstance(sql, bytes):
+        return sql.decode("utf-8", errors="replace")
+    if isinstance(sql, str):
+        return sql
+    # psycopg2.sql.Composed 等对象
+    try:
+        return sql.as_string(cursor)
+    except Exception:
+        return str(sql)
+
+
+def _record(cursor, sql, params, duration):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement_text(cursor, sql), duration)
+    for hook in _statement_hooks:
+        try:
+            hook(cursor, sql, params, duration)
+        except Exception as e:
+            logger.error(f"SQL计时回调执行失败: {str(e)}")
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(base):
+    """为任意游标类生成计时子类，按基类缓存"""
+    cls = _timed_cursor_classes.get(base)
+    if cls is not None:
+        return cls
+
+    class TimedCursor(base):
+        def execute(self, query, vars=None):
+            start = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                _record(self, query, vars, time.perf_counter() - start)
+
+        def executemany(self, query, vars_list):
+            start = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                _record(self, query, None, time.perf_counter() - start)
+
+        def callproc(self, procname, parameters=None):
+            start = time.perf_counter()
+            try:
+                return super().callproc(procname, parameters)
+            finally:
+                _record(self, f"CALL {procname}", parameters, time.perf_counter() - start)
+
+    TimedCursor.__name__ = f"Timed{base.__name__}"
+    TimedCursor.__qualname__ = TimedCursor.__name__
+    _timed_cursor_classes[base] = TimedCursor
+    return TimedCursor
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """创建的所有游标都会记录执行耗时的连接类，用作连接池的connection_factory"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop("cursor_factory", None) or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+def _format_server_timing(stats, total_seconds):
+    parts = [
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.query_count} queries"',
+        f"app;dur={total_seconds * 1000:.1f}",
+    ]
+    if stats.slowest_sql is not None:
+        parts.append(f"db-slowest;dur={stats.slowest_time * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class SQLTimingMiddleware:
+    """
+    为每个请求建立SQL统计上下文
+
+    响应头 Server-Timing 中给出截至响应开始时的数据库耗时和查询次数，
+    请求结束后把完整统计写入 logs/access.log
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((
+                    b"server-timing",
+                    _format_server_timing(stats, time.perf_counter() - start).encode("latin-1"),
+                ))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_stats.reset(token)
+            self._log_access(scope, stats, status_holder["status"], time.perf_counter() - start)
+
+    @staticmethod
+    def _log_access(scope, stats, status, duration):
+        try:
+            client = scope.get("client")
+            slowest_sql = stats.slowest_sql
+            if slowest_sql is not None:
+                slowest_sql = " ".join(slowest_sql.split())[:MAX_STATEMENT_LENGTH]
+            access_logger.info(json.dumps({
+                "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                "method": scope.get("method"),
+                "path": scope.get("path"),
+                "status": status,
+                "duration_ms": round(duration * 1000, 1),
+                "db_queries": stats.query_count,
+                "db_time_ms": round(stats.db_time * 1000, 1),
+                "db_slowest_ms": round(stats.slowest_time * 1000, 1),
+                "db_slowest_sql": slowest_sql,
+                "client": client[0] if client else None,
+            }, ensure_ascii=False))
+        except Exception as e:
+            logger.error(f"写入访问日志失败: {str(e)}")
@@ -0,0 +1,373 @@
+"""
+任务分发
+决定爬虫和数据分析在哪个进程中执行：
+
+- inline（默认）：API进程内的worker线程认领jobs队列中的任务执行，适合单进程部署
+- database：API只把任务写入jobs队列（见job_queue），由 crawler_worker.py 和 analysis_worker.py 认领执行，
+  各角色可以独立扩缩容和重启，爬取和分析不再占用API进程的CPU和内存
+
+两种模式下排队的爬虫任务都保存在jobs表中，进程重启后不会丢失
+
+角色分离时worker产生的进度事件通过PostgreSQL的 NOTIFY 转发到API进程的事件总线，
+前端的SSE推送不受影响
+"""
+import os
+import json
+import socket
+import select
+import logging
+import datetime
+import threading
+import psycopg2
+
+import db_config
+import event_bus
+import job_queue
+import browser_pool
+from lazy_loader import lazy_import
+
+spider = lazy_import("selenium_spider")
+data_processor = lazy_import("data_processor")
+
+# 确保logs目录存在
+logs_dir = "logs"
+if not os.path.exists(logs_dir):
+    os.makedirs(logs_dir)
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(logs_dir, "task_dispatch.log"), encoding="utf-8"),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger("task_dispatch")
+
+# 分发模式：inline 或 database
+TASK_DISPATCH = os.getenv("TASK_DISPATCH", "inline").strip().lower()
+# 进度事件的NOTIFY通道
+EVENT_CHANNEL = "rental_events"
+# NOTIFY负载上限为8000字节，留出余量
+MAX_NOTIFY_PAYLOAD = 7900
+# 单进程部署时API进程检查排队爬虫任务的间隔（秒）
+INLINE_POLL_INTERVAL = float(os.getenv("INLINE_CRAWL_POLL_INTERVAL", "30"))
+# 单进程部署时API进程检查排队分析任务的间隔（秒），用户在页面上等待结果，间隔较短
+INLINE_ANALYSIS_POLL_INTERVAL = float(os.getenv("INLINE_ANALYSIS_POLL_INTERVAL", "2"))
+# 分析任务的可见性超时（秒），Spark分析耗时较长，默认比其他任务宽松
+ANALYSIS_VISIBILITY_TIMEOUT = int(os.getenv("ANALYSIS_VISIBILITY_TIMEOUT", "600"))
+# 分析任务优先级：页面上手动发起的分析先于爬取完成和定时触发的分析
+ANALYSIS_PRIORITY = {"manual": 10, "crawl": 0, "schedule": 0}
+# 合并分析请求时的负载：触发来源取优先级较高的一方；
+# 两次请求针对不同的爬虫任务（或其中一方是整个城市）时扩大为分析整个城市
+ANALYSIS_MERGE_PAYLOAD = """
+    jsonb_build_object(
+        'city', EXCLUDED.payload->'city',
+        'task_id', CASE WHEN jobs.payload->'task_id' = EXCLUDED.payload->'task_id'
+                        THEN EXCLUDED.payload->'task_id' ELSE 'null'::jsonb END,
+        'trigger', CASE WHEN EXCLUDED.priority > jobs.priority
+                        THEN EXCLUDED.payload->'trigger' ELSE jobs.payload->'trigger' END,
+        'requested_by', COALESCE(EXCLUDED.payload->'requested_by', jobs.payload->'requested_by'),
+        'coalesced', jobs.payload->'coalesced'
+    )
+"""
+
+# 任务分发专用的数据库连接池
+connection_pool = db_config.LazyPool(
+    lambda: db_config.create_pool(
+        min_conn=1,
+        max_conn=5,
+        application_name="task_dispatch"
+    ),
+    "任务分发"
+)
+
+
+def is_inline():
+    """是否在当前进程内直接执行爬取和分析"""
+    return TASK_DISPATCH != "database"
+
+
+def worker_name(role):
+    """worker标识：角色@主机名:进程号"""
+    return f"{role}@{socket.gethostname()}:{os.getpid()}"
+
+
+# ---------------------------------------------------------------------------
+# 爬虫任务
+# ---------------------------------------------------------------------------
+
+def queue_crawl_in_transaction(cursor, task_id, max_pages=None):
+    """
+    在调用方的事务中把爬虫任务放入队列，由调用方提交并发布进度事件
+
+    排队位置在事务级咨询锁内分配，并发排队不会得到相同的位置
+
+    Returns:
+        tuple: (排队位置, 计划页数, job ID)
+    """
+    # 调用方可能使用RealDictCursor，在同一连接（同一事务）上另开普通游标
+    cursor = cursor.connection.cursor()
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('crawl_task_queue'))")
+    cursor.execute(
+        """
+        UPDATE crawl_task
+        SET status = 'Queued',
+            planned_pages = COALESCE(%s, planned_pages),
+            total_pages = COALESCE(%s, total_pages),
+            queue_position = COALESCE(
+                (SELECT MAX(queue_position) FROM crawl_task WHERE status = 'Queued'), 0
+            ) + 1
+        WHERE id = %s
+        RETURNING queue_position, planned_pages
+        """,
+        (max_pages, max_pages, task_id)
+    )
+    row = cursor.fetchone()
+    if not row:
+        raise ValueError(f"爬虫任务 {task_id} 不存在")
+    queue_position, planned_pages = row
+    job_id = job_queue.enqueue("crawl", {"task_id": task_id}, cursor=cursor)["id"]
+    return queue_position, planned_pages, job_id
+
+
+def queue_crawl(task_id, max_pages=None):
+    """
+    把爬虫任务放入队列
+
+    crawl_task的状态、排队位置和jobs中的crawl任务在同一个事务中写入
+
+    Args:
+        task_id: 爬虫任务ID
+        max_pages: 计划爬取页数，为None时沿用任务已有的计划页数
+
+    Returns:
+        int: 排队位置
+    """
+    job_queue.ensure_schema()
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        queue_position, planned_pages, job_id = queue_crawl_in_transaction(cursor, task_id, max_pages)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+    logger.info(f"爬虫任务 {task_id} 已进入队列（job {job_id}），位置 {queue_position}")
+    event_bus.publish_task(task_id, status="Queued", queue_position=queue_position, total_pages=planned_pages)
+    return queue_position
+
+
+def dispatch_crawl(task_id, max_pages):
+    """
+    执行已创建的爬虫任务：两种模式都写入jobs队列，inline模式下由API进程内的爬虫线程
+    （start_inline_workers）认领，与定时任务一样经过城市爬虫锁和浏览器池并发限制，
+    进程重启后排队中和执行中的任务会被重新认领
+
+    Args:
+        task_id: start_crawl_task创建的任务ID
+        max_pages: 计划爬取页数
+
+    Returns:
+        int: 排队位置
+    """
+    return queue_crawl(task_id, max_pages)
+
+
+def _start_inline_worker(kinds, handlers, stop_event, index=0, **options):
+    thread = threading.Thread(
+        target=job_queue.run_worker,
+        args=(kinds, handlers, f"{worker_name('inline')}-{kinds[0]}-{index}", stop_event),
+        kwargs=options,
+        name=f"inline-{kinds[0]}-worker-{index}",
+        daemon=True
+    )
+    thread.start()
+
+
+def start_inline_workers():
+    """
+    单进程部署时在API进程中认领jobs表里的爬虫和分析任务
+    （包括命令行提交的任务和进程重启前未执行的任务）
+
+    爬虫和分析模块只在认领到任务后才导入，不影响API启动速度；
+    分析单独一个线程，同一时间只执行一个分析
+
+    Returns:
+        threading.Event: 设置后worker在当前任务结束后退出
+    """
+    stop_event = threading.Event()
+    # 每个浏览器池槽位一个爬虫线程，不同城市并发爬取
+    for index in range(browser_pool.POOL_SIZE):
+        _start_inline_worker(["crawl"], {"crawl": lambda job: spider.run_crawl_job(job)}, stop_event,
+                             index=index, poll_interval=INLINE_POLL_INTERVAL)
+    _start_inline_worker(["analysis", "maintenance"],
+                         {"analysis": run_analysis_job, "maintenance": run_maintenance_job}, stop_event,
+                         poll_interval=INLINE_ANALYSIS_POLL_INTERVAL,
+                         visibility_timeout=ANALYSIS_VISIBILITY_TIMEOUT)
+    return stop_event
+
+
+# ---------------------------------------------------------------------------
+# 分析请求
+# ---------------------------------------------------------------------------
+
+def analysis_dedupe_key(city):
+    """分析任务的合并键：同一城市排队中的分析请求合并为一次"""
+    return f"city:{city or '*'}"
+
+
+def enqueue_analysis(city=None, task_id=None, trigger="manual", requested_by=None):
+    """
+    提交分析任务，同一城市已有排队中的分析时合并到该任务
+
+    Returns:
+        dict: {"job_id", "coalesced", "queue_position"}
+    """
+    city = city or None
+    result = job_queue.enqueue(
+        "analysis",
+        {"city": city, "task_id": task_id, "trigger": trigger, "requested_by": requested_by},
+        priority=ANALYSIS_PRIORITY.get(trigger, 0),
+        dedupe_key=analysis_dedupe_key(city),
+        merge_payload=ANALYSIS_MERGE_PAYLOAD,
+    )
+    job_id = result["id"]
+    position = job_queue.queue_position(job_id)
+    if result["coalesced"]:
+        logger.info(f"城市 {city} 的分析请求已合并到排队中的任务 {job_id}，触发来源: {trigger}，排队位置 {position}")
+    else:
+        logger.info(f"已提交分析任务 {job_id}，城市: {city}, 任务ID: {task_id}, 触发来源: {trigger}，排队位置 {position}")
+    event_bus.publish_analysis(city, status="queued", phase=None, task_id=task_id, trigger=trigger,
+                               job_id=job_id, queue_position=position, error="")
+    return {"job_id": job_id, "coalesced": result["coalesced"], "queue_position": position}
+
+
+def count_pending_analysis():
+    """排队中和执行中的分析任务数"""
+    counts = job_queue.count_jobs("analysis")
+    return {"pending": counts["queued"], "running": counts["running"]}
+
+
+def list_analysis_queue(city=None):
+    """排队中和执行中的分析任务及排队位置，city为None时返回全部"""
+    dedupe_key = analysis_dedupe_key(city) if city else None
+    return [
+        {
+            "job_id": job["id"],
+            "status": job["status"],
+            "queue_position": job["queue_position"],
+            "priority": job["priority"],
+            "city": job["payload"].get("city"),
+            "task_id": job["payload"].get("task_id"),
+            "trigger": job["payload"].get("trigger"),
+            "coalesced": job["payload"].get("coalesced", 0),
+            "created_at": job["created_at"],
+            "started_at": job["started_at"] if job["status"] == "running" else None,
+        }
+        for job in job_queue.list_queue("analysis", dedupe_key)
+    ]
+
+
+def run_analysis_job(job):
+    """执行analysis任务，失败时异常交给队列按退避策略重试"""
+    payload = job["payload"]
+    data_processor.run_city_analysis(
+        city=payload.get("city"),
+        task_id=payload.get("task_id"),
+        trigger=payload.get("trigger", "manual")
+    )
+
+
+def run_maintenance_job(job):
+    """执行maintenance任务"""
+    payload = job["payload"]
+    action = payload.get("action")
+    if action == "purge_jobs":
+        job_queue.purge_finished(payload.get("days", 30))
+    else:
+        raise ValueError(f"未知的维护任务: {action}")
+
+
+# ---------------------------------------------------------------------------
+# 进度事件跨进程转发
+# ---------------------------------------------------------------------------
+
+def _json_default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _forward_event(event):
+    payload = json.dumps(
+        {"event": event["event"], "key": event["key"], "data": event["data"]},
+        ensure_ascii=False,
+        default=_json_default,
+    )
+    if len(payload.encode("utf-8")) > MAX_NOTIFY_PAYLOAD:
+        logger.warning(f"事件 {event['key']} 超过NOTIFY长度限制，未转发")
+        return
+    conn = db_config.get_connection(connection_pool)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_notify(%s, %s)", (EVENT_CHANNEL, payload))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"转发事件 {event['key']} 失败: {str(e)}")
+    finally:
+        db_config.release_connection(connection_pool, conn)
+
+
+def install_event_forwarder():
+    """worker进程调用：本进程发布的进度事件通过NOTIFY发送给API进程"""
+    event_bus.bus.add_listener(_forward_event)
+    logger.info(f"进度事件将通过通道 {EVENT_CHANNEL} 转发给API进程")
+
+
+def _listen_loop(stop_event):
+    backoff = 1
+    while not stop_event.is_set():
+        conn = None
+        try:
+            params = db_config.DB_PARAMS.copy()
+            params["application_name"] = "rental_event_listener"
+            conn = psycopg2.connect(**params)
+            conn.set_session(autocommit=True)
+            conn.cursor().execute(f"LISTEN {EVENT_CHANNEL}")
+            logger.info(f"开始监听进度事件通道 {EVENT_CHANNEL}")
+            backoff = 1
+            while not stop_event.is_set():
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        message = json.loads(notify.payload)
+                        event_bus.bus.publish(message["event"], message["key"], message["data"])
+                    except Exception as e:
+                        logger.error(f"处理进度事件失败: {str(e)}")
+        except Exception as e:
+            logger.error(f"进度事件监听连接断开: {str(e)}，{backoff} 秒后重连")
+            stop_event.wait(backoff)
+            backoff = min(backoff * 2, 60)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+def start_event_listener():
+    """API进程调用：接收worker转发的进度事件并发布到本进程的事件总线"""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_listen_loop, args=(stop_event,), name="event-listener", daemon=True)
+    thread.start()
+    return stop_event
@@ -41,17 +41,15 @@ VERIFICATION_STATUS = {
 COOKIES_DIR = "verification_cookies"
 os.makedirs(COOKIES_DIR, exist_ok=True)
 
-# 创建验证管理器专用的数据库连接池
-try:
-    verification_pool = db_config.create_pool(
+# 验证管理器专用的数据库连接池，第一次使用时才建立连接
+verification_pool = db_config.LazyPool(
+    lambda: db_config.create_pool(
         min_conn=1, 
         max_conn=5, 
         application_name="verification_manager"
-    )
-    logger.info("验证管理器数据库连接池创建成功")
-except Exception as e:
-    logger.error(f"验证管理器数据库连接池创建失败: {str(e)}")
-    verification_pool = None
+    ),
+    "验证管理器"
+)
 
 # 创建装饰器实例
 with_db_connection = db_utils.with_db_connection(verification_pool)